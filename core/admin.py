@@ -249,3 +249,22 @@ class SavedSearchAdmin(admin.ModelAdmin):
 @admin.register(DocumentReview)
 class DocumentReviewAdmin(admin.ModelAdmin):
     pass
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'search_log', 'status', 'rows_written', 'created', 'finished')
+    list_filter = ('status',)
+
+
+@admin.register(GeneSet)
+class GeneSetAdmin(admin.ModelAdmin):
+    list_display = ('name', 'user', 'created', 'modified')
+    search_fields = ('name', 'description')
+    readonly_fields = ('checksum',)
+
+
+@admin.register(APIToken)
+class APITokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'name', 'created', 'last_used')
+    search_fields = ('user__username', 'name')
@@ -0,0 +1,62 @@
+"""
+Catalogs of all values of a field of a dataset's index, for fields with too many values to list in the filter
+form, e.g. gene symbols or transcripts. A catalog is read once with composite aggregations, kept per process and
+searched by prefix, so the browser only ever receives a page of matching values.
+"""
+import bisect
+import json
+import threading
+
+from natsort import natsorted
+
+from common.utils import import_from_settings
+from core.utils import (SearchResultCache, get_es_client,
+                        get_index_generation, iterate_field_values)
+
+CATALOG_SEARCH_LIMIT = 50
+MAX_CATALOG_SEARCH_LIMIT = 1000
+
+value_catalog_cache = SearchResultCache(import_from_settings('VALUE_CATALOG_CACHE_SIZE', 64),
+                                        import_from_settings('VALUE_CATALOG_CACHE_TTL', 24 * 60 * 60))
+# one request reads a missing catalog, the others wait for it instead of reading it too
+catalog_lock = threading.Lock()
+
+
+class ValueCatalog:
+    """The non empty values of a field, natural sorted, with a case insensitive prefix index."""
+
+    def __init__(self, values):
+        self.values = natsorted(value for value in values if value)
+        order = sorted(range(len(self.values)), key=lambda idx: str(self.values[idx]).lower())
+        self.search_keys = [str(self.values[idx]).lower() for idx in order]
+        self.search_values = [self.values[idx] for idx in order]
+
+    def __len__(self):
+        return len(self.values)
+
+    def search(self, prefix='', offset=0, limit=CATALOG_SEARCH_LIMIT):
+        """(values starting with prefix, ignoring case, from offset on, number of values matching prefix)."""
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.search_keys, prefix)
+        end = bisect.bisect_left(self.search_keys, prefix + '\U0010ffff')
+        return self.search_values[start + offset:min(end, start + offset + limit)], end - start
+
+
+def get_value_catalog(dataset_obj, field_es_name, field_path):
+    """
+    Catalog of a field of the dataset. Catalogs are cached per dataset, field and index generation, so one is
+    read again once the index is reloaded or its documents change.
+    """
+    key = json.dumps(['catalog', dataset_obj.id, field_path or '', field_es_name, get_index_generation(dataset_obj)])
+    catalog = value_catalog_cache.get(key)
+    if catalog is not None:
+        return catalog
+
+    with catalog_lock:
+        catalog = value_catalog_cache.get(key)
+        if catalog is None:
+            es = get_es_client(dataset_obj)
+            catalog = ValueCatalog(iterate_field_values(es, dataset_obj.es_index_name, field_es_name, field_path))
+            value_catalog_cache.set(key, catalog)
+
+    return catalog
@@ -0,0 +1,227 @@
+"""
+Parquet files of search results with the column types of the index mapping, see core.exports.
+pyarrow is only needed for these export formats.
+
+The mapping does not tell whether a numeric or boolean field holds one value or a list of them (e.g. AF and AC
+of multi-allelic sites), so the exported documents are counted first and fields with more than one value in any
+of them are written as list columns.
+"""
+import itertools
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from core.utils import get_es_client
+
+# rows per parquet row group, the rows of one group are held in memory while it is written
+ROW_GROUP_SIZE = 50000
+
+ARROW_TYPE_NAMES = {
+    'long': 'int64',
+    'integer': 'int64',
+    'short': 'int64',
+    'byte': 'int64',
+    'double': 'float64',
+    'float': 'float64',
+    'half_float': 'float64',
+    'scaled_float': 'float64',
+    'boolean': 'bool_',
+}
+
+
+def get_es_field_types(dataset_obj):
+    """Elasticsearch type of every field of the index mapping, keyed on (path, es_name); path is '' outside nested fields."""
+    es = get_es_client(dataset_obj)
+    properties = es.indices.get_mapping(index=dataset_obj.es_index_name)[dataset_obj.es_index_name]['mappings']['properties']
+
+    field_types = {}
+    for es_name, field_properties in properties.items():
+        if 'properties' in field_properties:
+            for nested_es_name, nested_properties in field_properties['properties'].items():
+                field_types[(es_name, nested_es_name)] = nested_properties.get('type', 'keyword')
+        else:
+            field_types[('', es_name)] = field_properties.get('type', 'keyword')
+
+    return field_types
+
+
+def get_multi_valued_fields(download_obj, field_types):
+    """
+    (path, es_name) of the numeric and boolean attributes of download_obj that hold more than one value in any of
+    the documents it exports, from one aggregation of their maximum number of values.
+    """
+    fields = [(ele.path or '', ele.es_name) for ele in download_obj.header
+              if field_types.get((ele.path or '', ele.es_name)) in ARROW_TYPE_NAMES]
+    if not fields:
+        return set()
+
+    aggs = {}
+    for idx, (path, es_name) in enumerate(fields):
+        agg = {"max": {"script": {
+            "source": "doc[params.field].size()",
+            "params": {"field": '%s.%s' % (path, es_name) if path else es_name},
+        }}}
+        if path:
+            agg = {"nested": {"path": path}, "aggs": {"values": agg}}
+        aggs[str(idx)] = agg
+
+    query_body = download_obj.get_query_body()
+    body = {"size": 0, "aggs": aggs}
+    if 'query' in query_body:
+        body['query'] = query_body['query']
+    dataset_obj = download_obj.search_log_obj.dataset
+    response = get_es_client(dataset_obj).search(index=dataset_obj.es_index_name, body=body, request_timeout=600)
+
+    multi_valued_fields = set()
+    for idx, field in enumerate(fields):
+        agg = response['aggregations'][str(idx)]
+        if field[0]:
+            agg = agg['values']
+        if (agg.get('value') or 0) > 1:
+            multi_valued_fields.add(field)
+    return multi_valued_fields
+
+
+def single_value(value):
+    if isinstance(value, list):
+        return value[0] if len(value) == 1 else None
+    return value
+
+
+def to_int(value):
+    try:
+        return int(single_value(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_float(value):
+    try:
+        return float(single_value(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def to_bool(value):
+    value = single_value(value)
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.lower() == 'true'
+    return bool(value)
+
+
+def to_string(value):
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return ','.join(str(ele) for ele in value)
+    return str(value)
+
+
+CONVERTERS = {
+    'int64': to_int,
+    'float64': to_float,
+    'bool_': to_bool,
+    'string': to_string,
+}
+
+
+def list_converter(converter):
+    """Converter of a list column, a single value becomes a list of one."""
+    def convert(value):
+        if value is None:
+            return None
+        return [converter(ele) for ele in (value if isinstance(value, list) else [value])]
+
+    return convert
+
+
+def get_column(field_types, path, es_name, multi_valued_fields=()):
+    """Arrow type and converter of one attribute."""
+    type_name = ARROW_TYPE_NAMES.get(field_types.get((path, es_name)), 'string')
+    arrow_type, converter = getattr(pyarrow, type_name)(), CONVERTERS[type_name]
+    if (path, es_name) in multi_valued_fields:
+        return pyarrow.list_(arrow_type), list_converter(converter)
+    return arrow_type, converter
+
+
+def unique_column_names(names):
+    seen = set()
+    output = []
+    for name in names:
+        unique_name = name
+        number = 2
+        while unique_name in seen:
+            unique_name = '%s_%d' % (name, number)
+            number += 1
+        seen.add(unique_name)
+        output.append(unique_name)
+    return output
+
+
+def get_schema(download_obj, field_types, multi_valued_fields=()):
+    """Arrow schema and per column value converters of the rows of download_obj, see BaseDownloadAllResults.row_format."""
+    header = download_obj.header
+    types = []
+    converters = []
+
+    if download_obj.row_format == 'nested':
+        for ele in header:
+            if not ele.path:
+                arrow_type, converter = get_column(field_types, '', ele.es_name, multi_valued_fields)
+                types.append(arrow_type)
+                converters.append(converter)
+
+        for path in download_obj.get_header_paths():
+            es_names = [ele.es_name for ele in header if ele.path == path]
+            columns = [get_column(field_types, path, es_name, multi_valued_fields) for es_name in es_names]
+            types.append(pyarrow.list_(pyarrow.struct([(es_name, arrow_type) for es_name, (arrow_type, _) in zip(es_names, columns)])))
+            converters.append(nested_converter(es_names, [converter for _, converter in columns]))
+    else:
+        for ele in header:
+            arrow_type, converter = get_column(field_types, ele.path or '', ele.es_name, multi_valued_fields)
+            types.append(arrow_type)
+            converters.append(converter)
+
+    names = unique_column_names(download_obj.get_header_keys())
+    return pyarrow.schema(list(zip(names, types))), converters
+
+
+def nested_converter(es_names, converters):
+    fields = list(zip(es_names, converters))
+
+    def convert(inner_hits):
+        return [{es_name: converter(inner_hit.get(es_name)) for es_name, converter in fields} for inner_hit in inner_hits or []]
+
+    return convert
+
+
+def write_parquet(file_path, download_obj, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write the rows of download_obj to a parquet file, one row group at a time so memory does not grow with the
+    number of results. Yields the number of rows written after every row group.
+    """
+    if pyarrow is None:
+        raise ImportError('Parquet exports need pyarrow, install it with pip install pyarrow')
+
+    field_types = get_es_field_types(download_obj.search_log_obj.dataset)
+    schema, converters = get_schema(download_obj, field_types, get_multi_valued_fields(download_obj, field_types))
+    rows = download_obj.yield_rows()
+    # the header, the column names are in the schema
+    next(rows)
+
+    rows_written = 0
+    with pyarrow.parquet.ParquetWriter(file_path, schema) as writer:
+        while True:
+            chunk = list(itertools.islice(rows, row_group_size))
+            if not chunk:
+                break
+            arrays = [pyarrow.array([converter(value) for value in column], type=field.type)
+                      for converter, column, field in zip(converters, zip(*chunk), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            rows_written += len(chunk)
+            yield rows_written
@@ -0,0 +1,2 @@
+class SearchPageExpired(Exception):
+    """The point in time of a paged search is gone, the search has to be run again."""
@@ -0,0 +1,229 @@
+import csv
+import gzip
+import io
+import itertools
+import os
+import traceback
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from common.utils import import_from_settings
+from core.columnar import write_parquet
+from core.models import ExportJob
+from core.utils import BaseDownloadAllResults
+
+EXPORT_TASK_NAME = 'es_celery.export_tasks.run_export_job'
+ACTIVE_STATUSES = ('Queued', 'Running')
+# Queued or Running jobs not updated for this many seconds have lost their worker or their task message
+STALE_EXPORT_JOB_TIMEOUT = import_from_settings('EXPORT_JOB_STALE_TIMEOUT', 60 * 60)
+# hits between two progress updates of an export job
+PROGRESS_INTERVAL = 5000
+FILE_CHUNK_SIZE = 64 * 1024
+# rows rendered to text before each write to the compressed file
+WRITE_CHUNK_ROWS = 10000
+# gzip level 6 compresses csv nearly as well as the default 9 at a fraction of the cost
+COMPRESS_LEVEL = 6
+DELIMITERS = {
+    'csv': ',',
+    'tsv': '\t',
+}
+FILE_EXTENSIONS = {
+    'csv': 'csv.gz',
+    'tsv': 'tsv.gz',
+    'parquet': 'parquet',
+    'parquet_nested': 'parquet',
+}
+# BaseDownloadAllResults.row_format of the formats that keep the Elasticsearch types
+ROW_FORMATS = {
+    'parquet': 'typed',
+    'parquet_nested': 'nested',
+}
+
+
+def get_export_root():
+    return import_from_settings('EXPORT_ROOT')
+
+
+def get_celery_app():
+    """The utils/es_celery app, imported the way a worker started from utils/ or the web tier sees it."""
+    try:
+        from es_celery.celery import app
+    except ImportError:
+        from utils.es_celery.celery import app
+    return app
+
+
+def get_download_class(search_log_obj):
+    app_name = search_log_obj.analysis_type.app_name.name
+
+    if app_name == 'mendelian':
+        from mendelian.utils import MendelianDownloadAllResults
+        return MendelianDownloadAllResults
+    else:
+        return BaseDownloadAllResults
+
+
+def start_export_job(user_obj, search_log_obj, file_format='csv', order_by_position=False):
+    """Create an export job, it runs as soon as the user has less than EXPORT_JOBS_PER_USER jobs running."""
+    export_job_obj = ExportJob.objects.create(user=user_obj, search_log=search_log_obj, file_format=file_format,
+                                              order_by_position=order_by_position)
+    dispatch_export_jobs(user_obj)
+    return export_job_obj
+
+
+def fail_stale_export_jobs(user_obj):
+    """
+    Fail the Queued or Running export jobs of a user that made no progress for STALE_EXPORT_JOB_TIMEOUT seconds,
+    e.g. their worker was killed, so they no longer count against EXPORT_JOBS_PER_USER and can be retried.
+    """
+    now = timezone.now()
+    ExportJob.objects.filter(user=user_obj, status__in=ACTIVE_STATUSES,
+                             modified__lt=now - timedelta(seconds=STALE_EXPORT_JOB_TIMEOUT)).update(
+        status='Failed', finished=now, modified=now,
+        error='No progress for %d seconds, the export worker stopped.' % (STALE_EXPORT_JOB_TIMEOUT))
+
+
+def retry_export_job(export_job_obj):
+    """Put a failed or stale export job back in line, it is written again from the start."""
+    fail_stale_export_jobs(export_job_obj.user)
+    export_job_obj.refresh_from_db()
+    if export_job_obj.status == 'Failed':
+        update_export_job(export_job_obj, status='Waiting')
+        dispatch_export_jobs(export_job_obj.user)
+
+
+def dispatch_export_jobs(user_obj):
+    """Send the oldest waiting export jobs of a user to the workers, up to the per user limit."""
+    limit = import_from_settings('EXPORT_JOBS_PER_USER', 2)
+
+    with transaction.atomic():
+        fail_stale_export_jobs(user_obj)
+        jobs = list(ExportJob.objects.select_for_update().filter(user=user_obj).order_by('created'))
+        number_active = len([job for job in jobs if job.status in ACTIVE_STATUSES])
+        export_job_ids = [job.id for job in jobs if job.status == 'Waiting'][:max(0, limit - number_active)]
+        ExportJob.objects.filter(id__in=export_job_ids).update(status='Queued', modified=timezone.now())
+        for export_job_id in export_job_ids:
+            transaction.on_commit(lambda export_job_id=export_job_id: get_celery_app().send_task(EXPORT_TASK_NAME, args=[export_job_id]))
+
+
+def update_export_job(export_job_obj, **fields):
+    for key, value in fields.items():
+        setattr(export_job_obj, key, value)
+    export_job_obj.save(update_fields=list(fields) + ['modified'])
+
+
+def get_export_file_path(export_job_obj):
+    return os.path.join(get_export_root(), export_job_obj.file_name)
+
+
+def write_rows(fp, rows, delimiter, chunk_rows=WRITE_CHUNK_ROWS):
+    """
+    Write rows as delimited text to fp, chunk_rows at a time rendered into one string and written at once.
+    Yields the number of rows written after every chunk.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    rows = iter(rows)
+    rows_written = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            break
+        writer.writerows(chunk)
+        fp.write(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+        rows_written += len(chunk)
+        yield rows_written
+
+
+def write_export_file(file_path, download_obj, file_format):
+    """Yields the number of rows written as the file is written."""
+    if file_format in DELIMITERS:
+        with gzip.open(file_path, 'wt', newline='', compresslevel=COMPRESS_LEVEL) as fp:
+            yield from write_rows(fp, download_obj.yield_rows(), DELIMITERS[file_format])
+    else:
+        yield from write_parquet(file_path, download_obj)
+
+
+def get_content_type(export_job_obj):
+    if export_job_obj.file_format in DELIMITERS:
+        return 'application/gzip'
+    return 'application/octet-stream'
+
+
+def run_export_job(export_job_id):
+    """
+    Write all rows of the search of an export job to a file in the format of the job. The file is written under a temporary
+    name and renamed once complete, so a failed or restarted job never leaves a truncated file to download.
+    """
+    export_job_obj = ExportJob.objects.select_related('search_log', 'user').get(pk=export_job_id)
+    if export_job_obj.status != 'Queued':
+        return export_job_obj.status
+
+    file_format = export_job_obj.file_format
+    file_name = 'export_%d_search_%d.%s' % (export_job_obj.id, export_job_obj.search_log_id, FILE_EXTENSIONS[file_format])
+    update_export_job(export_job_obj, status='Running', file_name=file_name, started=timezone.now(),
+                      finished=None, error=None, total_hits=None, hits_processed=0, rows_written=0)
+
+    file_path = get_export_file_path(export_job_obj)
+    tmp_file_path = file_path + '.part'
+    try:
+        os.makedirs(get_export_root(), exist_ok=True)
+        download_obj = get_download_class(export_job_obj.search_log)(export_job_obj.search_log,
+                                                                     order_by_position=export_job_obj.order_by_position,
+                                                                     row_format=ROW_FORMATS.get(file_format, 'text'))
+        update_export_job(export_job_obj, total_hits=download_obj.count_hits())
+
+        rows_written = 0
+        last_update = 0
+        for rows_written in write_export_file(tmp_file_path, download_obj, file_format):
+            if download_obj.hits_processed - last_update >= PROGRESS_INTERVAL:
+                last_update = download_obj.hits_processed
+                update_export_job(export_job_obj, hits_processed=last_update, rows_written=rows_written)
+
+        os.replace(tmp_file_path, file_path)
+        update_export_job(export_job_obj, status='Completed', finished=timezone.now(),
+                          hits_processed=download_obj.hits_processed, rows_written=rows_written)
+    except Exception:
+        if os.path.exists(tmp_file_path):
+            os.remove(tmp_file_path)
+        update_export_job(export_job_obj, status='Failed', finished=timezone.now(), error=traceback.format_exc())
+    finally:
+        dispatch_export_jobs(export_job_obj.user)
+
+    return export_job_obj.status
+
+
+def parse_range_header(range_header, file_size):
+    """(start, end) of a single 'bytes=start-end' range, both included, or None to send the whole file."""
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+
+    start, _, end = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:
+            # suffix range, the last end bytes
+            start, end = max(0, file_size - int(end)), file_size - 1
+        else:
+            start, end = int(start), min(int(end), file_size - 1) if end else file_size - 1
+    except ValueError:
+        return None
+
+    if start > end:
+        return None
+    return start, end
+
+
+def read_file_range(file_path, start, end):
+    with open(file_path, 'rb') as fp:
+        fp.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fp.read(min(FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
@@ -0,0 +1,159 @@
+"""
+Document counts of the choices of the filter form for the current filter state, so the filter widgets can show
+how many variants each choice would give without running the search.
+"""
+import hashlib
+import json
+
+from django.core.exceptions import ValidationError
+
+from common.utils import import_from_settings
+from core.utils import (BaseElasticSearchQueryDSL, SearchResultCache,
+                        get_dataset_metadata, get_es_client,
+                        get_index_generation)
+
+FACET_FORM_TYPES = ('MultipleChoiceField', 'ChoiceField')
+# exists filters have the fixed only/exclude choices, there is nothing to count per value
+FACET_SKIPPED_FILTER_TYPES = ('filter_exists', 'nested_filter_exists')
+
+facet_count_cache = SearchResultCache(import_from_settings('FACET_COUNT_CACHE_SIZE', 256),
+                                      import_from_settings('FACET_COUNT_CACHE_TTL', 600))
+
+
+def get_facet_fields(metadata):
+    """The visible choice filters of the dataset whose choices are values of the index."""
+    return [ele for ele in metadata.filter_fields.values()
+            if ele.id in metadata.visible_filter_field_ids and ele.form_type.name in FACET_FORM_TYPES and
+            ele.es_filter_type.name not in FACET_SKIPPED_FILTER_TYPES]
+
+
+def get_filter_state(filter_form_data):
+    """The filters used in cleaned FilterForm data, with the values of multiple choice filters in a fixed order."""
+    filter_state = {}
+    for key, value in filter_form_data.items():
+        if not value:
+            continue
+        filter_state[key] = sorted(value) if isinstance(value, list) else value
+    return filter_state
+
+
+def get_facet_cache_key(dataset_obj, filter_state):
+    filter_state_hash = hashlib.sha1(json.dumps(filter_state, sort_keys=True).encode('utf-8')).hexdigest()
+    return json.dumps(['facets', dataset_obj.id, dataset_obj.config_version, get_index_generation(dataset_obj),
+                       filter_state_hash])
+
+
+class FacetQueryDSL(BaseElasticSearchQueryDSL):
+    # facets are counted while the filters are typed, a long gene list must not become a gene set on the way
+    create_gene_sets = False
+
+
+def get_filter_query(dataset_obj, filter_state):
+    """The query of the filters in filter_state alone, as the search builds it with BaseElasticSearchQueryDSL."""
+    if not filter_state:
+        return None
+
+    elasticsearch_dsl = FacetQueryDSL(dataset_obj, filter_state, {}, {})
+    elasticsearch_dsl.generate_base_query_from_filters()
+    return elasticsearch_dsl.get_query_body().get('query')
+
+
+def get_facet_aggregation(filter_field_obj, values):
+    """Terms aggregation restricted to the choices of the field; nested fields count the documents, not the nested objects."""
+    terms = {
+        "field": filter_field_obj.es_name,
+        "include": values,
+        "size": len(values),
+        "min_doc_count": 0,
+    }
+    if not filter_field_obj.path:
+        return {"terms": terms}
+
+    terms["field"] = '%s.%s' % (filter_field_obj.path, filter_field_obj.es_name)
+    return {
+        "nested": {"path": filter_field_obj.path},
+        "aggs": {
+            "values": {
+                "terms": terms,
+                "aggs": {"documents": {"reverse_nested": {}}}
+            }
+        }
+    }
+
+
+def parse_facet_aggregation(filter_field_obj, aggregation):
+    if filter_field_obj.path:
+        return {str(bucket['key']): bucket['documents']['doc_count'] for bucket in aggregation['values']['buckets']}
+    return {str(bucket.get('key_as_string', bucket['key'])): bucket['doc_count'] for bucket in aggregation['buckets']}
+
+
+def get_facet_search_body(dataset_obj, filter_state):
+    body = {"size": 0, "track_total_hits": True, "aggs": {}}
+    query = get_filter_query(dataset_obj, filter_state)
+    if query:
+        body["query"] = query
+    return body
+
+
+def get_facet_searches(dataset_obj, filter_state):
+    """
+    (search body, facet fields) of the facet counts. The choices of a filter are counted with every other filter
+    applied but not itself, so picking more of its choices is not shown as zero hits. The filters not in use share
+    the search of the full filter state, one aggregation each; that search is the first one and gives the total.
+    """
+    metadata = get_dataset_metadata(dataset_obj)
+    searches = {None: (get_facet_search_body(dataset_obj, filter_state), [])}
+    for filter_field_obj in get_facet_fields(metadata):
+        key = str(filter_field_obj.id)
+        values = metadata.get_filter_field_choices(filter_field_obj)
+        if not values:
+            continue
+
+        group = key if key in filter_state else None
+        if group not in searches:
+            other_filters = {name: value for name, value in filter_state.items() if name != key}
+            searches[group] = (get_facet_search_body(dataset_obj, other_filters), [])
+
+        body, fields = searches[group]
+        body["aggs"][key] = get_facet_aggregation(filter_field_obj, values)
+        fields.append(filter_field_obj)
+
+    return list(searches.values())
+
+
+def get_facet_counts(dataset_obj, filter_form_data):
+    """
+    Per choice document counts of the visible choice filters for cleaned FilterForm data, as
+    {'total': hits of the filter state, 'facets': {filter field id: {choice: count}}}. All counts come from a
+    single _msearch request and are cached per dataset, index generation and filter state. Raises ValidationError
+    if the filter state cannot be searched.
+    """
+    filter_state = get_filter_state(filter_form_data)
+    cache_key = get_facet_cache_key(dataset_obj, filter_state)
+    cached = facet_count_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    searches = get_facet_searches(dataset_obj, filter_state)
+    msearch_body = []
+    for body, _ in searches:
+        if not body["aggs"]:
+            body.pop("aggs")
+        msearch_body.append({"index": dataset_obj.es_index_name})
+        msearch_body.append(body)
+
+    es = get_es_client(dataset_obj)
+    responses = es.msearch(searches=msearch_body, request_timeout=120)['responses']
+
+    for response in responses:
+        if 'error' in response:
+            raise ValidationError('Facet count search failed: %s' % response['error'])
+
+    facet_counts = {'total': responses[0]['hits']['total']['value'], 'facets': {}}
+    for (_, fields), response in zip(searches, responses):
+        for filter_field_obj in fields:
+            key = str(filter_field_obj.id)
+            facet_counts['facets'][key] = parse_facet_aggregation(filter_field_obj, response['aggregations'][key])
+
+    facet_count_cache.set(cache_key, facet_counts)
+    return facet_counts
@@ -0,0 +1,47 @@
+import itertools
+
+# rows one hit can expand into, e.g. 50 transcripts x 200 samples
+MAX_FLATTENED_ROWS_PER_HIT = 10000
+
+
+def freeze(value):
+    """Hashable equivalent of a row value, equal for equal values, so rows can be de-duplicated with a set."""
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((key, freeze(val)) for key, val in value.items())))
+    if isinstance(value, list):
+        return (list, tuple(freeze(val) for val in value))
+    return value
+
+
+def flatten_hit(result, nested_paths, non_nested_fields, fields_to_skip_flattening=(), max_rows=MAX_FLATTENED_ROWS_PER_HIT):
+    """
+    Yield the rows of one result: its non nested fields combined with every combination of the inner hits of
+    its nested paths, at most max_rows of them. A result without inner hits for one of its paths is yielded as is.
+    """
+    nested_lists = [result[path] for path in nested_paths if path in result]
+    if not nested_lists or not all(nested_lists):
+        yield result
+        return
+
+    non_nested = {key: result[key] for key in non_nested_fields if result.get(key) is not None}
+    not_flattened = {key: result[key] for key in fields_to_skip_flattening if result.get(key)}
+
+    for combination in itertools.islice(itertools.product(*nested_lists), max_rows):
+        row = non_nested.copy()
+        for nested in combination:
+            row.update(nested)
+        row['es_id'] = result['es_id']
+        row.update(not_flattened)
+        yield row
+
+
+def flatten_results(results, nested_paths, non_nested_fields, fields_to_skip_flattening=(), max_rows_per_hit=MAX_FLATTENED_ROWS_PER_HIT):
+    """Lazily yield the flattened rows of all results, skipping rows equal to one already yielded."""
+    seen = set()
+    for result in results:
+        for row in flatten_hit(result, nested_paths, non_nested_fields, fields_to_skip_flattening, max_rows_per_hit):
+            key = freeze(row)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield row
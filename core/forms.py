@@ -3,8 +3,8 @@ from django import forms
 from django.contrib.auth.models import User
 from django.db.models import Q
 
-from core.models import (Dataset, FilterField, FilterFieldChoice, SavedSearch,
-                         Study, DocumentReview)
+from core.models import Dataset, SavedSearch, Study, DocumentReview
+from core.utils import get_dataset_metadata
 
 EXIST_CHOICES = [('', '----'), ("only", "only"), ("excluded", "excluded")]
 
@@ -134,9 +134,9 @@ class FilterForm(forms.Form):
 
     def __init__(self, dataset, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        metadata = get_dataset_metadata(dataset)
 
-        for field in FilterField.objects.filter(dataset=dataset).select_related(
-                'widget_type', 'form_type', 'es_filter_type'):
+        for field in metadata.filter_fields.values():
 
             if field.tooltip:
                 tooltip = ' <i data-toggle="popover" data-trigger="hover" data-content="%s" class="fa fa-info-circle" aria-hidden="true"></i>' % (
@@ -152,8 +152,8 @@ class FilterForm(forms.Form):
                     label=label, required=False)
 
             elif field.form_type.name == "MultipleChoiceField" and field.widget_type.name == "SelectMultiple":
-                CHOICES = [(ele.value, ' '.join(ele.value.split('_')))
-                           for ele in FilterFieldChoice.objects.filter(filter_field=field).order_by('pk')]
+                CHOICES = [(value, ' '.join(value.split('_')))
+                           for value in metadata.get_filter_field_choices(field)]
                 self.fields[field_name] = forms.MultipleChoiceField(
                     label=label, required=False, choices=CHOICES)
 
@@ -165,8 +165,7 @@ class FilterForm(forms.Form):
                     self.fields[field_name] = forms.ChoiceField(
                         label=label, required=False, choices=EXIST_CHOICES)
                 else:
-                    CHOICES = [(ele.value, ele.value) for ele in FilterFieldChoice.objects.filter(
-                        filter_field=field).order_by('pk')]
+                    CHOICES = [(value, value) for value in metadata.get_filter_field_choices(field)]
                     CHOICES.insert(0, ('', '----'))
                     self.fields[field_name] = forms.ChoiceField(
                         label=label, required=False, choices=CHOICES)
@@ -193,7 +192,7 @@ class AttributeForm(forms.Form):
     def __init__(self, dataset, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        for field in dataset.attributefield_set.all():
+        for field in get_dataset_metadata(dataset).attribute_fields.values():
             label = field.display_text
             field_name = '%d' % (field.id)
             self.fields[field_name] = forms.BooleanField(
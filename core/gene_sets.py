@@ -0,0 +1,120 @@
+"""
+Gene lists of terms filters kept out of the query. A pasted or uploaded list longer than GENE_SET_INLINE_LIMIT, or
+a single 'gene_set:<id>' line, is a GeneSet whose genes are indexed once in GENE_SET_INDEX of the dataset's cluster,
+in chunks below index.max_terms_count. The query, and so the search log, only holds terms lookups of those chunks.
+"""
+from django.core.exceptions import ValidationError
+
+from common.utils import import_from_settings
+from core.models import GeneSet, get_genes_checksum, get_unique_genes
+from core.utils import get_es_client
+
+GENE_SET_INDEX = import_from_settings('GENE_SET_INDEX', 'genesysv_gene_sets')
+# longer lists are stored as gene sets, shorter ones stay in the query
+GENE_SET_INLINE_LIMIT = import_from_settings('GENE_SET_INLINE_LIMIT', 500)
+# genes per gene set document, at most index.max_terms_count of the dataset indices
+GENE_SET_CHUNK_SIZE = import_from_settings('GENE_SET_CHUNK_SIZE', 65536)
+GENE_SET_REFERENCE_PREFIX = 'gene_set:'
+
+# (es_host, es_port, gene set id, checksum) of the gene sets indexed by this process
+indexed_gene_sets = set()
+# (es_host, es_port) of the clusters where GENE_SET_INDEX was created by this process
+gene_set_indices = set()
+
+
+class GeneSetLookup:
+    """Stands in for the list of values of a terms filter, see core.utils.ElasticSearchFilter.get_terms_query."""
+
+    def __init__(self, gene_set_obj, document_ids, lowercase=False):
+        self.gene_set_obj = gene_set_obj
+        self.document_ids = document_ids
+        self.path = 'lowercase_genes' if lowercase else 'genes'
+
+    def get_reference(self):
+        return '%s%d' % (GENE_SET_REFERENCE_PREFIX, self.gene_set_obj.id)
+
+    def get_terms_query(self, field_name):
+        lookups = [{"terms": {field_name: {"index": GENE_SET_INDEX, "id": document_id, "path": self.path}}}
+                   for document_id in self.document_ids]
+        if len(lookups) == 1:
+            return lookups[0]
+        return {"bool": {"should": lookups, "minimum_should_match": 1}}
+
+
+def create_gene_set_index(es):
+    """Small index read by terms lookups only; nothing in it is searched, so nothing is indexed but the source."""
+    es.options(ignore_status=400).indices.create(
+        index=GENE_SET_INDEX,
+        settings={"number_of_shards": 1, "auto_expand_replicas": "0-all"},
+        mappings={"dynamic": False})
+
+
+def index_gene_set(dataset_obj, gene_set_obj):
+    """Index the chunks of a gene set in the cluster of the dataset, unless done before, and return their ids."""
+    genes = gene_set_obj.get_genes()
+    chunks = [genes[idx:idx + GENE_SET_CHUNK_SIZE] for idx in range(0, len(genes), GENE_SET_CHUNK_SIZE)] or [[]]
+    # the checksum is part of the ids, so an edited set never reads the chunks of its previous genes
+    document_ids = ['%d_%s_%d' % (gene_set_obj.id, gene_set_obj.checksum, idx) for idx in range(len(chunks))]
+
+    cluster = (dataset_obj.es_host, str(dataset_obj.es_port))
+    key = cluster + (gene_set_obj.id, gene_set_obj.checksum)
+    if key in indexed_gene_sets:
+        return document_ids
+
+    es = get_es_client(dataset_obj)
+    if cluster not in gene_set_indices:
+        create_gene_set_index(es)
+        gene_set_indices.add(cluster)
+
+    for document_id, chunk in zip(document_ids, chunks):
+        es.index(index=GENE_SET_INDEX, id=document_id, document={
+            'gene_set': gene_set_obj.id,
+            'genes': chunk,
+            'lowercase_genes': [gene.lower() for gene in chunk],
+        })
+    indexed_gene_sets.add(key)
+    return document_ids
+
+
+def get_referenced_gene_set(reference):
+    gene_set_id = reference[len(GENE_SET_REFERENCE_PREFIX):].strip()
+    gene_set_obj = GeneSet.objects.filter(pk=gene_set_id).first() if gene_set_id.isdigit() else None
+    if gene_set_obj is None:
+        raise ValidationError('Gene set %s does not exist!' % (gene_set_id))
+    return gene_set_obj
+
+
+def get_existing_gene_set(genes):
+    """The gene set with exactly these genes, or None if the list was never searched or uploaded."""
+    genes = get_unique_genes(gene for line in genes for gene in line.split())
+    return GeneSet.objects.filter(checksum=get_genes_checksum(genes)).order_by('pk').first()
+
+
+def get_or_create_gene_set(genes):
+    """The gene set with exactly these genes, created for an uploaded list the first time it is searched."""
+    gene_set_obj = get_existing_gene_set(genes)
+    if gene_set_obj is None:
+        genes = get_unique_genes(gene for line in genes for gene in line.split())
+        gene_set_obj = GeneSet.objects.create(name='Uploaded list of %d genes: %s' % (len(genes), ', '.join(genes[:5])),
+                                              genes='\n'.join(genes))
+    return gene_set_obj
+
+
+def get_gene_set_lookup(dataset_obj, values, lowercase=False, create=True):
+    """
+    GeneSetLookup for the lines of a terms filter that reference a gene set or are too many to inline, None for
+    the lines that stay in the query. Without create, a long list that is not a gene set yet stays in the query
+    too, so queries that are not searches, e.g. facet counts, store nothing.
+    """
+    values = [ele.strip() for ele in values if ele.strip()]
+    if len(values) == 1 and values[0].startswith(GENE_SET_REFERENCE_PREFIX):
+        gene_set_obj = get_referenced_gene_set(values[0])
+    elif len(values) > GENE_SET_INLINE_LIMIT:
+        gene_set_obj = get_or_create_gene_set(values) if create else get_existing_gene_set(values)
+    else:
+        return None
+
+    if gene_set_obj is None:
+        return None
+
+    return GeneSetLookup(gene_set_obj, index_gene_set(dataset_obj, gene_set_obj), lowercase)
@@ -0,0 +1,23 @@
+import secrets
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import APIToken, get_api_key_hash
+
+
+class Command(BaseCommand):
+    help = 'Create a search API token for a user and print its key, which is not stored and cannot be shown again'
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="User the API token acts as")
+        parser.add_argument("--name", default='', help="What the token is used for, e.g. the name of a script")
+
+    def handle(self, *args, **options):
+        user_obj = User.objects.filter(username=options.get('username')).first()
+        if user_obj is None:
+            raise CommandError('User %s does not exist!' % (options.get('username')))
+
+        key = secrets.token_urlsafe(32)
+        APIToken.objects.create(user=user_obj, name=options.get('name'), key_hash=get_api_key_hash(key))
+        print(key)
@@ -32,6 +32,7 @@ ES_FILTER_TYPES = ("filter_term",
                    "filter_exists",
                    "must_not_exists",
                    "nested_filter_exists",
+                   "filter_region",
                    )
 
 APP_NAMES = (
@@ -212,7 +213,6 @@ class Command(BaseCommand):
                     match = re.search(r'python_eval(.+)', field_values)
                     if field_values == 'get_values_from_es()':
                         field_values = get_values_from_es(index_name,
-                                                   type_name,
                                                    hostname,
                                                    port,
                                                    field_es_name,
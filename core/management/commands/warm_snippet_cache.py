@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Dataset
+from core.views import AttributeSnippetView, FilterSnippetView
+
+
+def get_snippet_views(dataset_obj):
+    snippet_views = [FilterSnippetView, AttributeSnippetView]
+    if dataset_obj.analysis_type.filter(app_name__name='mendelian').exists():
+        from mendelian.views import FamilySnippetView, KindredSnippetView
+        snippet_views.extend([KindredSnippetView, FamilySnippetView])
+    return snippet_views
+
+
+class Command(BaseCommand):
+    help = 'Render and cache the form snippets of every dataset, e.g. after a deploy, so no user waits for them'
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dataset", type=int, action='append',
+                            help="Only warm the dataset with this id, can be given more than once")
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('pk')
+        if options.get('dataset'):
+            datasets = datasets.filter(pk__in=options.get('dataset'))
+
+        number_failed = 0
+        for dataset_obj in datasets:
+            for snippet_view in get_snippet_views(dataset_obj):
+                try:
+                    snippet_view().get_snippet_html(dataset_obj)
+                except Exception as e:
+                    number_failed += 1
+                    print('%s %s: failed, %s' % (dataset_obj.name, snippet_view.snippet_name, e))
+                else:
+                    print('%s %s: cached' % (dataset_obj.name, snippet_view.snippet_name))
+
+        print('%d snippets could not be rendered' % (number_failed))
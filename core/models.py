@@ -1,11 +1,12 @@
+import hashlib
 import json
 
 from django.contrib.auth.models import Group, User
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from sortedm2m.fields import SortedManyToManyField
 
 from common.models import TimeStampedModel
-from core.utils import flush_memcache
 
 
 class AppName(TimeStampedModel):
@@ -68,8 +69,14 @@ class Dataset(TimeStampedModel):
     es_type_name = models.CharField(max_length=255)
     es_host = models.CharField(max_length=255)
     es_port = models.CharField(max_length=255)
+    # applied to the shared client of es_host:es_port, see core.utils.ElasticsearchClientRegistry
+    es_timeout = models.IntegerField(default=120, help_text='Elasticsearch request timeout in seconds')
+    es_max_retries = models.IntegerField(default=3, help_text='Retries of a failed or timed out Elasticsearch request')
     is_public = models.BooleanField(default=False)
     allowed_groups = models.ManyToManyField(Group, blank=True)
+    # incremented on every change of its filter and attribute configuration, which invalidates the cached
+    # configuration (core.utils.DatasetMetadataRegistry) and form snippets (core.utils.get_snippet_cache_key)
+    config_version = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         unique_together = ('name', 'description',)
@@ -126,10 +133,6 @@ class FilterField(TimeStampedModel):
         unique_together = ('dataset', 'es_name',
                            'es_filter_type', 'form_type', 'widget_type')
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(FilterField, self).save(*args, **kwargs)
-
     def __str__(self):
         return "%s %s" % (self.display_text, self.in_line_tooltip)
 
@@ -144,10 +147,6 @@ class FilterFieldChoice(TimeStampedModel):
     class Meta:
         unique_together = ('filter_field', 'value',)
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(FilterFieldChoice, self).save(*args, **kwargs)
-
     def __str__(self):
         return self.value
 
@@ -167,10 +166,6 @@ class AttributeField(TimeStampedModel):
     class Meta:
         unique_together = ('dataset', 'es_name', 'path')
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(AttributeField, self).save(*args, **kwargs)
-
     def __str__(self):
         return "%s" % (self.display_text)
 
@@ -185,10 +180,6 @@ class FilterPanel(TimeStampedModel):
     filter_fields = SortedManyToManyField(FilterField, blank=True)
     is_visible = models.BooleanField(default=True)
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(FilterPanel, self).save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
@@ -208,10 +199,6 @@ class FilterSubPanel(TimeStampedModel):
     filter_fields = SortedManyToManyField(FilterField, blank=True)
     is_visible = models.BooleanField(default=True)
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(FilterSubPanel, self).save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
@@ -224,10 +211,6 @@ class FilterTab(TimeStampedModel):
     name = models.CharField(max_length=255)
     filter_panels = SortedManyToManyField(FilterPanel, blank=True)
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(FilterTab, self).save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
@@ -242,10 +225,6 @@ class AttributePanel(TimeStampedModel):
     attribute_fields = SortedManyToManyField(AttributeField, blank=True)
     is_visible = models.BooleanField(default=True)
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(AttributePanel, self).save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
@@ -265,10 +244,6 @@ class AttributeSubPanel(TimeStampedModel):
     attribute_fields = SortedManyToManyField(AttributeField, blank=True)
     is_visible = models.BooleanField(default=True)
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(AttributeSubPanel, self).save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
@@ -281,14 +256,32 @@ class AttributeTab(TimeStampedModel):
     name = models.CharField(max_length=255)
     attribute_panels = SortedManyToManyField(AttributePanel, blank=True)
 
-    def save(self, *args, **kwargs):
-        flush_memcache()
-        super(AttributeTab, self).save(*args, **kwargs)
-
     def __str__(self):
         return self.name
 
 
+def bump_config_version(sender, instance, **kwargs):
+    """Invalidate the cached search configuration of the dataset of a changed field, choice, panel or tab."""
+    if kwargs.get('action', '').startswith('pre_'):
+        return
+
+    if isinstance(instance, FilterFieldChoice):
+        datasets = Dataset.objects.filter(filterfield__id=instance.filter_field_id)
+    else:
+        datasets = Dataset.objects.filter(pk=instance.dataset_id)
+    datasets.update(config_version=models.F('config_version') + 1)
+
+
+for config_model in (FilterField, FilterFieldChoice, AttributeField, FilterPanel, FilterSubPanel, FilterTab,
+                     AttributePanel, AttributeSubPanel, AttributeTab):
+    post_save.connect(bump_config_version, sender=config_model)
+    post_delete.connect(bump_config_version, sender=config_model)
+
+for config_m2m_field in (FilterPanel.filter_fields, FilterSubPanel.filter_fields, FilterTab.filter_panels,
+                         AttributePanel.attribute_fields, AttributeSubPanel.attribute_fields, AttributeTab.attribute_panels):
+    m2m_changed.connect(bump_config_version, sender=config_m2m_field.through)
+
+
 REVIEW_STATUS_CHOICES = (
     ('Approved', 'Approved'),
     ('Rejected', 'Rejected'),
@@ -352,6 +345,8 @@ class SearchLog(TimeStampedModel):
     non_nested_attributes_selected = models.TextField()
     additional_information = models.TextField(null=True, blank=True)
     exclude_rejected_documents = models.BooleanField(default=False)
+    # point in time and search_after values of the pages seen so far, see core.utils.BaseSearchResultsPage
+    page_cursor = models.TextField(null=True, blank=True)
 
     def __str__(self):
         return self.query
@@ -409,3 +404,110 @@ class SavedSearch(TimeStampedModel):
 
     class Meta:
         verbose_name_plural = 'Saved Searches'
+
+
+class ExportJob(TimeStampedModel):
+    """A full result download of a logged search, written to a compressed file by a celery worker, see core.exports."""
+    STATUS_CHOICES = (
+        ('Waiting', 'Waiting'),
+        ('Queued', 'Queued'),
+        ('Running', 'Running'),
+        ('Completed', 'Completed'),
+        ('Failed', 'Failed'),
+    )
+    FILE_FORMAT_CHOICES = (
+        ('csv', 'CSV'),
+        ('tsv', 'TSV'),
+        ('parquet', 'Parquet'),
+        ('parquet_nested', 'Parquet, nested as lists'),
+    )
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+    )
+    search_log = models.ForeignKey(
+        'SearchLog',
+        on_delete=models.CASCADE,
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Waiting')
+    file_format = models.CharField(max_length=16, choices=FILE_FORMAT_CHOICES, default='csv')
+    # rows sorted by CHROM and POS, slower than the order in which the shards return them
+    order_by_position = models.BooleanField(default=False)
+    file_name = models.CharField(max_length=255, null=True, blank=True)
+    total_hits = models.BigIntegerField(null=True, blank=True)
+    hits_processed = models.BigIntegerField(default=0)
+    rows_written = models.BigIntegerField(default=0)
+    error = models.TextField(null=True, blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s %s' % (self.user, self.search_log_id)
+
+    @property
+    def progress(self):
+        """Percentage of the hits written so far, None until the hits are counted."""
+        if self.status == 'Completed':
+            return 100
+        if not self.total_hits:
+            return None
+        return min(100, int(100 * self.hits_processed / self.total_hits))
+
+
+class APIToken(TimeStampedModel):
+    """
+    Key of a user for the search API, sent as an 'Authorization: Token <key>' header instead of a session cookie
+    and CSRF token; see core.views.SearchAPIView. Only a hash of the key is stored, create_api_token prints the
+    key once.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+    )
+    name = models.CharField(max_length=255, blank=True)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    last_used = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s %s' % (self.user, self.name)
+
+
+class GeneSet(TimeStampedModel):
+    """
+    A named list of genes, or other values of a terms filter, stored once and referenced from queries by terms
+    lookup instead of inlining every value; see core.gene_sets.
+    """
+    name = models.CharField(max_length=255)
+    description = models.TextField(blank=True)
+    # who uploaded or added the set, any user can reference it
+    user = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    genes = models.TextField(help_text='Genes separated by new lines or spaces')
+    checksum = models.CharField(max_length=40, db_index=True, editable=False)
+
+    def get_genes(self):
+        return get_unique_genes(self.genes.split())
+
+    def save(self, *args, **kwargs):
+        self.checksum = get_genes_checksum(self.get_genes())
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+def get_unique_genes(genes):
+    return sorted(set(gene.strip() for gene in genes if gene.strip()))
+
+
+def get_genes_checksum(genes):
+    return hashlib.sha1('\n'.join(genes).encode('utf-8')).hexdigest()
+
+
+def get_api_key_hash(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
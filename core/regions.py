@@ -0,0 +1,144 @@
+"""
+Genomic regions of the region filter, typed as chr:start-end lines or pasted or uploaded from a BED file. The
+regions are sorted and merged, so overlapping capture intervals cost one range, and compiled to one clause per
+chromosome: its CHROM term and the POS ranges of its merged regions. Elasticsearch 8 limits the number of leaf
+clauses of a whole query, so more than REGION_MAX_RANGE_CLAUSES merged regions, e.g. the intervals of a capture
+kit, are compiled to one script per chromosome that looks POS up in its sorted ranges instead.
+"""
+import re
+
+from django.core.exceptions import ValidationError
+
+from common.utils import import_from_settings
+
+REGION_CHROM_FIELD = 'CHROM'
+REGION_POS_FIELD = 'POS'
+# merged regions compiled to range clauses, well below the smallest clause limit of a node (1024) so the other
+# filters of the query still fit
+REGION_MAX_RANGE_CLAUSES = import_from_settings('REGION_MAX_RANGE_CLAUSES', 500)
+# binary search of the position of a document in the sorted, disjoint ranges of params.starts and params.ends
+REGION_LOOKUP_SCRIPT = """
+if (doc[params.field].size() == 0) {
+    return false;
+}
+long pos = doc[params.field].value;
+int low = 0;
+int high = params.starts.size() - 1;
+int found = -1;
+while (low <= high) {
+    int mid = (low + high) >>> 1;
+    if (((Number) params.starts.get(mid)).longValue() <= pos) {
+        found = mid;
+        low = mid + 1;
+    } else {
+        high = mid - 1;
+    }
+}
+return found >= 0 && ((Number) params.ends.get(found)).longValue() >= pos;
+"""
+BED_HEADER_PREFIXES = ('#', 'track', 'browser')
+REGION_PATTERN = re.compile(r'^([^:\s]+):([\d,]+)(?:-([\d,]+))?$')
+
+
+def get_chromosome_name(chromosome):
+    """The chromosome without a chr prefix, as the index stores it and so 'chr1:...' and '1:...' lines merge."""
+    if chromosome.lower().startswith('chr'):
+        return chromosome[3:]
+    return chromosome
+
+
+def parse_region_line(line):
+    """
+    (chromosome, start, end) of a chr:start-end, chr:position or BED line, 1-based with both ends included, or
+    None for blank, comment and track lines.
+    """
+    line = line.strip()
+    if not line or line.startswith(BED_HEADER_PREFIXES):
+        return None
+
+    fields = line.split()
+    if len(fields) >= 3 and fields[1].isdigit() and fields[2].isdigit():
+        # BED: 0-based start, end excluded
+        chromosome, start, end = fields[0], int(fields[1]) + 1, int(fields[2])
+    else:
+        match = REGION_PATTERN.match(line)
+        if not match:
+            raise ValidationError('Invalid region: %s' % (line))
+        chromosome = match.group(1)
+        start = int(match.group(2).replace(',', ''))
+        end = int((match.group(3) or match.group(2)).replace(',', ''))
+
+    if start < 1 or start > end:
+        raise ValidationError('Invalid region: %s' % (line))
+    return get_chromosome_name(chromosome), start, end
+
+
+def parse_regions(lines):
+    return [region for region in (parse_region_line(line) for line in lines) if region]
+
+
+def merge_regions(regions):
+    """Regions sorted by chromosome and start, with overlapping and adjacent regions merged into one."""
+    merged = []
+    for chromosome, start, end in sorted(regions):
+        if merged and merged[-1][0] == chromosome and start <= merged[-1][2] + 1:
+            merged[-1][2] = max(merged[-1][2], end)
+        else:
+            merged.append([chromosome, start, end])
+    return [tuple(ele) for ele in merged]
+
+
+def get_any_query(clauses):
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"bool": {"should": clauses, "minimum_should_match": 1}}
+
+
+def get_position_query(ranges, pos_field=REGION_POS_FIELD):
+    """Any of the (start, end) ranges, one range clause each."""
+    return get_any_query([{"range": {pos_field: {"gte": start, "lte": end}}} for start, end in ranges])
+
+
+def get_position_lookup_query(ranges, pos_field=REGION_POS_FIELD):
+    """
+    Any of the sorted, disjoint (start, end) ranges, as two leaf clauses whatever their number: a range of their
+    bounds, which the index answers, and REGION_LOOKUP_SCRIPT, which then only runs on the documents within it.
+    """
+    return {"bool": {"filter": [
+        {"range": {pos_field: {"gte": ranges[0][0], "lte": ranges[-1][1]}}},
+        {"script": {"script": {
+            "source": REGION_LOOKUP_SCRIPT,
+            "params": {
+                "field": pos_field,
+                "starts": [start for start, _ in ranges],
+                "ends": [end for _, end in ranges],
+            }
+        }}},
+    ]}}
+
+
+def get_region_query(regions, chrom_field=REGION_CHROM_FIELD, pos_field=REGION_POS_FIELD):
+    """
+    Query of the documents in any of the regions. Building it takes a sort of the regions and one pass over them,
+    whatever their number.
+    """
+    merged_regions = merge_regions(regions)
+    if len(merged_regions) > REGION_MAX_RANGE_CLAUSES:
+        get_chromosome_query = get_position_lookup_query
+    else:
+        get_chromosome_query = get_position_query
+
+    ranges = {}
+    for chromosome, start, end in merged_regions:
+        ranges.setdefault(chromosome, []).append((start, end))
+    if len(ranges) > REGION_MAX_RANGE_CLAUSES:
+        raise ValidationError('Regions on more than %d chromosomes or contigs are not supported!' % (
+            REGION_MAX_RANGE_CLAUSES))
+
+    clauses = []
+    for chromosome, chromosome_ranges in ranges.items():
+        clauses.append({"bool": {"filter": [
+            {"terms": {chrom_field: [chromosome, 'chr%s' % (chromosome)]}},
+            get_chromosome_query(chromosome_ranges, pos_field),
+        ]}})
+    return get_any_query(clauses)
@@ -1,3 +1,112 @@
-from django.test import TestCase
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from core.exports import parse_range_header
+from core.flatten import flatten_results
+from core.regions import (REGION_MAX_RANGE_CLAUSES, get_region_query,
+                          merge_regions, parse_region_line, parse_regions)
+
+
+class RegionParsingTests(SimpleTestCase):
+
+    def test_bed_start_is_converted_to_1_based(self):
+        self.assertEqual(parse_region_line('chr1\t99\t200\tcapture_1'), ('1', 100, 200))
+        self.assertEqual(parse_region_line('1 0 10'), ('1', 1, 10))
+
+    def test_region_strings(self):
+        self.assertEqual(parse_region_line('chr2:1,000-2,000'), ('2', 1000, 2000))
+        self.assertEqual(parse_region_line('X:500'), ('X', 500, 500))
+
+    def test_chr_prefix_is_removed(self):
+        self.assertEqual(parse_region_line('chrX:1-10')[0], 'X')
+        self.assertEqual(parse_region_line('CHR7:1-10')[0], '7')
+        self.assertEqual(parse_region_line('MT:1-10')[0], 'MT')
+
+    def test_header_and_blank_lines_are_skipped(self):
+        lines = ['track name=capture', 'browser position chr1:1-100', '# comment', '', '  ', 'chr1\t0\t5']
+        self.assertEqual(parse_regions(lines), [('1', 1, 5)])
+
+    def test_invalid_lines(self):
+        for line in ['BRCA1', 'chr1:', 'chr1:20-10', 'chr1:0-10', 'chr1\t10\t10', 'chr1 10', 'chr1:a-b']:
+            with self.subTest(line=line):
+                with self.assertRaises(ValidationError):
+                    parse_region_line(line)
+
+
+class RegionMergingTests(SimpleTestCase):
+
+    def test_overlapping_and_adjacent_regions_are_merged(self):
+        regions = [('1', 300, 400), ('1', 100, 200), ('1', 150, 160), ('1', 201, 250), ('1', 252, 260)]
+        self.assertEqual(merge_regions(regions), [('1', 100, 250), ('1', 252, 260), ('1', 300, 400)])
+
+    def test_regions_of_other_chromosomes_are_not_merged(self):
+        self.assertEqual(merge_regions([('2', 1, 10), ('1', 5, 20)]), [('1', 5, 20), ('2', 1, 10)])
+
+    def test_chr_and_plain_names_merge(self):
+        regions = parse_regions(['chr1:100-200', '1:150-300'])
+        self.assertEqual(merge_regions(regions), [('1', 100, 300)])
+
+    def test_query_of_one_region(self):
+        self.assertEqual(get_region_query([('1', 100, 200)]), {"bool": {"filter": [
+            {"terms": {"CHROM": ['1', 'chr1']}},
+            {"range": {"POS": {"gte": 100, "lte": 200}}},
+        ]}})
+
+    def test_many_regions_are_looked_up_by_a_script(self):
+        regions = [('1', 100 * idx + 1, 100 * idx + 11) for idx in range(REGION_MAX_RANGE_CLAUSES + 1)]
+        chromosome_query = get_region_query(regions)["bool"]["filter"]
+        self.assertEqual(chromosome_query[1]["bool"]["filter"][0], {"range": {"POS": {"gte": 1, "lte": regions[-1][2]}}})
+        params = chromosome_query[1]["bool"]["filter"][1]["script"]["script"]["params"]
+        self.assertEqual(params["starts"], [start for _, start, _ in regions])
+        self.assertEqual(params["ends"], [end for _, _, end in regions])
+
+
+class FlattenResultsTests(SimpleTestCase):
+
+    def test_rows_follow_the_results_and_their_inner_hits_in_order(self):
+        results = [
+            {'es_id': 'a', 'CHROM': '1', 'sample': [{'sample_ID': 's1'}, {'sample_ID': 's2'}],
+             'gene': [{'SYMBOL': 'G1'}, {'SYMBOL': 'G2'}]},
+            {'es_id': 'b', 'CHROM': '2', 'sample': [{'sample_ID': 's3'}], 'gene': [{'SYMBOL': 'G3'}]},
+        ]
+        rows = list(flatten_results(results, ['sample', 'gene'], ['CHROM']))
+        self.assertEqual([(row['es_id'], row['sample_ID'], row['SYMBOL']) for row in rows], [
+            ('a', 's1', 'G1'), ('a', 's1', 'G2'), ('a', 's2', 'G1'), ('a', 's2', 'G2'), ('b', 's3', 'G3'),
+        ])
+
+    def test_equal_rows_are_yielded_once(self):
+        results = [
+            {'es_id': 'a', 'CHROM': '1', 'sample': [{'sample_ID': 's1', 'AD': [1, 2]}, {'sample_ID': 's1', 'AD': [1, 2]},
+                                                    {'sample_ID': 's2', 'AD': [1, 2]}]},
+            {'es_id': 'a', 'CHROM': '1', 'sample': [{'sample_ID': 's1', 'AD': [1, 2]}]},
+        ]
+        rows = list(flatten_results(results, ['sample'], ['CHROM']))
+        self.assertEqual([row['sample_ID'] for row in rows], ['s1', 's2'])
+
+    def test_results_without_inner_hits_are_yielded_as_is(self):
+        result = {'es_id': 'a', 'CHROM': '1', 'sample': []}
+        self.assertEqual(list(flatten_results([result], ['sample'], ['CHROM'])), [result])
+
+    def test_rows_per_hit_are_limited(self):
+        result = {'es_id': 'a', 'sample': [{'sample_ID': str(idx)} for idx in range(10)]}
+        self.assertEqual(len(list(flatten_results([result], ['sample'], [], max_rows_per_hit=3))), 3)
+
+
+class RangeHeaderTests(SimpleTestCase):
+
+    def test_ranges(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=500-', 1000), (500, 999))
+
+    def test_suffix_ranges(self):
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), (0, 999))
+
+    def test_end_past_the_file_is_clipped(self):
+        self.assertEqual(parse_range_header('bytes=900-5000', 1000), (900, 999))
+
+    def test_whole_file_is_sent_for_unusable_ranges(self):
+        for range_header in [None, '', 'items=0-99', 'bytes=0-1,5-6', 'bytes=1000-', 'bytes=5000-6000',
+                             'bytes=50-10', 'bytes=a-b', 'bytes=-']:
+            with self.subTest(range_header=range_header):
+                self.assertIsNone(parse_range_header(range_header, 1000))
@@ -9,10 +9,18 @@ urlpatterns = (
          core_views.AnalysisTypeSnippetView.as_view(), name='analysis-type-snippet'),
     path('filter-snippet/<int:dataset_id>',
          core_views.FilterSnippetView.as_view(), name='filter-snippet'),
+    path('facet-counts/<int:dataset_id>',
+         core_views.FacetCountView.as_view(), name='facet-counts'),
+    path('value-catalog/<int:dataset_id>/<int:filter_field_id>',
+         core_views.ValueCatalogView.as_view(), name='value-catalog'),
     path('attribute-snippet/<int:dataset_id>',
          core_views.AttributeSnippetView.as_view(), name='attribute-snippet'),
     path('search-router/', core_views.SearchRouterView.as_view(), name='search-router'),
+    path('api/v%d/search' % core_views.SEARCH_API_VERSION, core_views.SearchAPIView.as_view(), name='search-api'),
+    path('api/v%d/search.ndjson' % core_views.SEARCH_API_VERSION, core_views.SearchNDJSONAPIView.as_view(), name='search-api-ndjson'),
+    path('api/v%d/async/search' % core_views.SEARCH_API_VERSION, core_views.AsyncSearchAPIView.as_view(), name='search-api-async'),
     path('download-router/<int:search_log_id>', core_views.DownloadRouterView.as_view(), name='download-router'),
+    path('search-page-router/<int:search_log_id>', core_views.SearchPageRouterView.as_view(), name='search-page-router'),
     path('additional-form-router/<int:dataset_id>/<int:analysis_type_id>', core_views.AdditionalFormRouterView.as_view(), name='additional-form-router'),
     path('base-search/', core_views.BaseSearchView.as_view(), name='base-search'),
     path('base-download/<int:search_log_id>', core_views.BaseDownloadView.as_view(), name='base-download'),
@@ -23,4 +31,9 @@ urlpatterns = (
     path('core-document-review-create/<int:dataset_id>/<document_es_id>/', core_views.DocumentReviewCreateView.as_view(), name='core-document-review-create'),
     path('core-document-review-update/<int:dataset_id>/<int:document_review_id>/', core_views.DocumentReviewUpdateView.as_view(), name='core-document-review-update'),
     path('core-document-list/', core_views.DocumentReviewListView.as_view(), name='core-document-list'),
+    path('runtime-stats/', core_views.RuntimeStatsView.as_view(), name='runtime-stats'),
+    path('export-job-list/', core_views.ExportJobListView.as_view(), name='export-job-list'),
+    path('export-job-status/<int:export_job_id>', core_views.ExportJobStatusView.as_view(), name='export-job-status'),
+    path('export-job-download/<int:export_job_id>', core_views.ExportJobDownloadView.as_view(), name='export-job-download'),
+    path('retry-export/<int:export_job_id>', core_views.retry_export, name='retry-export'),
 )
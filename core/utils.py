@@ -1,25 +1,436 @@
+import asyncio
+import contextlib
+import contextvars
 import copy
+import hashlib
+import heapq
 import itertools
 import json
 import pprint
+import queue
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from operator import itemgetter
 
 import elasticsearch
-import memcache
+from asgiref.sync import sync_to_async
 from django.core import serializers
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Q
 from natsort import natsorted
 from collections import OrderedDict
 from django.contrib.auth.models import Group
 
+from common.utils import import_from_settings
 from core import models as core_models
+from core.exceptions import SearchPageExpired
+from core.flatten import MAX_FLATTENED_ROWS_PER_HIT, flatten_results
+from core.regions import get_region_query, parse_regions
 
 #from core import forms as core_forms
 
 
-def flush_memcache():
-    mc = memcache.Client(['127.0.0.1:11211'], debug=0)
-    mc.flush_all()
+# rendered form snippets leave the shared cache after this many seconds unless used, see get_cached_snippet
+SNIPPET_CACHE_TTL = import_from_settings('SNIPPET_CACHE_TTL', 7 * 24 * 60 * 60)
+
+
+def get_snippet_cache_key(name, dataset_obj):
+    """
+    Key of a cached snippet in the namespace of the dataset's configuration version. A change of the dataset's
+    fields, choices, panels or tabs bumps Dataset.config_version, so its snippets are rendered again while the
+    stale ones and the snippets of other datasets stay untouched until they expire.
+    """
+    return 'dataset_%d_v%d_%s' % (dataset_obj.id, dataset_obj.config_version, name)
+
+
+def get_cached_snippet(name, dataset_obj, render_snippet):
+    """Rendered HTML of a snippet of the dataset from the cache, or from render_snippet() which is then cached."""
+    key = get_snippet_cache_key(name, dataset_obj)
+    html = cache.get(key)
+    if html is None:
+        html = render_snippet()
+        cache.set(key, html, SNIPPET_CACHE_TTL)
+    return html
+
+
+class ElasticsearchClientRegistry:
+    """
+    One Elasticsearch client, and so one keep-alive connection pool, per (es_host, es_port) for the whole process.
+
+    Clients are thread safe and created on first use, so every web or celery worker process gets its own after
+    forking. Per dataset timeouts and retries are applied with client.options(), which shares the connection
+    pool of the registered client.
+    """
+
+    def __init__(self):
+        self.clients = {}
+        self.lookups = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def get_client(self, es_host, es_port):
+        key = (es_host, str(es_port))
+        client = self.clients.get(key)
+        if client is None:
+            with self.lock:
+                client = self.clients.get(key)
+                if client is None:
+                    client = elasticsearch.Elasticsearch(
+                        "http://%s:%s" % key,
+                        connections_per_node=import_from_settings('ELASTICSEARCH_CONNECTIONS_PER_NODE', 10),
+                        request_timeout=import_from_settings('ELASTICSEARCH_REQUEST_TIMEOUT', 120),
+                        max_retries=import_from_settings('ELASTICSEARCH_MAX_RETRIES', 3),
+                        retry_on_timeout=True)
+                    self.clients[key] = client
+
+        self.lookups[key] += 1
+        return client
+
+    def get_dataset_client(self, dataset_obj):
+        client = self.get_client(dataset_obj.es_host, dataset_obj.es_port)
+        return client.options(request_timeout=dataset_obj.es_timeout,
+                              max_retries=dataset_obj.es_max_retries,
+                              retry_on_timeout=True)
+
+    def get_stats(self):
+        """Connection pool utilization of every registered client, for the runtime stats view."""
+        stats = []
+        for (es_host, es_port), client in list(self.clients.items()):
+            nodes = []
+            for node in client.transport.node_pool.all():
+                # urllib3 pool of the node; idle connections are the ones waiting in its queue
+                pool = getattr(node, 'pool', None)
+                idle_queue = getattr(pool, 'pool', None)
+                nodes.append({
+                    'node': str(node.base_url),
+                    'max_connections': getattr(pool, 'maxsize', None),
+                    'connections_opened': getattr(pool, 'num_connections', None),
+                    'idle_connections': idle_queue.qsize() if idle_queue is not None else None,
+                    'requests': getattr(pool, 'num_requests', None),
+                })
+            stats.append({'es_host': es_host, 'es_port': es_port, 'lookups': self.lookups[(es_host, es_port)], 'nodes': nodes})
+
+        return stats
+
+
+es_clients = ElasticsearchClientRegistry()
+
+
+def get_es_client(dataset_obj):
+    """Shared client for dataset_obj, with the dataset's timeout and retries."""
+    return es_clients.get_dataset_client(dataset_obj)
+
+
+# {(es_host, es_port): client} of the async request being served, see async_es_client_scope
+request_async_es_clients = contextvars.ContextVar('request_async_es_clients', default=None)
+
+
+class AsyncElasticsearchClientRegistry:
+    """
+    AsyncElasticsearch clients of the async search path. An aiohttp connection pool belongs to the event loop it
+    was created in. Under ASGI that loop lives as long as the process, and with ELASTICSEARCH_KEEP_ASYNC_CLIENTS
+    one client per (es_host, es_port) and loop is kept across requests. Otherwise, e.g. under WSGI where every
+    async view runs in an event loop of its own, the clients of a request are created within its
+    async_es_client_scope and closed when it ends.
+    """
+
+    def __init__(self, keep_clients=False):
+        self.keep_clients = keep_clients
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def create_client(self, es_host, es_port):
+        return elasticsearch.AsyncElasticsearch(
+            "http://%s:%s" % (es_host, es_port),
+            connections_per_node=import_from_settings('ELASTICSEARCH_CONNECTIONS_PER_NODE', 10),
+            request_timeout=import_from_settings('ELASTICSEARCH_REQUEST_TIMEOUT', 120),
+            max_retries=import_from_settings('ELASTICSEARCH_MAX_RETRIES', 3),
+            retry_on_timeout=True)
+
+    def get_client(self, es_host, es_port):
+        request_clients = request_async_es_clients.get()
+        if not self.keep_clients and request_clients is not None:
+            key = (es_host, str(es_port))
+            if key not in request_clients:
+                request_clients[key] = self.create_client(es_host, es_port)
+            return request_clients[key]
+
+        loop = asyncio.get_running_loop()
+        key = (id(loop), es_host, str(es_port))
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is None or entry[0] is not loop:
+                self.clients = {key: entry for key, entry in self.clients.items() if not entry[0].is_closed()}
+                entry = (loop, self.create_client(es_host, es_port))
+                self.clients[key] = entry
+
+        return entry[1]
+
+    def get_dataset_client(self, dataset_obj):
+        client = self.get_client(dataset_obj.es_host, dataset_obj.es_port)
+        return client.options(request_timeout=dataset_obj.es_timeout,
+                              max_retries=dataset_obj.es_max_retries,
+                              retry_on_timeout=True)
+
+
+async_es_clients = AsyncElasticsearchClientRegistry(import_from_settings('ELASTICSEARCH_KEEP_ASYNC_CLIENTS', False))
+
+
+def get_async_es_client(dataset_obj):
+    """Shared AsyncElasticsearch client of the running event loop for dataset_obj, see get_es_client."""
+    return async_es_clients.get_dataset_client(dataset_obj)
+
+
+@contextlib.asynccontextmanager
+async def async_es_client_scope():
+    """
+    Scope of an async request: the clients get_async_es_client creates within it are closed on exit, unless
+    ELASTICSEARCH_KEEP_ASYNC_CLIENTS keeps them for the next requests.
+    """
+    clients = {}
+    token = request_async_es_clients.set(clients)
+    try:
+        yield
+    finally:
+        request_async_es_clients.reset(token)
+        for client in clients.values():
+            await client.close()
+
+
+class SearchResultCache:
+    """
+    In-process LRU cache of parsed search results, bounded by number of entries and age.
+
+    Keys come from BaseSearchElasticsearch.get_result_cache_key and include the index generation and the review
+    state, so entries of a reloaded or re-annotated index are never served again and simply age out.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+search_result_cache = SearchResultCache(import_from_settings('SEARCH_RESULT_CACHE_SIZE', 128),
+                                        import_from_settings('SEARCH_RESULT_CACHE_TTL', 600))
+
+# (es_host, es_port, index) -> (expires, generation); the generation is looked up at most every few seconds
+INDEX_GENERATION_TTL = 5
+INDEX_GENERATION_METRICS = ['docs', 'indexing', 'refresh']
+index_generations = {}
+
+
+def get_index_generation(dataset_obj):
+    """
+    Token that changes whenever the documents searchable in the dataset's index change: the index is recreated,
+    documents are loaded or updated, e.g. by Mendelian annotation, and refreshed.
+    """
+    key = (dataset_obj.es_host, str(dataset_obj.es_port), dataset_obj.es_index_name)
+    cached = index_generations.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    es = get_es_client(dataset_obj)
+    stats = es.indices.stats(index=dataset_obj.es_index_name, metric=INDEX_GENERATION_METRICS)
+    return set_index_generation(key, stats)
+
+
+async def async_get_index_generation(dataset_obj):
+    """get_index_generation for async code, sharing its cache."""
+    key = (dataset_obj.es_host, str(dataset_obj.es_port), dataset_obj.es_index_name)
+    cached = index_generations.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    es = get_async_es_client(dataset_obj)
+    stats = await es.indices.stats(index=dataset_obj.es_index_name, metric=INDEX_GENERATION_METRICS)
+    return set_index_generation(key, stats)
+
+
+def set_index_generation(key, stats):
+    primaries = stats['_all']['primaries']
+    generation = [sorted(index_stats.get('uuid', name) for name, index_stats in stats['indices'].items()),
+                  primaries['docs']['count'],
+                  primaries['docs']['deleted'],
+                  primaries['indexing']['index_total'],
+                  primaries['indexing']['delete_total'],
+                  primaries['refresh']['total']]
+
+    index_generations[key] = (time.monotonic() + INDEX_GENERATION_TTL, generation)
+    return generation
+
+
+class DatasetMetadata:
+    """
+    Search configuration of one dataset read from the database at once: its filter fields with their form,
+    widget and Elasticsearch filter types and choices, its attribute fields, and which filter fields are on
+    visible panels. Model instances are shared by all requests of the process and must not be modified.
+    """
+
+    def __init__(self, dataset_obj):
+        self.config_version = dataset_obj.config_version
+        self.filter_fields = OrderedDict(
+            (ele.id, ele) for ele in core_models.FilterField.objects.filter(dataset=dataset_obj).select_related(
+                'widget_type', 'form_type', 'es_filter_type').order_by('pk'))
+
+        filter_field_choices = defaultdict(list)
+        for filter_field_id, value in core_models.FilterFieldChoice.objects.filter(
+                filter_field__dataset=dataset_obj).order_by('pk').values_list('filter_field_id', 'value'):
+            filter_field_choices[filter_field_id].append(value)
+        self.filter_field_choices = dict(filter_field_choices)
+
+        self.visible_filter_field_ids = set(core_models.FilterField.objects.filter(
+            Q(filterpanel__is_visible=True) | Q(filtersubpanel__is_visible=True),
+            dataset=dataset_obj, is_visible=True).values_list('id', flat=True))
+
+        self.attribute_fields = OrderedDict(
+            (ele.id, ele) for ele in core_models.AttributeField.objects.filter(dataset=dataset_obj).order_by('pk'))
+        # the search log keeps the header as serialized AttributeFields
+        self.serialized_attribute_fields = {ele['pk']: json.dumps(ele, cls=DjangoJSONEncoder)
+                                            for ele in serializers.serialize('python', self.attribute_fields.values())}
+
+    def get_filter_fields(self, ids):
+        ids = {str(ele) for ele in ids}
+        return [ele for ele in self.filter_fields.values() if str(ele.id) in ids]
+
+    def get_filter_field_choices(self, filter_field_obj):
+        return self.filter_field_choices.get(filter_field_obj.id, [])
+
+    def get_attribute_fields(self, ids):
+        ids = {str(ele) for ele in ids}
+        return [ele for ele in self.attribute_fields.values() if str(ele.id) in ids]
+
+    def serialize_header(self, header):
+        """serializers.serialize("json", header) from the AttributeFields serialized once per process."""
+        if not all(ele.id in self.serialized_attribute_fields for ele in header):
+            return serializers.serialize("json", header)
+        return '[%s]' % ', '.join(self.serialized_attribute_fields[ele.id] for ele in header)
+
+
+class DatasetMetadataRegistry:
+    """
+    DatasetMetadata of every dataset used by the process, loaded on first use and loaded again when the
+    config_version of the dataset changes, which every change of its filter or attribute configuration does.
+    Checking the version costs nothing as it is read with the dataset itself.
+    """
+
+    def __init__(self):
+        self.datasets = {}
+        self.lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, dataset_obj):
+        metadata = self.datasets.get(dataset_obj.id)
+        if metadata is None or metadata.config_version != dataset_obj.config_version:
+            with self.lock:
+                metadata = self.datasets.get(dataset_obj.id)
+                if metadata is None or metadata.config_version != dataset_obj.config_version:
+                    metadata = DatasetMetadata(dataset_obj)
+                    self.datasets[dataset_obj.id] = metadata
+                    self.loads += 1
+        return metadata
+
+    def get_stats(self):
+        return {
+            'datasets': {dataset_id: metadata.config_version for dataset_id, metadata in list(self.datasets.items())},
+            'loads': self.loads,
+        }
+
+
+dataset_metadata = DatasetMetadataRegistry()
+
+
+def get_dataset_metadata(dataset_obj):
+    return dataset_metadata.get(dataset_obj)
+
+
+def get_review_version(dataset_obj, group_obj):
+    """Changes whenever a review of the group in the dataset is created, changed or deleted."""
+    version = core_models.DocumentReview.objects.filter(dataset=dataset_obj, group=group_obj).aggregate(
+        count=Count('id'), modified=Max('modified'))
+    return [group_obj.id, version['count'], version['modified']]
+
+
+# buckets per page of a composite aggregation over all values of a field
+FIELD_VALUES_PAGE_SIZE = 10000
+
+
+def iterate_field_values(es, index_name, field_es_name, field_path, page_size=FIELD_VALUES_PAGE_SIZE):
+    """
+    Every distinct value of a field, inside the nested objects of field_path when set, one composite aggregation
+    page at a time, so fields with more values than a terms aggregation returns are read completely.
+    """
+    field = '%s.%s' % (field_path, field_es_name) if field_path else field_es_name
+    after_key = None
+    while True:
+        composite = {"size": page_size, "sources": [{"value": {"terms": {"field": field}}}]}
+        if after_key:
+            composite["after"] = after_key
+        if field_path:
+            aggs = {"values": {"nested": {"path": field_path}, "aggs": {"values": {"composite": composite}}}}
+        else:
+            aggs = {"values": {"composite": composite}}
+
+        results = es.search(index=index_name, body={"size": 0, "aggs": aggs}, request_timeout=240)
+        aggregation = results["aggregations"]["values"]
+        if field_path:
+            aggregation = aggregation["values"]
+
+        for bucket in aggregation["buckets"]:
+            yield bucket["key"]["value"]
+
+        after_key = aggregation.get("after_key")
+        if len(aggregation["buckets"]) < page_size or not after_key:
+            return
 
 
 def get_values_from_es(dataset_es_index_name,
@@ -27,53 +438,14 @@ def get_values_from_es(dataset_es_index_name,
                        dataset_es_port,
                        field_es_name,
                        field_path):
-
-    # es = elasticsearch.Elasticsearch(host=dataset_es_host, port=dataset_es_port)
-    # Changing declaratio of client for elasticsearch 8+ (https://www.elastic.co/guide/en/elasticsearch/client/python-api/current/migration.html#migration-options)
-    es = elasticsearch.Elasticsearch("http://"+dataset_es_host+":"+dataset_es_port)
-
-    if not field_path:
-        body_non_nested_template = """
-            {
-                "size": 0,
-                "aggs" : {
-                    "values" : {
-                        "terms" : { "field" : "%s", "size" : 30000 }
-                    }
-                }
-            }
-        """
-        body = json.loads(body_non_nested_template % (field_es_name))
-        results = es.search(index=dataset_es_index_name, body=body, request_timeout=120)
-        return natsorted([ele['key'] for ele in results["aggregations"]["values"]["buckets"] if ele['key']])
-
-    elif field_path:
-        body_nested_template = """
-            {
-                "size": 0,
-                "aggs" : {
-                    "values" : {
-                        "nested" : {
-                            "path" : "%s"
-                        },
-                        "aggs" : {
-                            "values" : {"terms" : {"field" : "%s.%s", "size" : 30000}}
-                        }
-                    }
-                }
-            }
-        """
-        body = json.loads(body_nested_template % (field_path,
-                              field_path,
-                              field_es_name))
-
-        results = es.search(index=dataset_es_index_name,
-                    body=body, request_timeout=240)
-        return natsorted([ele['key'] for ele in results["aggregations"]["values"]["values"]["buckets"] if ele['key']])
+    """All non empty values of a field, natural sorted; core.catalogs keeps them cached per dataset."""
+    es = es_clients.get_client(dataset_es_host, dataset_es_port)
+    values = iterate_field_values(es, dataset_es_index_name, field_es_name, field_path)
+    return natsorted([value for value in values if value])
 
 
 def get_es_document(dataset_obj, document_id):
-    es = elasticsearch.Elasticsearch(host=dataset_obj.es_host)
+    es = get_es_client(dataset_obj)
     result = es.get(index=dataset_obj.es_index_name, 
             id=document_id)
     return result["_source"]
@@ -111,6 +483,11 @@ def get_user_group_for_reviewing(dataset_obj, user_obj):
         return (group_obj, None)
 
 
+def user_can_access_dataset(dataset_obj, user_obj):
+    """Same rule as the dataset choices of core.forms.DatasetForm: public, or allowed to one of the user's groups."""
+    return dataset_obj.is_public or dataset_obj.allowed_groups.filter(
+        id__in=user_obj.groups.values_list('id', flat=True)).exists()
+
 
 class ElasticSearchFilter:
 
@@ -136,6 +513,8 @@ class ElasticSearchFilter:
         self.nested_filter_range_gte = {}
         self.nested_filter_range_lte = {}
 
+        self.filter_region = []
+
         self.filter_exists = []
         self.must_not_exists = []
         self.nested_filter_exists = {}
@@ -239,6 +618,12 @@ class ElasticSearchFilter:
         if list(self.nested_filter_range_lte):
             return self.nested_filter_range_lte
 
+    def add_filter_region(self, field_name, regions):
+        self.filter_region.append((field_name, regions))
+
+    def get_filter_region(self):
+        return self.filter_region
+
     def add_filter_exists(self, field_name, value):
         self.filter_exists.append((field_name, value))
 
@@ -291,6 +676,12 @@ class ElasticSearchFilter:
         }
         return nested
 
+    def get_terms_query(self, field_name, value):
+        """terms query of a list of values, or terms lookups of a stored gene set, see core.gene_sets.GeneSetLookup."""
+        if hasattr(value, 'get_terms_query'):
+            return value.get_terms_query(field_name)
+        return {"terms": {field_name: value}}
+
     def generate_query_string(self):
         query_string = {
             "size": self.size,
@@ -316,7 +707,7 @@ class ElasticSearchFilter:
 
             for field_name, value in filter_terms:
                 query_string["query"]["bool"]["filter"].append(
-                    {"terms": {field_name: value}})
+                    self.get_terms_query(field_name, value))
 
         if self.get_nested_filter_term():
             nested_filter_term = self.get_nested_filter_term()
@@ -359,14 +750,15 @@ class ElasticSearchFilter:
                     query_string["query"]["bool"]["filter"].remove(nested)
 
                 for field_name, value in nested_filter_terms[path]:
-                    tmp = []
-                    for ele in value:
-                        tmp.extend(ele.split())
-                    value = tmp
+                    if isinstance(value, list):
+                        tmp = []
+                        for ele in value:
+                            tmp.extend(ele.split())
+                        value = tmp
                     path_fieldname = "%s.%s" % (path, field_name)
 
                     nested["nested"]["query"]["bool"]["filter"].append(
-                        {"terms": {path_fieldname: value}})
+                        self.get_terms_query(path_fieldname, value))
                     for ele in self.get_inner_hits_source_path(path):
                         if ele not in nested["nested"]["inner_hits"]["_source"]:
                             nested["nested"]["inner_hits"][
@@ -532,6 +924,19 @@ class ElasticSearchFilter:
 
                 query_string["query"]["bool"]["filter"].append(nested)
 
+        if self.get_filter_region():
+            filter_region = self.get_filter_region()
+
+            if "filter" not in query_string["query"]["bool"]:
+                query_string["query"]["bool"]["filter"] = []
+
+            for field_name, regions in filter_region:
+                query_string["query"]["bool"]["filter"].append(
+                    get_region_query(regions, pos_field=field_name))
+
+            # hits in the order of an index sorted on CHROM and POS, whose shards then stop after the first size hits
+            query_string["sort"] = PAGE_SORT
+
         if self.get_source():
             query_string["_source"] = sorted(list(set(self.get_source())))
 
@@ -541,7 +946,34 @@ class ElasticSearchFilter:
         return query_string
 
 
+def get_rejected_document_ids(dataset_obj, group_obj):
+    return list(core_models.DocumentReview.objects.filter(
+        dataset=dataset_obj, group=group_obj, status='Rejected').values_list('document_es_id', flat=True))
+
+
+def exclude_rejected_documents_from_query(query_body, dataset_obj, user_obj):
+    """
+    Copy of query_body that leaves out, on the Elasticsearch side, the documents rejected by the review group of
+    user_obj. Costs one database query for the group and one for the rejected ids, whatever the number of hits.
+    """
+    group_obj, message = get_user_group_for_reviewing(dataset_obj, user_obj)
+    if not group_obj:
+        return query_body
+
+    rejected_ids = get_rejected_document_ids(dataset_obj, group_obj)
+    if not rejected_ids:
+        return query_body
+
+    query_body = copy.deepcopy(query_body)
+    query_bool = query_body.setdefault('query', {'bool': {}}).setdefault('bool', {})
+    query_bool.setdefault('must_not', []).append({"ids": {"values": rejected_ids}})
+
+    return query_body
+
+
 class BaseElasticSearchQueryDSL:
+    # long gene lists of terms filters are stored as gene sets, see core.gene_sets.get_gene_set_lookup
+    create_gene_sets = True
 
     def __init__(self, dataset_obj, filter_form_data, attribute_form_data, attribute_order):
         self.dataset_obj = dataset_obj
@@ -558,9 +990,10 @@ class BaseElasticSearchQueryDSL:
         self.attributes_selected = []
         self.base_query_body = None
         self.base_query_header = None
+        self.metadata = get_dataset_metadata(dataset_obj)
 
     def determine_selected_attirbute_fields(self):
-        for attribute_field_obj in core_models.AttributeField.objects.filter(id__in=self.attribute_form_data.keys()):
+        for attribute_field_obj in self.metadata.get_attribute_fields(self.attribute_form_data.keys()):
             key = str(attribute_field_obj.id)
             val = self.attribute_form_data[key]
             if val:
@@ -587,7 +1020,7 @@ class BaseElasticSearchQueryDSL:
             order, pk = val.split('-')
             pks_orders[int(pk)] = order
 
-        for attribute_field_obj in core_models.AttributeField.objects.filter(id__in=list(pks_orders)):
+        for attribute_field_obj in self.metadata.get_attribute_fields(pks_orders):
             es_name = attribute_field_obj.es_name
             path = attribute_field_obj.path
             if path:
@@ -603,13 +1036,16 @@ class BaseElasticSearchQueryDSL:
             self.attributes_selected.append('%d' % (ele.id))
 
     def generate_base_query_from_filters(self):
+        # gene sets need the models and clients of this module
+        from core.gene_sets import get_gene_set_lookup
+
         es_filter = ElasticSearchFilter()
         keys = self.filter_form_data.keys()
         dict_filter_fields = {}
         source_fields = []
         inner_hits_source_fields = {}
 
-        for filter_field_obj in core_models.FilterField.objects.filter(id__in=keys).select_related('widget_type', 'form_type', 'es_filter_type'):
+        for filter_field_obj in self.metadata.get_filter_fields(keys):
             key = str(filter_field_obj.id)
             data = self.filter_form_data[key]
 
@@ -645,7 +1081,12 @@ class BaseElasticSearchQueryDSL:
                     es_filter.add_filter_term(es_name, data)
 
             elif es_filter_type == 'filter_terms' and isinstance(data, str):
-                es_filter.add_filter_terms(es_name, data.splitlines())
+                gene_set_lookup = get_gene_set_lookup(self.dataset_obj, data.splitlines(), create=self.create_gene_sets)
+                if gene_set_lookup:
+                    self.filters_used[key] = gene_set_lookup.get_reference()
+                    es_filter.add_filter_terms(es_name, gene_set_lookup)
+                else:
+                    es_filter.add_filter_terms(es_name, data.splitlines())
 
             elif es_filter_type == 'filter_terms' and isinstance(data, list):
                 es_filter.add_filter_terms(es_name, data)
@@ -682,7 +1123,15 @@ class BaseElasticSearchQueryDSL:
 
             elif es_filter_type == 'nested_filter_terms' and isinstance(data, str):
                 data_split = data.splitlines()
-                if filter_field_obj.es_data_type == 'text':
+                gene_set_lookup = get_gene_set_lookup(
+                    self.dataset_obj, data_split,
+                    lowercase=filter_field_obj.es_data_type == 'text' and filter_field_obj.es_text_analyzer != 'whitespace',
+                    create=self.create_gene_sets)
+                if gene_set_lookup:
+                    self.filters_used[key] = gene_set_lookup.get_reference()
+                    es_filter.add_nested_filter_terms(
+                        es_name, gene_set_lookup, filter_field_obj.path)
+                elif filter_field_obj.es_data_type == 'text':
                     if filter_field_obj.es_text_analyzer != 'whitespace':
                         data_split_lower = [ele.lower()
                                             for ele in data_split]
@@ -735,6 +1184,12 @@ class BaseElasticSearchQueryDSL:
                 dict_filter_fields[filter_field_pk].append(
                     float(data.strip()))
 
+            elif es_filter_type == 'filter_region':
+                regions = parse_regions(data.splitlines())
+                if not regions:
+                    raise ValidationError('No regions in %s!' % (filter_field_obj.display_text))
+                es_filter.add_filter_region(es_name, regions)
+
             elif es_filter_type == 'filter_exists':
                 if data == 'only':
                     es_filter.add_filter_exists(es_name, data)
@@ -814,6 +1269,15 @@ class BaseElasticSearchQueryDSL:
         return self.nested_attributes_selected
 
 
+# sort of paged results; the point in time adds its _shard_doc tiebreaker, which makes the order total
+PAGE_SORT = [
+    {"CHROM": {"order": "asc", "unmapped_type": "keyword"}},
+    {"POS": {"order": "asc", "unmapped_type": "long"}},
+]
+PAGE_KEEP_ALIVE = '10m'
+PAGE_SIZE = 100
+
+
 class BaseElasticSearchQueryExecutor:
 
     def __init__(self, dataset_obj, query_body, elasticsearch_terminate_after=0):
@@ -822,12 +1286,21 @@ class BaseElasticSearchQueryExecutor:
         self.elasticsearch_terminate_after = elasticsearch_terminate_after
         self.elasticsearch_response = None
 
+    def get_search_body(self):
+        """
+        query_body as searched for the hits. Nothing reads the total of this search, async_search counts the hits
+        with async_count and search does not count them, so a query sorted like an index sorted on CHROM and POS,
+        see the region filter of ElasticSearchFilter, skips counting and can stop early.
+        """
+        if 'sort' in self.query_body:
+            return dict(self.query_body, track_total_hits=False)
+        return self.query_body
+
     def excecute_elasticsearch_query(self):
-        es = elasticsearch.Elasticsearch(
-            host=self.dataset_obj.es_host, port=self.dataset_obj.es_port)
+        es = get_es_client(self.dataset_obj)
         response = es.search(
             index=self.dataset_obj.es_index_name,
-            body=json.dumps(self.query_body),
+            body=json.dumps(self.get_search_body()),
             request_timeout=120,
             terminate_after=self.elasticsearch_terminate_after)
 
@@ -837,6 +1310,54 @@ class BaseElasticSearchQueryExecutor:
         self.excecute_elasticsearch_query()
         return self.elasticsearch_response
 
+    async def async_get_elasticsearch_response(self):
+        es = get_async_es_client(self.dataset_obj)
+        self.elasticsearch_response = await es.search(
+            index=self.dataset_obj.es_index_name,
+            body=self.get_search_body(),
+            terminate_after=self.elasticsearch_terminate_after)
+
+        return self.elasticsearch_response
+
+    async def async_count(self):
+        """Total number of hits of the query, which the search itself stops counting at terminate_after."""
+        es = get_async_es_client(self.dataset_obj)
+        body = {'query': self.query_body['query']} if 'query' in self.query_body else None
+        response = await es.count(index=self.dataset_obj.es_index_name, body=body)
+        return response['count']
+
+    def get_page_query_body(self):
+        return self.query_body
+
+    def process_page_hits(self, hits):
+        return hits
+
+    def search_page(self, pit_id, search_after, page_size):
+        """
+        One query for page_size hits sorted by PAGE_SORT, after the sort values search_after of the last hit
+        of the previous page, in the point in time pit_id. Returns the point in time id to use for the next page.
+        """
+        es = get_es_client(self.dataset_obj)
+        if pit_id is None:
+            pit_id = es.open_point_in_time(index=self.dataset_obj.es_index_name, keep_alive=PAGE_KEEP_ALIVE)['id']
+
+        query_body = copy.deepcopy(self.get_page_query_body())
+        query_body['size'] = page_size
+        query_body['sort'] = PAGE_SORT
+        query_body['pit'] = {'id': pit_id, 'keep_alive': PAGE_KEEP_ALIVE}
+        if search_after:
+            query_body['search_after'] = search_after
+
+        try:
+            response = es.search(body=query_body)
+        except elasticsearch.NotFoundError:
+            raise SearchPageExpired('Search results expired, please run the search again.')
+
+        response['hits']['hits'] = self.process_page_hits(response['hits']['hits'])
+        self.elasticsearch_response = response
+
+        return response.get('pit_id', pit_id)
+
     def get_elasticsearch_response_time(self):
         return self.elasticsearch_response.get('took')
 
@@ -844,6 +1365,7 @@ class BaseElasticSearchQueryExecutor:
 class BaseElasticsearchResponseParser:
     flatten_nested = True
     maximum_table_size = 400
+    maximum_rows_per_hit = MAX_FLATTENED_ROWS_PER_HIT
     fields_to_skip_flattening = []
 
     def __init__(self, elasticsearch_response, non_nested_attribute_fields, nested_attribute_fields, nested_attributes_selected, limit_results=True):
@@ -900,53 +1422,14 @@ class BaseElasticsearchResponseParser:
     def flatten_nested_results(self):
 
         if self.nested_attribute_fields:
-            flattened_results = []
-            results_count = 0
-            for idx, result in enumerate(self.results):
-
-                if self.limit_results and results_count > self.maximum_table_size:
-                    break
-                combined = False
-                combined_nested = None
-                for idx, path in enumerate(self.nested_attribute_fields):
-                    for field_to_skip in self.fields_to_skip_flattening:
-                        if path.startswith(field_to_skip):
-                            continue
-
-                    if path not in result:
-                        continue
-
-                    if not combined:
-                        combined_nested = result[path]
-                        combined = True
-                        continue
-                    else:
-                        combined_nested = list(itertools.product(
-                            combined_nested, result[path]))
-                        combined_nested = self.merge_two_dicts_array(
-                            combined_nested)
-
-                tmp_non_nested = self.subset_dict(
-                    result, self.non_nested_attribute_fields)
-                if combined_nested:
-                    tmp_output = list(itertools.product(
-                        [tmp_non_nested, ], combined_nested))
-
-                    for x, y in tmp_output:
-                        tmp = self.merge_two_dicts(x, y)
-                        tmp["es_id"] = result["es_id"]
-
-                        for field_to_skip in self.fields_to_skip_flattening:
-                            if result.get(field_to_skip):
-                                tmp[field_to_skip] = result[field_to_skip]
-
-                        if tmp not in flattened_results:
-                            flattened_results.append(tmp)
-                            results_count += 1
-                else:
-                    if result not in flattened_results:
-                        flattened_results.append(result)
-                        results_count += 1
+            flattened_results = flatten_results(self.results,
+                                                self.nested_attribute_fields,
+                                                self.non_nested_attribute_fields,
+                                                self.fields_to_skip_flattening,
+                                                self.maximum_rows_per_hit)
+            if self.limit_results:
+                flattened_results = itertools.islice(flattened_results, self.maximum_table_size)
+            flattened_results = list(flattened_results)
         else:
             flattened_results = self.results
 
@@ -992,6 +1475,7 @@ class BaseSearchElasticsearch:
         self.search_log_id = None
         self.exclude_rejected_documents = kwargs.get('exclude_rejected_documents')
         self.limit_results = kwargs.get('limit_results', True)
+        self.total_hits = None
 
     def run_elasticsearch_dsl(self):
         elasticsearch_dsl = self.elasticsearch_dsl_class(
@@ -1006,9 +1490,55 @@ class BaseSearchElasticsearch:
         self.non_nested_attributes_selected = elasticsearch_dsl.get_non_nested_attributes_selected()
         self.nested_attributes_selected = elasticsearch_dsl.get_nested_attributes_selected()
 
+    def get_result_cache_key_parts(self):
+        review_version = None
+        if self.user.is_authenticated and self.exclude_rejected_documents == 'true':
+            group_obj, message = get_user_group_for_reviewing(self.dataset_obj, self.user)
+            review_version = get_review_version(self.dataset_obj, group_obj) if group_obj else message
+
+        return {
+            'dataset': self.dataset_obj.id,
+            'index_generation': get_index_generation(self.dataset_obj),
+            'query_body': self.query_body,
+            'executor': self.elasticsearch_query_executor_class.__qualname__,
+            'parser': self.elasticsearch_response_parser_class.__qualname__,
+            'non_nested_attribute_fields': self.non_nested_attribute_fields,
+            'nested_attribute_fields': self.nested_attribute_fields,
+            'nested_attributes_selected': self.nested_attributes_selected,
+            'limit_results': self.limit_results,
+            'exclude_rejected_documents': self.exclude_rejected_documents,
+            'review_version': review_version,
+        }
+
+    def get_result_cache_key(self):
+        key_parts = json.dumps(self.get_result_cache_key_parts(), sort_keys=True, default=str)
+        return hashlib.sha1(key_parts.encode('utf-8')).hexdigest()
+
+    def run_query_and_parse(self):
+        self.run_elasticsearch_query_executor()
+        self.run_elasticsearch_response_parser_class()
+
+    def run_query_and_parse_cached(self):
+        key = self.get_result_cache_key()
+        cached_results = search_result_cache.get(key)
+        if cached_results is not None:
+            # served without asking elasticsearch
+            self.results = cached_results
+            self.elasticsearch_response_time = 0
+            return
+
+        self.run_query_and_parse()
+        search_result_cache.set(key, self.results)
+
+    def get_executed_query_body(self):
+        """query_body as sent to Elasticsearch; the logged query_body leaves review state out."""
+        if self.user.is_authenticated and self.exclude_rejected_documents == 'true':
+            return exclude_rejected_documents_from_query(self.query_body, self.dataset_obj, self.user)
+        return self.query_body
+
     def run_elasticsearch_query_executor(self):
         elasticsearch_query_executor = self.elasticsearch_query_executor_class(
-            self.dataset_obj, self.query_body)
+            self.dataset_obj, self.get_executed_query_body())
         self.elasticsearch_response = elasticsearch_query_executor.get_elasticsearch_response()
         self.elasticsearch_response_time = elasticsearch_query_executor.get_elasticsearch_response_time()
 
@@ -1017,25 +1547,10 @@ class BaseSearchElasticsearch:
             self.elasticsearch_response, self.non_nested_attribute_fields, self.nested_attribute_fields, self.nested_attributes_selected, limit_results=self.limit_results)
         self.results = elasticsearch_response_parser.get_results()
 
-    def run_exclude_rejected_documents(self):
-        if self.user.is_authenticated and self.exclude_rejected_documents == 'true':
-            group_obj, message = get_user_group_for_reviewing(self.dataset_obj, self.user)
-            tmp_results = []
-            if group_obj:
-                for result in self.results:
-                    if core_models.DocumentReview.objects.filter(document_es_id=result.get('es_id'), group=group_obj).exists():
-                        document_review_obj = core_models.DocumentReview.objects.get(document_es_id=result.get('es_id'), group=group_obj)
-                        if document_review_obj.status != 'Rejected':
-                            tmp_results.append(result)
-                    else:
-                        tmp_results.append(result)
-
-            self.results = tmp_results
-
     def log_search(self):
 
         # convert to json
-        header_json = serializers.serialize("json", self.header)
+        header_json = get_dataset_metadata(self.dataset_obj).serialize_header(self.header)
         # pprint.pprint(self.query_body)
         query_body_json = json.dumps(self.query_body)
 
@@ -1073,9 +1588,44 @@ class BaseSearchElasticsearch:
 
     def search(self):
         self.run_elasticsearch_dsl()
-        self.run_elasticsearch_query_executor()
+        self.run_query_and_parse_cached()
+        self.log_search()
+
+    async def async_run_elasticsearch_query_executor(self):
+        elasticsearch_query_executor = self.elasticsearch_query_executor_class(
+            self.dataset_obj, await sync_to_async(self.get_executed_query_body)())
+        self.elasticsearch_response, self.total_hits = await asyncio.gather(
+            elasticsearch_query_executor.async_get_elasticsearch_response(),
+            elasticsearch_query_executor.async_count())
+        self.elasticsearch_response_time = elasticsearch_query_executor.get_elasticsearch_response_time()
+
+    async def async_run_query_and_parse(self):
+        await self.async_run_elasticsearch_query_executor()
         self.run_elasticsearch_response_parser_class()
-        self.run_exclude_rejected_documents()
+
+    async def async_search(self):
+        """
+        search() for async views. Database work runs through sync_to_async, Elasticsearch requests are awaited and
+        the independent ones, the hits, their total count and the search log, are issued concurrently.
+        """
+        await sync_to_async(self.run_elasticsearch_dsl)()
+        # fills the index generation cache, so the cache key costs no blocking Elasticsearch request
+        await async_get_index_generation(self.dataset_obj)
+        key = await sync_to_async(self.get_result_cache_key)()
+
+        cached_results = search_result_cache.get(key)
+        if cached_results is not None:
+            self.results = cached_results
+            self.elasticsearch_response_time = 0
+            await sync_to_async(self.log_search)()
+            return
+
+        await asyncio.gather(self.async_run_query_and_parse(), sync_to_async(self.log_search)())
+        search_result_cache.set(key, self.results)
+
+    def log_search_without_results(self):
+        """Build and log the query without running it, for results read from the search log afterwards."""
+        self.run_elasticsearch_dsl()
         self.log_search()
 
     def get_header(self):
@@ -1090,6 +1640,10 @@ class BaseSearchElasticsearch:
     def get_search_log_id(self):
         return self.search_log_id
 
+    def get_total_hits(self):
+        """Total number of hits, only counted by async_search."""
+        return self.total_hits
+
     def get_filters_used(self):
         return self.filters_used
 
@@ -1097,14 +1651,133 @@ class BaseSearchElasticsearch:
         return self.attributes_selected
 
 
+class BaseSearchResultsPage:
+    """
+    Cursor paging through all results of a logged search. The cursor, stored in SearchLog.page_cursor, holds
+    the point in time and the search_after values of every page seen so far, so every page, including going
+    back, costs one query.
+    """
+    elasticsearch_query_executor_class = BaseElasticSearchQueryExecutor
+    elasticsearch_response_parser_class = BaseElasticsearchResponseParser
+    page_size = PAGE_SIZE
+
+    def __init__(self, search_log_obj, user_obj):
+        self.search_log_obj = search_log_obj
+        self.dataset_obj = search_log_obj.dataset
+        self.user_obj = user_obj
+        self.header = [ele.object for ele in serializers.deserialize("json", search_log_obj.header)]
+        self.query_body = json.loads(search_log_obj.query)
+        if user_obj.is_authenticated and search_log_obj.exclude_rejected_documents:
+            self.query_body = exclude_rejected_documents_from_query(self.query_body, self.dataset_obj, user_obj)
+        self.nested_attribute_fields = json.loads(search_log_obj.nested_attribute_fields or '[]')
+        self.non_nested_attribute_fields = json.loads(search_log_obj.non_nested_attribute_fields or '[]')
+        self.nested_attributes_selected = json.loads(search_log_obj.nested_attributes_selected or 'null')
+        self.results = []
+        self.elasticsearch_response_time = None
+        self.page_number = None
+        self.has_next_page = False
+
+    def get_cursor(self, restart):
+        if restart or not self.search_log_obj.page_cursor:
+            return {'pit_id': None, 'search_after': [None]}
+        return json.loads(self.search_log_obj.page_cursor)
+
+    def get_elasticsearch_query_executor(self):
+        return self.elasticsearch_query_executor_class(self.dataset_obj, self.query_body)
+
+    def get_page(self, page_number, restart=False):
+        """page_number starts at 1; pages up to one past the furthest page seen so far can be requested."""
+        cursor = self.get_cursor(restart)
+        page_number = max(1, min(page_number, len(cursor['search_after'])))
+
+        elasticsearch_query_executor = self.get_elasticsearch_query_executor()
+        cursor['pit_id'] = elasticsearch_query_executor.search_page(
+            cursor['pit_id'], cursor['search_after'][page_number - 1], self.page_size)
+        elasticsearch_response = elasticsearch_query_executor.get_elasticsearch_response()
+        hits = elasticsearch_response['hits']['hits']
+
+        self.has_next_page = len(hits) == self.page_size
+        if self.has_next_page and len(cursor['search_after']) == page_number:
+            cursor['search_after'].append(hits[-1]['sort'])
+
+        elasticsearch_response_parser = self.elasticsearch_response_parser_class(
+            elasticsearch_response, self.non_nested_attribute_fields, self.nested_attribute_fields,
+            self.nested_attributes_selected, limit_results=False)
+        self.results = elasticsearch_response_parser.get_results()
+
+        self.elasticsearch_response_time = elasticsearch_response.get('took')
+        self.page_number = page_number
+        self.search_log_obj.page_cursor = json.dumps(cursor)
+        self.search_log_obj.save(update_fields=['page_cursor', 'modified'])
+
+        return self.results
+
+
+def get_result_record(header, result):
+    """A result row as typed values in header order, with the id of its document, as served by the search API."""
+    return {'es_id': result.get('es_id'), 'values': [result.get(ele.es_name) for ele in header]}
+
+
+# hits above which a download is read as sliced scrolls in parallel, see BaseDownloadAllResults.get_number_of_slices
+SLICED_EXPORT_MIN_HITS = 100000
+# hits each slice may read ahead of the rows being written out
+SLICE_QUEUE_SIZE = 1000
+SLICE_DONE = object()
+
+
+def position_sort_key(sort_values):
+    """Sort values of a hit sorted by PAGE_SORT as a key that orders like Elasticsearch, missing values last."""
+    return tuple((value is None, value) for value in sort_values)
+
+
+def put_unless_stopped(output_queue, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            output_queue.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def iterate_slice_queue(output_queue, number_of_slices):
+    """Items put on output_queue by number_of_slices read_slice workers, re-raising the error of a failed one."""
+    while number_of_slices:
+        item = output_queue.get()
+        if item is SLICE_DONE:
+            number_of_slices -= 1
+        elif isinstance(item, Exception):
+            raise item
+        else:
+            yield item
+
+
 class BaseDownloadAllResults:
+    """
+    All rows of a logged search, for full result downloads. Large result sets are read as parallel sliced scrolls
+    (EXPORT_SCROLL_SLICES); with order_by_position the rows come out sorted by CHROM and POS.
+
+    row_format 'text' gives the values as strings, 'typed' as loaded from Elasticsearch, 'records' typed values
+    with the document id (get_result_record), and 'nested' one typed row per hit with the fields of each nested
+    path as a list of dicts, instead of flattening them.
+    """
+    row_generators = {
+        'text': 'generate_row',
+        'typed': 'generate_typed_row',
+        'records': 'generate_record',
+    }
     flatten_nested = True
+    maximum_rows_per_hit = MAX_FLATTENED_ROWS_PER_HIT
     fields_to_skip_flattening = []
 
-    def __init__(self, search_log_obj):
+    def __init__(self, search_log_obj, order_by_position=False, row_format='text'):
         self.search_log_obj = search_log_obj
+        self.order_by_position = order_by_position
+        self.row_format = row_format
         self.results = []
         self.flattened_results = []
+        self.hits_processed = 0
+        self.total_hits = None
         self.header = [ele.object for ele in serializers.deserialize("json", self.search_log_obj.header)]
         self.query_body = json.loads(self.search_log_obj.query)
         if self.search_log_obj.nested_attribute_fields:
@@ -1135,110 +1808,170 @@ class BaseDownloadAllResults:
         return output
 
     def generate_row(self, header, tmp_source):
-        tmp = []
-        for ele in header:
-            tmp.append(str(tmp_source.get(ele.es_name, None)))
-
-        return tmp
-
-    def yield_rows(self):
+        return [str(tmp_source.get(ele.es_name, None)) for ele in header]
 
+    def generate_typed_row(self, header, tmp_source):
+        return [tmp_source.get(ele.es_name) for ele in header]
 
-        header_keys = [ele.display_text for ele in self.header]
-        yield header_keys
-
-        es = elasticsearch.Elasticsearch(
-            host=self.search_log_obj.dataset.es_host)
-        for hit in elasticsearch.helpers.scan(es,
-                                              query=self.query_body,
-                                              scroll=u'5m',
-                                              size=1000,
-                                              preserve_order=False,
-                                              index=self.search_log_obj.dataset.es_index_name,
-                                              ):
-            tmp_source = hit['_source']
-            es_id = hit['_id']
-
-
-            if self.search_log_obj.user != None and self.search_log_obj.user.is_authenticated and self.search_log_obj.exclude_rejected_documents:
-                group_obj, message = get_user_group_for_reviewing(self.search_log_obj.dataset, self.search_log_obj.user)
-                if core_models.DocumentReview.objects.filter(document_es_id=es_id, group=group_obj).exists():
-                    document_review_obj = core_models.DocumentReview.objects.get(document_es_id=es_id, group=group_obj)
-                    if document_review_obj.status == 'Rejected':
-                        continue
-
-
-            inner_hits = hit.get('inner_hits')
-
-            tmp_source['es_id'] = es_id
-            if inner_hits:
-                for key, value in inner_hits.items():
-                    if key not in tmp_source:
-                        tmp_source[key] = []
-                    hits_hits_array = inner_hits[key]['hits']['hits']
-                    for hit in hits_hits_array:
-                        tmp_hit_dict = {}
-                        for hit_key, hit_value in hit['_source'].items():
-                            tmp_hit_dict[hit_key] = hit_value
-
-                        if tmp_hit_dict:
-                            tmp_source[key].append(tmp_hit_dict)
-            self.results = [tmp_source, ]
+    def generate_record(self, header, tmp_source):
+        return get_result_record(header, tmp_source)
 
-            if self.flatten_nested:
-                self.flatten_nested_results()
-
-            for idx, result in enumerate(self.results):
-                row = self.generate_row(self.header, result)
-                yield row
-
-    def flatten_nested_results(self):
-        if self.nested_attribute_fields:
-            flattened_results = []
-            results_count = 0
-            for idx, result in enumerate(self.results):
-                combined = False
-                combined_nested = None
-                for idx, path in enumerate(self.nested_attribute_fields):
-                    for field_to_skip in self.fields_to_skip_flattening:
-                        if path.startswith(field_to_skip):
-                            continue
-
-                    if path not in result:
-                        continue
-
-                    if not combined:
-                        combined_nested = result[path]
-                        combined = True
-                        continue
-                    else:
-                        combined_nested = list(itertools.product(combined_nested, result[path]))
-                        combined_nested = self.merge_two_dicts_array(combined_nested)
+    def get_header_paths(self):
+        """Nested paths of the selected attributes, in header order."""
+        return list(dict.fromkeys(ele.path for ele in self.header if ele.path))
 
-                tmp_non_nested = self.subset_dict(result, self.non_nested_attribute_fields)
+    def generate_nested_row(self, header, tmp_source):
+        row = [tmp_source.get(ele.es_name) for ele in header if not ele.path]
+        for path in self.get_header_paths():
+            es_names = [ele.es_name for ele in header if ele.path == path]
+            row.append([{es_name: inner_hit.get(es_name) for es_name in es_names} for inner_hit in tmp_source.get(path) or []])
+        return row
 
-                if combined_nested:
-                    tmp_output = list(itertools.product([tmp_non_nested, ], combined_nested))
+    def get_header_keys(self):
+        if self.row_format == 'nested':
+            return [ele.display_text for ele in self.header if not ele.path] + self.get_header_paths()
+        return [ele.display_text for ele in self.header]
 
-                    for x, y in tmp_output:
-                        tmp = self.merge_two_dicts(x, y)
-                        tmp["es_id"] = result["es_id"]
+    def get_query_body(self):
+        query_body = self.query_body
+        if self.search_log_obj.user != None and self.search_log_obj.user.is_authenticated and self.search_log_obj.exclude_rejected_documents:
+            query_body = exclude_rejected_documents_from_query(query_body, self.search_log_obj.dataset, self.search_log_obj.user)
+        if self.order_by_position:
+            query_body = dict(query_body, sort=PAGE_SORT)
+        return query_body
+
+    def count_hits(self):
+        """Number of hits the download will go through, for progress reporting."""
+        if self.total_hits is None:
+            es = get_es_client(self.search_log_obj.dataset)
+            query_body = self.get_query_body()
+            body = {'query': query_body['query']} if 'query' in query_body else None
+            self.total_hits = es.count(index=self.search_log_obj.dataset.es_index_name, body=body)['count']
+        return self.total_hits
+
+    def get_number_of_slices(self):
+        number_of_slices = import_from_settings('EXPORT_SCROLL_SLICES', 4)
+        if number_of_slices > 1 and self.count_hits() < SLICED_EXPORT_MIN_HITS:
+            return 1
+        return number_of_slices
+
+    def get_hits(self, query_body):
+        es = get_es_client(self.search_log_obj.dataset)
+        return elasticsearch.helpers.scan(es,
+                                          query=query_body,
+                                          scroll=u'5m',
+                                          size=1000,
+                                          preserve_order=self.order_by_position,
+                                          index=self.search_log_obj.dataset.es_index_name,
+                                          )
+
+    def process_hit(self, hit):
+        tmp_source = hit['_source']
+        es_id = hit['_id']
+
+        inner_hits = hit.get('inner_hits')
+
+        tmp_source['es_id'] = es_id
+        if inner_hits:
+            for key, value in inner_hits.items():
+                if key not in tmp_source:
+                    tmp_source[key] = []
+                hits_hits_array = inner_hits[key]['hits']['hits']
+                for hit in hits_hits_array:
+                    tmp_hit_dict = {}
+                    for hit_key, hit_value in hit['_source'].items():
+                        tmp_hit_dict[hit_key] = hit_value
+
+                    if tmp_hit_dict:
+                        tmp_source[key].append(tmp_hit_dict)
+        return tmp_source
+
+    def get_rows(self, hit):
+        """Rows of one hit. Leaves the object untouched, so slices can be converted in parallel."""
+        results = [self.process_hit(hit), ]
+        if self.row_format == 'nested':
+            return [self.generate_nested_row(self.header, result) for result in results]
+
+        if self.flatten_nested and self.nested_attribute_fields:
+            results = flatten_results(results,
+                                      self.nested_attribute_fields,
+                                      self.non_nested_attribute_fields,
+                                      self.fields_to_skip_flattening,
+                                      self.maximum_rows_per_hit)
+
+        generate_row = getattr(self, self.row_generators[self.row_format])
+        return [generate_row(self.header, result) for result in results]
+
+    def read_slice(self, query_body, output_queue, stop_event):
+        """Worker of a sliced download: puts (sort values, rows) of every hit of one slice on output_queue."""
+        hits = self.get_hits(query_body)
+        try:
+            for hit in hits:
+                if not put_unless_stopped(output_queue, (hit.get('sort'), self.get_rows(hit)), stop_event):
+                    return
+        except Exception as e:
+            put_unless_stopped(output_queue, e, stop_event)
+        finally:
+            hits.close()
+            put_unless_stopped(output_queue, SLICE_DONE, stop_event)
+
+    def yield_sliced_hit_rows(self, query_body, number_of_slices):
+        """
+        Rows of every hit, read as number_of_slices sliced scrolls by a pool of threads. Each slice is sorted by
+        PAGE_SORT when the download is ordered, and the slices are then merged; otherwise hits are taken from
+        whichever slice has one ready.
+        """
+        stop_event = threading.Event()
+        if self.order_by_position:
+            queues = [queue.Queue(SLICE_QUEUE_SIZE) for _ in range(number_of_slices)]
+        else:
+            queues = [queue.Queue(SLICE_QUEUE_SIZE * number_of_slices)] * number_of_slices
 
-                        for field_to_skip in self.fields_to_skip_flattening:
-                            if result.get(field_to_skip):
-                                tmp[field_to_skip] = result[field_to_skip]
+        executor = ThreadPoolExecutor(max_workers=number_of_slices)
+        for slice_id, output_queue in enumerate(queues):
+            slice_query_body = dict(query_body, slice={'id': slice_id, 'max': number_of_slices})
+            executor.submit(self.read_slice, slice_query_body, output_queue, stop_event)
 
-                        if tmp not in flattened_results:
-                            flattened_results.append(tmp)
-                            results_count += 1
-                else:
-                    if result not in flattened_results:
-                        flattened_results.append(result)
-                        results_count += 1
+        try:
+            if self.order_by_position:
+                items = heapq.merge(*[iterate_slice_queue(output_queue, 1) for output_queue in queues],
+                                    key=lambda item: position_sort_key(item[0]))
+            else:
+                items = iterate_slice_queue(queues[0], number_of_slices)
+
+            for sort_values, rows in items:
+                yield rows
+        finally:
+            # also stops the workers when the rows are not read to the end
+            stop_event.set()
+            executor.shutdown(wait=False)
+
+    def yield_hit_rows(self):
+        query_body = self.get_query_body()
+        number_of_slices = self.get_number_of_slices()
+        if number_of_slices > 1:
+            yield from self.yield_sliced_hit_rows(query_body, number_of_slices)
+        else:
+            for hit in self.get_hits(query_body):
+                yield self.get_rows(hit)
 
-            self.results = flattened_results
+    def yield_rows(self):
+        header_keys = self.get_header_keys()
+        yield header_keys
 
+        self.hits_processed = 0
+        for rows in self.yield_hit_rows():
+            self.hits_processed += 1
+            yield from rows
 
+    def flatten_nested_results(self):
+        if self.nested_attribute_fields:
+            # lazy, the rows are generated as yield_rows writes them out
+            self.results = flatten_results(self.results,
+                                           self.nested_attribute_fields,
+                                           self.non_nested_attribute_fields,
+                                           self.fields_to_skip_flattening,
+                                           self.maximum_rows_per_hit)
 
     def get_results(self):
         self.extract_nested_results_from_elasticsearch_response()
@@ -1,18 +1,24 @@
 import csv
 import json
+import os
 from collections import deque
 from datetime import datetime
 from pprint import pprint
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import Group
-from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
-from django.http import (HttpResponse, HttpResponseForbidden,
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseForbidden,
                          HttpResponseServerError, JsonResponse, QueryDict,
                          StreamingHttpResponse)
+from django.middleware.csrf import CsrfViewMiddleware
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.utils import timezone
 from django.views import View
+from django.views.decorators.http import require_POST
 from django.views.generic.base import TemplateView
 from django.views.generic.list import ListView
 from django.views.generic.edit import FormView
@@ -20,19 +26,38 @@ from django.views.generic.edit import FormView
 
 from common.utils import Echo
 from core.apps import CoreConfig
+from core.exceptions import SearchPageExpired
+from core.exports import (DELIMITERS, fail_stale_export_jobs,
+                          get_content_type, get_download_class,
+                          get_export_file_path, parse_range_header,
+                          read_file_range, retry_export_job,
+                          start_export_job)
+from core.catalogs import (CATALOG_SEARCH_LIMIT, MAX_CATALOG_SEARCH_LIMIT,
+                           get_value_catalog, value_catalog_cache)
+from core.facets import facet_count_cache, get_facet_counts
 from core.forms import (AnalysisTypeForm, AttributeForm, AttributeFormPart,
                         DatasetForm, FilterForm, FilterFormPart,
                         SaveSearchForm, StudyForm, DocumentReviewForm)
-from core.models import (AnalysisType, AttributeTab, Dataset, FilterTab,
-                         SavedSearch, SearchLog, Study, DocumentReview)
-from core.utils import (BaseDownloadAllResults, BaseElasticSearchQueryDSL,
+from core.models import (AnalysisType, APIToken, AttributeTab, Dataset,
+                         ExportJob, FilterTab, SavedSearch, SearchLog, Study,
+                         DocumentReview, get_api_key_hash)
+from core.utils import (BaseElasticSearchQueryDSL,
                         BaseElasticSearchQueryExecutor,
                         BaseElasticsearchResponseParser,
-                        BaseSearchElasticsearch, get_es_document, get_user_group_for_reviewing)
+                        BaseSearchElasticsearch, BaseSearchResultsPage,
+                        async_es_client_scope, dataset_metadata, es_clients,
+                        get_cached_snippet,
+                        get_dataset_metadata, get_es_document,
+                        get_result_record,
+                        get_user_group_for_reviewing, search_result_cache,
+                        user_can_access_dataset)
 from django.urls import reverse
 from django.contrib import messages
 from django.http import HttpResponseRedirect
 
+# version of the JSON search API, part of its urls; bump it on changes that break clients
+SEARCH_API_VERSION = 1
+
 
 class MainPageView(TemplateView):
     template_name = "core/home.html"
@@ -84,9 +109,37 @@ class AnalysisTypeSnippetView(View):
         return render(request, self.template_name, context)
 
 
-class FilterSnippetView(View):
+class CachedSnippetView(View):
+    """
+    Form snippet of a dataset, rendered once per configuration version of the dataset and kept in the cache as
+    HTML; see core.utils.get_cached_snippet and the warm_snippet_cache command.
+    """
+    template_name = None
+    snippet_name = None
+
+    def get_snippet_context(self, dataset_obj):
+        raise NotImplementedError
+
+    def get_snippet_name(self, dataset_obj):
+        """Name of the snippet in the cache; snippets that depend on more than the configuration add it here."""
+        return self.snippet_name
+
+    def render_snippet(self, dataset_obj):
+        return render_to_string(self.template_name, self.get_snippet_context(dataset_obj))
+
+    def get_snippet_html(self, dataset_obj):
+        return get_cached_snippet(self.get_snippet_name(dataset_obj), dataset_obj, lambda: self.render_snippet(dataset_obj))
+
+    def get(self, request, *args, **kwargs):
+        dataset_obj = get_object_or_404(
+            Dataset, pk=kwargs.get('dataset_id'))
+        return HttpResponse(self.get_snippet_html(dataset_obj))
+
+
+class FilterSnippetView(CachedSnippetView):
     form_class = FilterFormPart
     template_name = "core/filter_form_template.html"
+    snippet_name = 'filter_form_tabs'
 
     def generate_filter_form_tabs(self, dataset_obj):
         filter_form_tabs = deque()
@@ -118,31 +171,63 @@ class FilterSnippetView(View):
             filter_form_tabs.append(tmp_dict)
         return filter_form_tabs
 
-    def get_filter_form_tabs_response(self, request, dataset_obj):
-        cache_name = 'filter_form_tabs_for_{}'.format(dataset_obj.id)
-        cached_form = cache.get(cache_name)
-        if cached_form:
-            return cached_form
-        else:
-            filter_form_tabs = self.generate_filter_form_tabs(dataset_obj)
-            context = {}
-            context['tabs'] = filter_form_tabs
-            response = render(
-                request, self.template_name, context)
-            cache.set(cache_name, response, None)
-            return response
+    def get_snippet_context(self, dataset_obj):
+        return {'tabs': self.generate_filter_form_tabs(dataset_obj)}
+
+
+class FacetCountView(View):
+    """
+    Number of documents for each choice of the visible choice filters given the filter state in form_data, the
+    serialized search form, as JSON; see core.facets.get_facet_counts.
+    """
+
+    def post(self, request, *args, **kwargs):
+        dataset_obj = get_object_or_404(Dataset, pk=self.kwargs.get('dataset_id'))
+        if not user_can_access_dataset(dataset_obj, request.user):
+            return HttpResponseForbidden()
+
+        POST_data = QueryDict(request.POST.get('form_data', ''))
+        filter_form = FilterForm(dataset_obj, POST_data, prefix='filter_')
+        if not filter_form.is_valid():
+            return JsonResponse({'errors': filter_form.errors}, status=400)
+
+        try:
+            facet_counts = get_facet_counts(dataset_obj, filter_form.cleaned_data)
+        except ValidationError as e:
+            return JsonResponse({'errors': e.messages}, status=400)
+        return JsonResponse(facet_counts)
+
+
+class ValueCatalogView(View):
+    """
+    Page of the values of a filter field that start with the q parameter, for autocomplete widgets of fields with
+    too many values to list, as JSON; see core.catalogs.
+    """
 
     def get(self, request, *args, **kwargs):
-        dataset_obj = get_object_or_404(
-            Dataset, pk=self.kwargs.get('dataset_id'))
-        filter_form_tabs_response = self.get_filter_form_tabs_response(
-            request, dataset_obj)
-        return filter_form_tabs_response
+        dataset_obj = get_object_or_404(Dataset, pk=self.kwargs.get('dataset_id'))
+        if not user_can_access_dataset(dataset_obj, request.user):
+            return HttpResponseForbidden()
 
+        filter_field_obj = get_dataset_metadata(dataset_obj).filter_fields.get(self.kwargs.get('filter_field_id'))
+        if filter_field_obj is None:
+            raise Http404
 
-class AttributeSnippetView(View):
+        try:
+            offset = max(0, int(request.GET.get('offset', 0)))
+            limit = min(MAX_CATALOG_SEARCH_LIMIT, max(1, int(request.GET.get('limit', CATALOG_SEARCH_LIMIT))))
+        except ValueError:
+            return JsonResponse({'errors': ['offset and limit must be integers']}, status=400)
+
+        catalog = get_value_catalog(dataset_obj, filter_field_obj.es_name, filter_field_obj.path)
+        values, total = catalog.search(request.GET.get('q', '').strip(), offset, limit)
+        return JsonResponse({'values': values, 'total': total, 'offset': offset, 'limit': limit})
+
+
+class AttributeSnippetView(CachedSnippetView):
     form_class = AttributeFormPart
     template_name = "core/attribute_form_template.html"
+    snippet_name = 'attribute_form_tabs'
 
     def generate_attribute_form_tabs(self, dataset_obj):
         attribute_form_tabs = deque()
@@ -182,27 +267,21 @@ class AttributeSnippetView(View):
             attribute_form_tabs.append(tmp_dict)
         return attribute_form_tabs
 
-    def get_attribute_form_tabs_response(self, request, dataset_obj):
-        cache_name = 'attribute_form_tabs_for_{}'.format(dataset_obj.id)
-        cached_form = cache.get(cache_name)
-        if cached_form:
-            return cached_form
-        else:
-            attribute_form_tabs = self.generate_attribute_form_tabs(
-                dataset_obj)
-            context = {}
-            context['tabs'] = attribute_form_tabs
-            response = render(
-                request, self.template_name, context)
-            cache.set(cache_name, response, None)
-            return response
+    def get_snippet_context(self, dataset_obj):
+        return {'tabs': self.generate_attribute_form_tabs(dataset_obj)}
 
-    def get(self, request, *args, **kwargs):
-        dataset_obj = get_object_or_404(
-            Dataset, pk=self.kwargs.get('dataset_id'))
-        attribute_form_tabs_response = self.get_attribute_form_tabs_response(
-            request, dataset_obj)
-        return attribute_form_tabs_response
+
+def get_search_view_class(analysis_type_obj):
+    app_name = analysis_type_obj.app_name.name
+
+    if app_name == 'complex':
+        from complex.views import ComplexSearchView
+        return ComplexSearchView
+    elif app_name == 'mendelian':
+        from mendelian.views import MendelianSearchView
+        return MendelianSearchView
+    else:
+        return BaseSearchView
 
 
 class SearchRouterView(View):
@@ -211,18 +290,8 @@ class SearchRouterView(View):
         POST_data = QueryDict(request.POST['form_data'])
         analysis_type_id = POST_data.get('analysis_type')
         analysis_type_obj = get_object_or_404(AnalysisType, pk=analysis_type_id)
-        app_name = analysis_type_obj.app_name.name
-
-        if app_name == 'complex':
-            from complex.views import ComplexSearchView
-            return_view = ComplexSearchView
-        elif app_name == 'mendelian':
-            from mendelian.views import MendelianSearchView
-            return_view = MendelianSearchView
-        else:
-            return_view = BaseSearchView
 
-        return return_view().post(request)
+        return get_search_view_class(analysis_type_obj)().post(request)
 
 
 class DownloadRouterView(View):
@@ -232,11 +301,27 @@ class DownloadRouterView(View):
         search_log_obj = get_object_or_404(SearchLog, pk=search_log_id)
         app_name = search_log_obj.analysis_type.app_name.name
 
-        if app_name == 'complex':
-            return_view = BaseDownloadView
-        elif app_name == 'mendelian':
+        if app_name == 'mendelian':
             from mendelian.views import MendelianDownloadView
             return_view = MendelianDownloadView
+        else:
+            return_view = BaseDownloadView
+
+        return return_view().get(request, **{'search_log_id': search_log_id})
+
+
+class SearchPageRouterView(View):
+
+    def get(self, request, *args, **kwargs):
+        search_log_id = kwargs.get('search_log_id')
+        search_log_obj = get_object_or_404(SearchLog, pk=search_log_id)
+        app_name = search_log_obj.analysis_type.app_name.name
+
+        if app_name == 'mendelian':
+            from mendelian.views import MendelianSearchPageView
+            return_view = MendelianSearchPageView
+        else:
+            return_view = BaseSearchPageView
 
         return return_view().get(request, **{'search_log_id': search_log_id})
 
@@ -294,8 +379,7 @@ class BaseSearchView(TemplateView):
         else:
             raise ValidationError('Invalid dataset!')
 
-        self.dataset_obj = Dataset.objects.prefetch_related(
-            'attributefield_set').get(id=dataset_id)
+        self.dataset_obj = Dataset.objects.get(id=dataset_id)
 
         # Validate Analysis Type Form
         analysis_type_form = AnalysisTypeForm(self.dataset_obj, request.user, POST_data)
@@ -341,17 +425,56 @@ class BaseSearchView(TemplateView):
 
         return kwargs
 
-    def post(self, request, *args, **kwargs):
+    def validate_additional_forms(self, request, POST_data):
+        pass
+
+    def get_additional_information(self):
+        return ''
+
+    def run_search(self, request, run_query=True):
+        """
+        Validate the search form data of request and run the search, or with run_query False only build and log
+        its query. Returns the search object, see BaseSearchElasticsearch.
+        """
         self.start_time = datetime.now()
 
         # Get all FORM POST Data
         POST_data = QueryDict(request.POST['form_data'])
 
         self.validate_request_data(request, POST_data)
+        self.validate_additional_forms(request, POST_data)
+
+        search_elasticsearch_obj = self.search_elasticsearch_class(**self.get_kwargs(request))
+        if run_query:
+            search_elasticsearch_obj.search()
+        else:
+            search_elasticsearch_obj.log_search_without_results()
+
+        return search_elasticsearch_obj
+
+    async def async_run_search(self, request):
+        """run_search for async views, see BaseSearchElasticsearch.async_search."""
+        self.start_time = datetime.now()
+
+        # Get all FORM POST Data
+        POST_data = QueryDict(request.POST['form_data'])
 
-        kwargs = self.get_kwargs(request)
-        search_elasticsearch_obj = self.search_elasticsearch_class(**kwargs)
-        search_elasticsearch_obj.search()
+        await sync_to_async(self.validate_request_data)(request, POST_data)
+        await sync_to_async(self.validate_additional_forms)(request, POST_data)
+
+        search_elasticsearch_obj = self.search_elasticsearch_class(**self.get_kwargs(request))
+        await search_elasticsearch_obj.async_search()
+
+        return search_elasticsearch_obj
+
+    def get_gene_mania_link(self, results):
+        genes = sorted({result.get('SYMBOL') for result in results if result.get('SYMBOL') not in (None, '', 'NA')})
+        if not genes:
+            return None
+        return '<a target="_blank" href="http://genemania.org/#/search/9606/%s"><i class="fa fa-external-link-square fa-1x" aria-hidden="true"></i> GeneMANIA</a>' %('|'.join(genes))
+
+    def post(self, request, *args, **kwargs):
+        search_elasticsearch_obj = self.run_search(request)
         header = search_elasticsearch_obj.get_header()
         results = search_elasticsearch_obj.get_results()
         elasticsearch_response_time = search_elasticsearch_obj.get_elasticsearch_response_time()
@@ -359,38 +482,18 @@ class BaseSearchView(TemplateView):
         filters_used = search_elasticsearch_obj.get_filters_used()
         attributes_selected = search_elasticsearch_obj.get_attributes_selected()
 
-        try:
-            keys = results[0].keys()
-        except:
-            keys = []
-
-        if 'SYMBOL' in keys:
-            genes = []
-            for result in results:
-                symbol = result.get('SYMBOL')
-                if not symbol or symbol == 'NA':
-                    continue
-                genes.append(result.get('SYMBOL'))
-            genes = sorted(list(set(genes)))
-            if genes:
-                gene_mania_link = '<a target="_blank" href="http://genemania.org/#/search/9606/%s"><i class="fa fa-external-link-square fa-1x" aria-hidden="true"></i> GeneMANIA</a>' %('|'.join(genes))
-            else:
-                gene_mania_link = None
-        else:
-            gene_mania_link = None
-
-
         if request.user.is_authenticated:
             save_search_form = SaveSearchForm(request.user,
                                               self.dataset_obj,
                                               self.analysis_type_obj,
-                                              '',
+                                              self.get_additional_information(),
                                               filters_used,
                                               attributes_selected)
         else:
             save_search_form = None
 
         if self.call_get_context and request.user.is_authenticated:
+            kwargs = self.get_kwargs(request)
             kwargs.update({'user_obj': request.user})
             kwargs.update({'search_log_obj': SearchLog.objects.get(id=search_log_id)})
             context = self.get_context_data(**kwargs)
@@ -403,7 +506,7 @@ class BaseSearchView(TemplateView):
             exclude_rejected_documents_checkbox_status = ""
 
         context['exclude_rejected_documents_checkbox_status'] = exclude_rejected_documents_checkbox_status
-        context['gene_mania_link'] = gene_mania_link
+        context['gene_mania_link'] = self.get_gene_mania_link(results)
         context['header'] = header
         context['results'] = results
         context['total_time'] = int((datetime.now() - self.start_time).total_seconds() * 1000)
@@ -415,22 +518,223 @@ class BaseSearchView(TemplateView):
         return render(request, self.template_name, context)
 
 
+def serialize_header(header):
+    return [{'es_name': ele.es_name,
+             'display_text': ele.display_text,
+             'path': ele.path or None,
+             'is_link_field': ele.is_link_field} for ele in header]
+
+
+def authenticate_api_request(request):
+    """
+    None if request may call the search API, the error response otherwise. A request with an
+    'Authorization: Token <key>' header, see core.models.APIToken, acts as the user of the key and needs no CSRF
+    token. Any other request is a browser session and is checked against CSRF like the rest of the site.
+    """
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not authorization.startswith('Token '):
+        return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+
+    api_token_obj = APIToken.objects.select_related('user').filter(
+        key_hash=get_api_key_hash(authorization[len('Token '):].strip())).first()
+    if api_token_obj is None or not api_token_obj.user.is_active:
+        return JsonResponse({'version': SEARCH_API_VERSION, 'errors': ['Invalid API token!']}, status=401)
+
+    APIToken.objects.filter(pk=api_token_obj.pk).update(last_used=timezone.now())
+    request.user = api_token_obj.user
+    return None
+
+
+class SearchAPIView(View):
+    """
+    The search of the search form as JSON: the same POST data as the search router, the rows as typed values
+    in header order instead of a rendered table. Scripts authenticate with an API token, see
+    authenticate_api_request; the CSRF middleware leaves these views to it.
+    """
+    version = SEARCH_API_VERSION
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    def dispatch(self, request, *args, **kwargs):
+        response = authenticate_api_request(request)
+        if response is not None:
+            return response
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_search_view(self, request):
+        POST_data = QueryDict(request.POST['form_data'])
+        analysis_type_obj = get_object_or_404(AnalysisType, pk=POST_data.get('analysis_type'))
+        return get_search_view_class(analysis_type_obj)()
+
+    def post(self, request, *args, **kwargs):
+        search_view = self.get_search_view(request)
+        try:
+            search_elasticsearch_obj = search_view.run_search(request)
+        except ValidationError as e:
+            return JsonResponse({'version': self.version, 'errors': e.messages}, status=400)
+
+        header = search_elasticsearch_obj.get_header()
+        results = search_elasticsearch_obj.get_results()
+        data = {
+            'version': self.version,
+            'search_log_id': search_elasticsearch_obj.get_search_log_id(),
+            'header': serialize_header(header),
+            'rows': [get_result_record(header, result) for result in results],
+            'number_of_rows': len(results),
+            'elasticsearch_response_time': search_elasticsearch_obj.get_elasticsearch_response_time(),
+            'total_time': int((datetime.now() - search_view.start_time).total_seconds() * 1000),
+        }
+        return JsonResponse(data)
+
+
+class AsyncSearchAPIView(SearchAPIView):
+    """
+    SearchAPIView as an async view: the worker is not held while Elasticsearch works, and the hits, their total
+    count and the search log are requested concurrently. Needs aiohttp, and an ASGI server (genesysv/asgi.py) to
+    keep its Elasticsearch connections across requests, see ELASTICSEARCH_KEEP_ASYNC_CLIENTS.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        response = await sync_to_async(authenticate_api_request)(request)
+        if response is not None:
+            return response
+        async with async_es_client_scope():
+            return await View.dispatch(self, request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        search_view = await sync_to_async(self.get_search_view)(request)
+        try:
+            search_elasticsearch_obj = await search_view.async_run_search(request)
+        except ValidationError as e:
+            return JsonResponse({'version': self.version, 'errors': e.messages}, status=400)
+
+        header = search_elasticsearch_obj.get_header()
+        results = search_elasticsearch_obj.get_results()
+        data = {
+            'version': self.version,
+            'search_log_id': search_elasticsearch_obj.get_search_log_id(),
+            'header': serialize_header(header),
+            'rows': [get_result_record(header, result) for result in results],
+            'number_of_rows': len(results),
+            'total_hits': search_elasticsearch_obj.get_total_hits(),
+            'elasticsearch_response_time': search_elasticsearch_obj.get_elasticsearch_response_time(),
+            'total_time': int((datetime.now() - search_view.start_time).total_seconds() * 1000),
+        }
+        return JsonResponse(data)
+
+
+class SearchNDJSONAPIView(SearchAPIView):
+    """
+    Streaming variant of SearchAPIView with every result, not only the first page: a header line, one line per
+    row and a summary line, as newline delimited JSON.
+    """
+
+    def yield_lines(self, search_view, search_log_obj):
+        download_obj = get_download_class(search_log_obj)(search_log_obj, row_format='records')
+        yield json.dumps({'type': 'header',
+                          'version': self.version,
+                          'search_log_id': search_log_obj.id,
+                          'header': serialize_header(download_obj.header)}) + '\n'
+
+        rows = download_obj.yield_rows()
+        # the header keys
+        next(rows)
+        number_of_rows = 0
+        for row in rows:
+            number_of_rows += 1
+            yield json.dumps(dict(row, type='row'), cls=DjangoJSONEncoder) + '\n'
+
+        yield json.dumps({'type': 'summary',
+                          'number_of_rows': number_of_rows,
+                          'total_time': int((datetime.now() - search_view.start_time).total_seconds() * 1000)}) + '\n'
+
+    def post(self, request, *args, **kwargs):
+        search_view = self.get_search_view(request)
+        try:
+            search_elasticsearch_obj = search_view.run_search(request, run_query=False)
+        except ValidationError as e:
+            return JsonResponse({'version': self.version, 'errors': e.messages}, status=400)
+
+        search_log_obj = SearchLog.objects.get(id=search_elasticsearch_obj.get_search_log_id())
+        return StreamingHttpResponse(self.yield_lines(search_view, search_log_obj), content_type='application/x-ndjson')
+
+
 class BaseDownloadView(View):
+    """
+    Start an export job writing all results of the search to a file, see core.exports. Export jobs belong to a
+    user, so the anonymous searches stream their rows as CSV or TSV while the request lasts, as before.
+    """
+
+    def stream_rows(self, search_log_obj, file_format, order_by_position):
+        download_obj = get_download_class(search_log_obj)(search_log_obj, order_by_position=order_by_position)
+        writer = csv.writer(Echo(), delimiter=DELIMITERS[file_format])
+        response = StreamingHttpResponse((writer.writerow(row) for row in download_obj.yield_rows()),
+                                         content_type='text/%s' % (file_format))
+        response['Content-Disposition'] = 'attachment; filename="search_results.%s"' % (file_format)
+        return response
 
     def get(self, request, *args, **kwargs):
         search_log_obj = get_object_or_404(
             SearchLog, pk=kwargs.get('search_log_id'))
         if search_log_obj.user != None and request.user != search_log_obj.user:
             return HttpResponseForbidden()
-        download_obj = BaseDownloadAllResults(search_log_obj)
-        rows = download_obj.yield_rows()
-        pseudo_buffer = Echo()
-        writer = csv.writer(pseudo_buffer)
-        response = StreamingHttpResponse((writer.writerow(row) for row in rows),
-                                         content_type="text/csv")
-        response['Content-Disposition'] = 'attachment; filename="search_results.csv"'
 
-        return response
+        file_format = request.GET.get('format', 'csv')
+        if file_format not in dict(ExportJob.FILE_FORMAT_CHOICES):
+            file_format = 'csv'
+        order_by_position = request.GET.get('order') == 'position'
+
+        if not request.user.is_authenticated:
+            return self.stream_rows(search_log_obj, file_format if file_format in DELIMITERS else 'csv',
+                                    order_by_position)
+        start_export_job(request.user, search_log_obj, file_format=file_format,
+                         order_by_position=order_by_position)
+
+        return redirect('export-job-list')
+
+
+class BaseSearchPageView(View):
+    template_name = "core/search_page.html"
+    search_results_page_class = BaseSearchResultsPage
+
+    def get(self, request, *args, **kwargs):
+        start_time = datetime.now()
+        search_log_obj = get_object_or_404(
+            SearchLog, pk=kwargs.get('search_log_id'))
+        if search_log_obj.user != None and request.user != search_log_obj.user:
+            return HttpResponseForbidden()
+
+        try:
+            page_number = int(request.GET.get('page', 1))
+        except ValueError:
+            page_number = 1
+
+        search_results_page = self.search_results_page_class(search_log_obj, request.user)
+        page_expired = False
+        try:
+            results = search_results_page.get_page(page_number, restart=request.GET.get('restart') == 'true')
+        except SearchPageExpired:
+            # the point in time timed out, start again from the first page
+            page_expired = True
+            results = search_results_page.get_page(1, restart=True)
+
+        context = {
+            'search_log_id': search_log_obj.id,
+            'dataset_obj': search_log_obj.dataset,
+            'header': search_results_page.header,
+            'results': results,
+            'page_number': search_results_page.page_number,
+            'has_next_page': search_results_page.has_next_page,
+            'page_expired': page_expired,
+            'app_name': search_log_obj.analysis_type.app_name.name,
+            'elasticsearch_response_time': search_results_page.elasticsearch_response_time,
+            'total_time': int((datetime.now() - start_time).total_seconds() * 1000),
+        }
+        return render(request, self.template_name, context)
 
 
 def save_search(request):
@@ -666,3 +970,104 @@ class DocumentReviewListView(ListView):
     def get_queryset(self):
         groups = self.request.user.groups.all()
         return DocumentReview.objects.filter(group__in=groups)
+
+
+class RuntimeStatsView(View):
+    """Per process runtime statistics for staff, as JSON."""
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_staff:
+            return HttpResponseForbidden()
+
+        stats = {
+            'elasticsearch_clients': es_clients.get_stats(),
+            'search_result_cache': search_result_cache.get_stats(),
+            'facet_count_cache': facet_count_cache.get_stats(),
+            'value_catalog_cache': value_catalog_cache.get_stats(),
+            'dataset_metadata': dataset_metadata.get_stats(),
+        }
+        return JsonResponse(stats)
+
+
+class ExportJobListView(ListView):
+    model = ExportJob
+    context_object_name = 'export_job_list'
+    template_name = 'core/export_job_list.html'
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return HttpResponseForbidden()
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        # shows the jobs whose worker stopped as failed, with their retry link
+        fail_stale_export_jobs(self.request.user)
+        return ExportJob.objects.filter(user=self.request.user).select_related(
+            'search_log__dataset', 'search_log__analysis_type').order_by('-created')
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['has_active_jobs'] = any(ele.status in ('Waiting', 'Queued', 'Running') for ele in context['export_job_list'])
+        return context
+
+
+class ExportJobStatusView(View):
+
+    def get(self, request, *args, **kwargs):
+        export_job_obj = get_object_or_404(ExportJob, pk=kwargs.get('export_job_id'))
+        if request.user != export_job_obj.user:
+            return HttpResponseForbidden()
+
+        data = {
+            'status': export_job_obj.status,
+            'progress': export_job_obj.progress,
+            'total_hits': export_job_obj.total_hits,
+            'hits_processed': export_job_obj.hits_processed,
+            'rows_written': export_job_obj.rows_written,
+            'download_url': None,
+        }
+        if export_job_obj.status == 'Completed':
+            data['download_url'] = reverse('export-job-download', args=[export_job_obj.id])
+        return JsonResponse(data)
+
+
+class ExportJobDownloadView(View):
+    """Send the file of a completed export job; single byte ranges are honoured so broken downloads can resume."""
+
+    def get(self, request, *args, **kwargs):
+        export_job_obj = get_object_or_404(ExportJob, pk=kwargs.get('export_job_id'))
+        if request.user != export_job_obj.user:
+            return HttpResponseForbidden()
+
+        if export_job_obj.status != 'Completed':
+            raise Http404
+        file_path = get_export_file_path(export_job_obj)
+        if not os.path.exists(file_path):
+            raise Http404
+
+        file_size = os.path.getsize(file_path)
+        byte_range = parse_range_header(request.META.get('HTTP_RANGE'), file_size)
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(read_file_range(file_path, start, end),
+                                             status=206, content_type=get_content_type(export_job_obj))
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, file_size)
+            response['Content-Length'] = str(end - start + 1)
+            response['Content-Disposition'] = 'attachment; filename="%s"' % export_job_obj.file_name
+        else:
+            response = FileResponse(open(file_path, 'rb'), as_attachment=True,
+                                    filename=export_job_obj.file_name, content_type=get_content_type(export_job_obj))
+        response['Accept-Ranges'] = 'bytes'
+
+        return response
+
+
+@require_POST
+def retry_export(request, export_job_id):
+    export_job_obj = get_object_or_404(ExportJob, pk=export_job_id)
+    if request.user != export_job_obj.user:
+        return HttpResponseForbidden()
+
+    retry_export_job(export_job_obj)
+
+    return redirect('export-job-list')
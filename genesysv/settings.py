@@ -124,6 +124,48 @@ CACHES = {
     }
 }
 
+# seconds a rendered form snippet (core.utils.get_cached_snippet) stays in the cache
+SNIPPET_CACHE_TTL = 7 * 24 * 60 * 60
+
+# shared Elasticsearch clients of the web tier, one per host and port (core.utils.ElasticsearchClientRegistry).
+# Timeouts and retries can be overridden per Dataset.
+ELASTICSEARCH_CONNECTIONS_PER_NODE = 10
+ELASTICSEARCH_REQUEST_TIMEOUT = 120
+ELASTICSEARCH_MAX_RETRIES = 3
+# keep the AsyncElasticsearch clients of the async views (core.utils.AsyncElasticsearchClientRegistry) across
+# requests. Only set this when serving with ASGI (genesysv/asgi.py), whose event loop lives as long as the process;
+# under WSGI every async request runs in an event loop of its own and its clients are closed when it ends.
+ELASTICSEARCH_KEEP_ASYNC_CLIENTS = False
+
+# in-process cache of parsed search results (core.utils.SearchResultCache), number of entries and seconds
+SEARCH_RESULT_CACHE_SIZE = 128
+SEARCH_RESULT_CACHE_TTL = 600
+
+# in-process cache of the filter choice counts (core.facets), number of entries and seconds
+FACET_COUNT_CACHE_SIZE = 256
+FACET_COUNT_CACHE_TTL = 600
+
+# in-process cache of the value catalogs of fields (core.catalogs), number of entries and seconds
+VALUE_CATALOG_CACHE_SIZE = 64
+VALUE_CATALOG_CACHE_TTL = 24 * 60 * 60
+
+# gene lists of terms filters longer than GENE_SET_INLINE_LIMIT are stored as gene sets and referenced by terms
+# lookup in GENE_SET_INDEX, in documents of at most GENE_SET_CHUNK_SIZE genes (index.max_terms_count) (core.gene_sets)
+GENE_SET_INDEX = 'genesysv_gene_sets'
+GENE_SET_INLINE_LIMIT = 500
+GENE_SET_CHUNK_SIZE = 65536
+
+# merged regions of a region filter compiled to range clauses, more are looked up by a script (core.regions)
+REGION_MAX_RANGE_CLAUSES = 500
+
+# full result downloads, written by the utils/es_celery workers (core.exports), and how many can run at once per user
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+EXPORT_JOBS_PER_USER = 2
+# seconds without progress after which a Queued or Running export job counts as failed and can be retried
+EXPORT_JOB_STALE_TIMEOUT = 60 * 60
+# parallel sliced scrolls of one large export (core.utils.BaseDownloadAllResults)
+EXPORT_SCROLL_SLICES = 4
+
 
 LANGUAGE_CODE = 'en-us'
 
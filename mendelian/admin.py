@@ -1,3 +1,15 @@
 from django.contrib import admin
 
-# Register your models here.
+from mendelian.models import Family, Subject
+
+
+class SubjectInline(admin.TabularInline):
+    model = Subject
+    extra = 0
+
+
+@admin.register(Family)
+class FamilyAdmin(admin.ModelAdmin):
+    list_display = ('family_id', 'dataset')
+    list_filter = ('dataset',)
+    inlines = [SubjectInline]
@@ -1,3 +1,43 @@
 from django.db import models
 
-# Create your models here.
+from common.models import TimeStampedModel
+
+
+class Family(TimeStampedModel):
+    """A family of a dataset, as defined in the ped file used to load it."""
+    dataset = models.ForeignKey(
+        'core.Dataset',
+        on_delete=models.CASCADE,
+        related_name='families',
+    )
+    family_id = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('dataset', 'family_id',)
+        verbose_name_plural = 'families'
+
+    def __str__(self):
+        return self.family_id
+
+
+class Subject(TimeStampedModel):
+    family = models.ForeignKey(
+        'Family',
+        on_delete=models.CASCADE,
+        related_name='subjects',
+    )
+    sample_id = models.CharField(max_length=255)
+    father_id = models.CharField(max_length=255, blank=True, null=True)
+    mother_id = models.CharField(max_length=255, blank=True, null=True)
+    sex = models.CharField(max_length=16, blank=True, null=True)
+    phenotype = models.CharField(max_length=16, blank=True, null=True)
+
+    class Meta:
+        unique_together = ('family', 'sample_id',)
+
+    def __str__(self):
+        return self.sample_id
+
+    @property
+    def is_child(self):
+        return bool(self.father_id and self.mother_id)
@@ -1,21 +1,94 @@
+import asyncio
 import copy
 import datetime
+import json
 import pprint
 import sys
 from collections import Counter, deque
 
-import elasticsearch
+from asgiref.sync import sync_to_async
 from elasticsearch import helpers
+from django.db import transaction
 from natsort import natsorted
 
+from core.catalogs import get_value_catalog
 from core.models import AttributeField, SearchLog
-from core.utils import (BaseElasticSearchQueryDSL,
+from mendelian.models import Family, Subject
+from core.utils import (BaseDownloadAllResults, BaseElasticSearchQueryDSL,
                         BaseElasticSearchQueryExecutor,
                         BaseElasticsearchResponseParser,
-                        BaseSearchElasticsearch, get_values_from_es)
+                        BaseSearchElasticsearch, BaseSearchResultsPage,
+                        es_clients, get_async_es_client, get_es_client)
 
 thismodule = sys.modules[__name__]
 
+# dataset id -> (dataset modified, family_dict); save_pedigree touches the dataset, which invalidates the entry
+_family_dict_cache = {}
+
+
+def save_pedigree(dataset_obj, ped_info):
+    """Replace the families of dataset_obj with the ones in ped_info, as returned by process_ped_file in load_vcf.py."""
+    with transaction.atomic():
+        Family.objects.filter(dataset=dataset_obj).delete()
+
+        families = {}
+        subjects = []
+        for sample_id, ped in natsorted(ped_info.items()):
+            family_id = ped.get('family')
+            if not family_id:
+                continue
+            if family_id not in families:
+                families[family_id] = Family.objects.create(dataset=dataset_obj, family_id=family_id)
+            subjects.append(Subject(family=families[family_id],
+                                    sample_id=sample_id,
+                                    father_id=ped.get('father'),
+                                    mother_id=ped.get('mother'),
+                                    sex=ped.get('sex'),
+                                    phenotype=ped.get('phenotype')))
+
+        Subject.objects.bulk_create(subjects)
+        dataset_obj.save(update_fields=['modified'])
+
+    _family_dict_cache.pop(dataset_obj.id, None)
+
+
+def get_family_dict(dataset_obj):
+    """
+    {Family_ID: {'father_id', 'mother_id', 'child_id', 'child_sex', 'children'}} from the pedigree saved at load time,
+    without any Elasticsearch request. 'children' lists every subject with both parents in the ped file, child_id and
+    child_sex are the first of them. Returns None for datasets loaded before the pedigree was saved.
+    """
+    cached = _family_dict_cache.get(dataset_obj.id)
+    if cached and cached[0] == dataset_obj.modified:
+        return cached[1]
+
+    subjects = Subject.objects.filter(family__dataset=dataset_obj).select_related('family')
+    if not subjects:
+        return None
+
+    family_dict = {}
+    for subject in natsorted(subjects, key=lambda subject: (subject.family.family_id, subject.sample_id)):
+        if not subject.is_child:
+            continue
+        family = family_dict.setdefault(subject.family.family_id, {'father_id': subject.father_id,
+                                                                   'mother_id': subject.mother_id,
+                                                                   'child_id': subject.sample_id,
+                                                                   'child_sex': subject.sex,
+                                                                   'children': []})
+        family['children'].append({'child_id': subject.sample_id, 'child_sex': subject.sex})
+
+    _family_dict_cache[dataset_obj.id] = (dataset_obj.modified, family_dict)
+    return family_dict
+
+
+def get_number_of_families(dataset_obj):
+    number_of_families = Family.objects.filter(dataset=dataset_obj).count()
+    if number_of_families:
+        return number_of_families
+
+    # dataset loaded before the pedigree was saved
+    return len(get_value_catalog(dataset_obj, 'Family_ID', 'sample'))
+
 
 def filter_using_inner_hits(source_data, inner_hits_data):
 
@@ -116,24 +189,26 @@ class MendelianElasticSearchQueryExecutor(BaseElasticSearchQueryExecutor):
                 )
         return query_body
 
-    def search(self):
-        results = {
-            "took": None,
-            "hits": {
-                "total": None,
-                "hits": deque()
-            }
-        }
-        count = 0
-        start_time = datetime.datetime.now()
+    def get_annotation_from_mapping(self, mapping):
+        properties = mapping[self.dataset_obj.es_index_name]['mappings']['properties']
+        if 'CSQ_nested' in properties:
+            return 'VEP'
+        elif 'ExonicFunc_refGene' in properties:
+            return 'ANNOVAR'
+
+    def get_annotation(self, es):
+        return self.get_annotation_from_mapping(es.indices.get_mapping(index=self.dataset_obj.es_index_name))
 
-        es = elasticsearch.Elasticsearch(host=self.dataset_obj.es_host, port=self.dataset_obj.es_port)
+    async def async_get_annotation(self, es):
+        return self.get_annotation_from_mapping(await es.indices.get_mapping(index=self.dataset_obj.es_index_name))
 
-        if 'CSQ_nested' in es.indices.get_mapping()[self.dataset_obj.es_index_name]['mappings']['properties']:
-            annotation = 'VEP'
-        elif 'ExonicFunc_refGene' in es.indices.get_mapping()[self.dataset_obj.es_index_name]['mappings']['properties']:
-            annotation = 'ANNOVAR'
+    def get_analysis_query_body(self, es):
+        return self.build_analysis_query_body(self.get_annotation(es))
 
+    async def async_get_analysis_query_body(self, es):
+        return self.build_analysis_query_body(await self.async_get_annotation(es))
+
+    def build_analysis_query_body(self, annotation):
         query_body = self.add_analysis_type_filter(self.mendelian_analysis_type)
 
         if annotation == 'VEP' and self.mendelian_analysis_type in ['autosomal_recessive', 'compound_heterozygous', 'x_linked_recessive']:
@@ -152,25 +227,48 @@ class MendelianElasticSearchQueryExecutor(BaseElasticSearchQueryExecutor):
                 }
              })
 
-        print("$$$$ query %s" % query_body)
+        return query_body
+
+    def process_hit(self, hit):
+        inner_hits_sample = hit['inner_hits']['sample']['hits']['hits']
+        sample_data = extract_sample_inner_hits_as_array(inner_hits_sample)
+        tmp_results = hit.copy()
+        tmp_results['_source']['sample'] = sample_data
+        tmp_results['inner_hits'].pop('sample')
+        return tmp_results
+
+    def get_page_query_body(self):
+        return self.get_analysis_query_body(get_es_client(self.dataset_obj))
+
+    def process_page_hits(self, hits):
+        return [self.process_hit(hit) for hit in hits]
+
+    def search(self):
+        results = {
+            "took": None,
+            "hits": {
+                "total": None,
+                "hits": deque()
+            }
+        }
+        count = 0
+        start_time = datetime.datetime.now()
+
+        es = get_es_client(self.dataset_obj)
+        query_body = self.get_analysis_query_body(es)
+
         for hit in helpers.scan(
                 es,
                 query=query_body,
                 scroll=u'5m',
                 size=1000,
                 preserve_order=False,
-                doc_type = '_doc',
                 index=self.dataset_obj.es_index_name):
 
             if self.limit_results and len(results['hits']['hits']) > self.elasticsearch_terminate_after:
                 break
 
-            inner_hits_sample = hit['inner_hits']['sample']['hits']['hits']
-            sample_data = extract_sample_inner_hits_as_array(inner_hits_sample)
-            tmp_results = hit.copy()
-            tmp_results['_source']['sample'] = sample_data
-            tmp_results['inner_hits'].pop('sample')
-            results['hits']['hits'].append(tmp_results)
+            results['hits']['hits'].append(self.process_hit(hit))
             count += 1
         elapsped_time = int((datetime.datetime.now() - start_time).total_seconds() * 1000)
 
@@ -179,6 +277,42 @@ class MendelianElasticSearchQueryExecutor(BaseElasticSearchQueryExecutor):
 
         return results
 
+    async def async_search(self, query_body):
+        """search() for async views, reading the hits of query_body from an async scroll."""
+        results = {
+            "took": None,
+            "hits": {
+                "total": None,
+                "hits": deque()
+            }
+        }
+        count = 0
+        start_time = datetime.datetime.now()
+
+        hits = helpers.async_scan(
+            get_async_es_client(self.dataset_obj),
+            query=query_body,
+            scroll=u'5m',
+            size=1000,
+            preserve_order=False,
+            index=self.dataset_obj.es_index_name)
+        try:
+            async for hit in hits:
+                if self.limit_results and len(results['hits']['hits']) > self.elasticsearch_terminate_after:
+                    break
+
+                results['hits']['hits'].append(self.process_hit(hit))
+                count += 1
+        finally:
+            # clears the scroll when stopping early
+            await hits.aclose()
+
+        results['took'] = int((datetime.datetime.now() - start_time).total_seconds() * 1000)
+        results['hits']['total'] = count
+        self.elasticsearch_response = results
+
+        return results
+
     def excecute_elasticsearch_query(self):
         results = self.search()
         self.elasticsearch_response = results
@@ -221,8 +355,7 @@ class MendelianSearchElasticsearch(BaseSearchElasticsearch):
            }
         }
         """
-        es = elasticsearch.Elasticsearch(
-            host=dataset_es_host, port=dataset_es_port)
+        es = es_clients.get_client(dataset_es_host, dataset_es_port)
 
         body = body_template % (Family_ID)
         results = es.search(index=dataset_es_index_name,
@@ -236,12 +369,13 @@ class MendelianSearchElasticsearch(BaseSearchElasticsearch):
         return (father_id, mother_id, child_id, child_sex)
 
     def get_family_dict(self):
+        self.family_dict = get_family_dict(self.dataset_obj)
+        if self.family_dict is None:
+            self.get_family_dict_from_es()
 
-        family_ids = get_values_from_es(self.dataset_obj.es_index_name,
-                                        self.dataset_obj.es_host,
-                                        self.dataset_obj.es_port,
-                                        'Family_ID',
-                                        'sample')
+    def get_family_dict_from_es(self):
+
+        family_ids = get_value_catalog(self.dataset_obj, 'Family_ID', 'sample').values
 
         family_dict = {}
         for family_id in family_ids:
@@ -281,17 +415,91 @@ class MendelianSearchElasticsearch(BaseSearchElasticsearch):
 
         self.get_family_dict()
         elasticsearch_query_executor = self.elasticsearch_query_executor_class(
-            self.dataset_obj, self.query_body, self.family_dict, self.mendelian_analysis_type, limit_results)
+            self.dataset_obj, self.get_executed_query_body(), self.family_dict, self.mendelian_analysis_type, limit_results)
         self.elasticsearch_response = elasticsearch_query_executor.get_elasticsearch_response()
         self.elasticsearch_response = self.apply_kindred_filtering(self.elasticsearch_response)
         self.elasticsearch_response_time = elasticsearch_query_executor.get_elasticsearch_response_time()
 
-    def search(self):
-        self.run_elasticsearch_dsl()
+    async def async_run_elasticsearch_query_executor(self):
+        elasticsearch_query_executor = self.elasticsearch_query_executor_class(
+            self.dataset_obj, await sync_to_async(self.get_executed_query_body)(), None, self.mendelian_analysis_type,
+            self.limit_results)
+
+        # the family lookups and the mapping the query depends on are independent of each other
+        _, query_body = await asyncio.gather(
+            sync_to_async(self.get_family_dict)(),
+            elasticsearch_query_executor.async_get_analysis_query_body(get_async_es_client(self.dataset_obj)))
+        elasticsearch_query_executor.family_dict = self.family_dict
+
+        self.elasticsearch_response = await elasticsearch_query_executor.async_search(query_body)
+        self.elasticsearch_response = self.apply_kindred_filtering(self.elasticsearch_response)
+        self.elasticsearch_response_time = elasticsearch_query_executor.get_elasticsearch_response_time()
+
+    def get_result_cache_key_parts(self):
+        key_parts = super().get_result_cache_key_parts()
+        key_parts['mendelian_analysis_type'] = self.mendelian_analysis_type
+        key_parts['number_of_kindred'] = self.number_of_kindred
+        return key_parts
+
+    def run_query_and_parse(self):
         self.run_elasticsearch_query_executor()
         self.run_elasticsearch_response_parser_class()
+
+    def search(self):
+        self.run_elasticsearch_dsl()
+        self.run_query_and_parse_cached()
         self.log_search()
 
     def download(self):
         self.run_elasticsearch_query_executor(limit_results=self.limit_results)
         self.run_elasticsearch_response_parser_class()
+
+
+class MendelianSearchResultsPage(BaseSearchResultsPage):
+    elasticsearch_query_executor_class = MendelianElasticSearchQueryExecutor
+    elasticsearch_response_parser_class = MendelianElasticsearchResponseParser
+
+    def get_elasticsearch_query_executor(self):
+        return self.elasticsearch_query_executor_class(self.dataset_obj,
+                                                       self.query_body,
+                                                       get_family_dict(self.dataset_obj),
+                                                       self.search_log_obj.analysis_type.name,
+                                                       limit_results=False)
+
+
+class MendelianDownloadAllResults(BaseDownloadAllResults):
+    """Streams every hit of the mendelian analysis type of a logged search, see BaseDownloadAllResults."""
+
+    def __init__(self, search_log_obj, **kwargs):
+        super().__init__(search_log_obj, **kwargs)
+        self.elasticsearch_query_executor = MendelianElasticSearchQueryExecutor(search_log_obj.dataset,
+                                                                                self.query_body,
+                                                                                get_family_dict(search_log_obj.dataset),
+                                                                                search_log_obj.analysis_type.name,
+                                                                                limit_results=False)
+        if search_log_obj.additional_information:
+            self.number_of_kindred = json.loads(search_log_obj.additional_information).get('number_of_kindred')
+        else:
+            self.number_of_kindred = None
+
+    def get_query_body(self):
+        self.elasticsearch_query_executor.query_body = super().get_query_body()
+        return self.elasticsearch_query_executor.get_page_query_body()
+
+    def get_number_of_slices(self):
+        if self.number_of_kindred:
+            return 1
+        return super().get_number_of_slices()
+
+    def get_hits(self, query_body):
+        hits = super().get_hits(query_body)
+        if not self.number_of_kindred:
+            return hits
+
+        # kindred filtering counts the hits of every variant, so it needs the whole result set
+        hits = list(hits)
+        es_id_counter = Counter(hit['_id'] for hit in hits)
+        return (hit for hit in hits if es_id_counter[hit['_id']] > int(self.number_of_kindred))
+
+    def process_hit(self, hit):
+        return super().process_hit(self.elasticsearch_query_executor.process_hit(hit))
@@ -24,6 +24,12 @@ class DownloadRequest(TimeStampedModel):
     reason = models.TextField()
     contact_email = models.EmailField()
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='Pending')
+    # csv export of the search, started when the request is approved
+    export_job = models.ForeignKey(
+        core.models.ExportJob,
+        on_delete=models.SET_NULL,
+        null=True, blank=True,
+    )
 
     class Meta:
         permissions = (
@@ -3,6 +3,8 @@ import json
 import elasticsearch
 from django.core import serializers
 
+from core.utils import get_es_client
+
 
 class DownloadAllResultsAsOTUTable:
     necessary_fields = ['BMlabid', 'value', 'taxonomy', ]
@@ -24,8 +26,7 @@ class DownloadAllResultsAsOTUTable:
 
         self.add_necessary_fields()
 
-        es = elasticsearch.Elasticsearch(
-            host=self.search_log_obj.dataset.es_host)
+        es = get_es_client(self.search_log_obj.dataset)
         for hit in elasticsearch.helpers.scan(es,
                                               query=self.query_body,
                                               scroll=u'5m',
@@ -9,6 +9,7 @@ from django.views.generic.list import ListView
 
 import core
 from common.utils import Echo
+from core.exports import start_export_job
 
 from .forms import DownloadRequestForm
 from .models import DownloadRequest
@@ -55,9 +56,9 @@ class DownloadRequestListView(ListView):
 
     def get_queryset(self):
         if self.request.user.has_perm('microbiome.can_view_all_download_requests'):
-            return DownloadRequest.objects.all()
+            return DownloadRequest.objects.all().select_related('export_job')
         else:
-            return DownloadRequest.objects.filter(user=self.request.user)
+            return DownloadRequest.objects.filter(user=self.request.user).select_related('export_job')
 
 
 class DownloadRequestReviewListView(ListView):
@@ -80,8 +81,9 @@ def approve_download_request(request, download_request_id):
             DownloadRequest, pk=download_request_id)
 
         download_request_obj.status = 'Approved'
+        if download_request_obj.export_job is None:
+            download_request_obj.export_job = start_export_job(download_request_obj.user, download_request_obj.search_log)
         download_request_obj.save()
-        print(download_request_obj.status)
 
         return redirect('download-request-review-list')
 
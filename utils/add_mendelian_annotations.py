@@ -149,99 +149,6 @@ autosomal_dominant_query_body_template = """{
 }
 }"""
 
-compound_heterozygous_vep_query_body_template = """{
- "_source": ["sample", "CHROM", "ID", "POS", "REF", "Variant"
- ],
- "query": {
-     "bool": {
-         "filter": [
-             {"nested": {
-                 "path": "sample",
-                 "query": {
-                   "bool": {
-                     "filter": [
-                       {"term": {"sample.Sample_ID": "%s"}},
-                       {"terms": {"sample.GT": ["0/1", "0|1", "1|0"]}},
-                       {"term": {"sample.Phenotype": "2"}},
-                       {"term": {"sample.Mother_Phenotype": "1"}},
-                       {"term": {"sample.Father_Phenotype": "1"}}
-                     ]
-                   }
-                 },
-                 "score_mode": "none"
-                }
-             },
-             {"nested": {
-                 "path": "CSQ_nested",
-                 "query": {
-                   "bool": {
-                     "filter": [
-                       {"terms": {"CSQ_nested.Consequence": ["frameshift_variant", "splice_acceptor_variant", "splice_donor_variant", "start_lost", "start_retained_variant", "stop_gained", "stop_lost"]}},
-                       {"term": {"CSQ_nested.SYMBOL": "%s"}}
-                     ]
-                   }
-                 },
-                 "score_mode": "none"
-                }
-             }
-         ],
-         "must_not" : [
-             {"terms": {"CHROM": ["X", "Y"]}}
-        ]
-     }
- }
-}"""
-
-
-compound_heterozygous_annovar_query_body_template = """{
- "_source": ["sample", "CHROM", "ID", "POS", "REF", "Variant"
- ],
- "query": {
-     "bool": {
-         "filter": [
-             {"nested": {
-                 "path": "sample",
-                 "query": {
-                   "bool": {
-                     "filter": [
-                       {"term": {"sample.Sample_ID": "%s"}},
-                       {"terms": {"sample.GT": ["0/1", "0|1", "1|0"]}},
-                       {"term": {"sample.Phenotype": "2"}},
-                       {"term": {"sample.Mother_Phenotype": "1"}},
-                       {"term": {"sample.Father_Phenotype": "1"}}
-                     ]
-                   }
-                 },
-                 "score_mode": "none"
-                }
-             },
-             {"nested": {
-                 "path": "AAChange_refGene",
-                 "query": {
-                   "bool": {
-                     "filter": [
-                       {"term": {"AAChange_refGene.Gene": "%s"}}
-                     ]
-                   }
-                 },
-                 "score_mode": "none"
-                }
-             }
-         ],
-         "must_not" : [
-             {"terms": {"CHROM": ["X", "Y"]}}
-        ],
-        "should" : [
-             {"terms": {"ExonicFunc_ensGene": ["frameshift_deletion", "frameshift_insertion", "stopgain", "stoploss"]}},
-             {"terms": {"ExonicFunc_refGene": ["frameshift_deletion", "frameshift_insertion", "stopgain", "stoploss"]}},
-             {"term": {"Func_ensGene": "splicing"}},
-             {"term": {"Func_refGene": "splicing"}}
-        ],
-        "minimum_should_match": 1
-     }
- }
-}"""
-
 x_linked_dominant_query_body_template = """{
 "_source": ["sample","CHROM","ID","POS","REF","Variant"
 ],
@@ -391,6 +298,12 @@ x_linked_de_novo_query_body_template = """{
 
 import elasticsearch
 from elasticsearch import helpers
+import concurrent.futures
+import contextlib
+import math
+import os
+import threading
+import time
 import pprint
 import json
 from natsort import natsorted
@@ -478,120 +391,6 @@ def is_x_linked_denovo(sample_information):
     return False
 
 
-def get_vep_genes_from_es_for_compound_heterozygous(es, index_name):
-    compound_heterozygous_query_body_template = """{
-         "_source": ["sample", "CHROM", "ID", "POS", "REF", "Variant", "CSQ_nested"
-         ],
-         "query": {
-             "bool": {
-                 "filter": [
-                     {"nested": {
-                         "path": "sample",
-                         "query": {
-                           "bool": {
-                             "filter": [
-                               {"terms": {"sample.GT": ["0/1", "0|1", "1|0"]}},
-                               {"term": {"sample.Phenotype": "2"}},
-                               {"term": {"sample.Mother_Phenotype": "1"}},
-                               {"term": {"sample.Father_Phenotype": "1"}}
-                             ]
-                           }
-                         },
-                         "score_mode": "none"
-                        }
-                     },
-                     {"nested": {
-                         "path": "CSQ_nested",
-                         "query": {
-                           "bool": {
-                             "filter": [
-                               {"terms": {"CSQ_nested.Consequence": ["frameshift_variant", "splice_acceptor_variant", "splice_donor_variant", "start_lost", "start_retained_variant", "stop_gained", "stop_lost"]}}
-                             ]
-                           }
-                         },
-                         "score_mode": "none"
-                        }
-                     }
-                 ],
-                 "must_not" : [
-                     {"terms": {"CHROM": ["X", "Y"]}}
-                ]
-             }
-         },
-         "size": 0,
-        "aggs" : {
-            "values" : {
-                "nested" : {
-                    "path" : "CSQ_nested"
-                },
-                "aggs" : {
-                    "values" : {"terms" : {"field" : "CSQ_nested.SYMBOL", "size" : 30000}}
-                }
-            }
-        }
-        }"""
-
-    results = es.search(index=index_name,
-                        body=compound_heterozygous_query_body_template, request_timeout=120)
-    return natsorted([ele['key'] for ele in results["aggregations"]["values"]["values"]["buckets"] if ele['key']])
-
-
-def get_annovar_genes_from_es_for_compound_heterozygous(es, index_name):
-    query = {
-        "_source": ["sample", "CHROM", "ID", "POS", "REF", "Variant", "CSQ_nested"],
-        "query": {
-            "bool": {
-                "filter": [
-                    {
-                        "nested": {
-                            "path": "sample",
-                            "query": {
-                                "bool": {
-                                    "filter": [
-                                        {"terms": {"sample.GT": ["0/1", "0|1", "1|0"]}},
-                                        {"term": {"sample.Phenotype": "2"}},
-                                        {"term": {"sample.Mother_Phenotype": "1"}},
-                                        {"term": {"sample.Father_Phenotype": "1"}}
-                                    ]
-                                }
-                            },
-                            "score_mode": "none"
-                        }
-                    }
-                ],
-                "must_not": [
-                    {"terms": {"CHROM": ["X", "Y"]}}
-                ],
-                "should": [
-                    {"terms": {"ExonicFunc_ensGene": ["frameshift_deletion", "frameshift_insertion", "stopgain", "stoploss"]}},
-                    {"terms": {"ExonicFunc_refGene": ["frameshift_deletion", "frameshift_insertion", "stopgain", "stoploss"]}},
-                    {"term": {"Func_ensGene": "splicing"}},
-                    {"term": {"Func_refGene": "splicing"}}
-                ],
-                "minimum_should_match": 1
-            }
-        },
-        "size": 0,
-        "aggs": {
-            "values": {
-                "nested": {
-                    "path": "AAChange_refGene"
-                },
-                "aggs": {
-                    "values": {
-                        "terms": {
-                            "field": "AAChange_refGene.Gene",
-                            "size": 30000
-                        }
-                    }
-                }
-            }
-        }
-    }
-
-    results = es.search(index=index_name, body=query, request_timeout=120)
-    return natsorted([ele['key'] for ele in results["aggregations"]["values"]["values"]["buckets"] if ele['key']])
-
 def get_values_from_es(es, index_name, field_es_name, field_path):
 
     if not field_path:
@@ -678,35 +477,29 @@ def get_family_dict(es, index_name):
     return family_dict
 
 
-def pop_sample_with_id(sample_array, sample_id):
-
-    saved_index = 0
-    for index, sample in enumerate(sample_array):
-        if sample.get('Sample_ID') == sample_id:
-            saved_index = index
-
-    sample = sample_array.pop(saved_index)
-
-    return sample
-
-
-def pop_sample_with_id_apply_compound_het_rules(sample_array, sample_id):
-
-    saved_index = 0
-    for index, sample in enumerate(sample_array):
-        if sample.get('Sample_ID') == sample_id:
-            saved_index = index
+def get_family_dict_from_ped(ped_info):
+    """
+    Same layout as get_family_dict, built from process_ped_file output instead of Elasticsearch. Every subject
+    with both parents is a child and is listed in 'children'; child_id and child_sex are the first of them.
+    """
+    family_dict = {}
+    for subject, ped in natsorted(ped_info.items()):
+        if not ped.get('family') or not ped.get('father') or not ped.get('mother'):
+            continue
+        family = family_dict.setdefault(ped['family'], {'father_id': ped['father'],
+                                                        'mother_id': ped['mother'],
+                                                        'child_id': subject,
+                                                        'child_sex': ped.get('sex'),
+                                                        'children': []})
+        family['children'].append({'child_id': subject, 'child_sex': ped.get('sex')})
 
-    sample = sample_array.pop(saved_index)
+    return family_dict
 
-    if (sample.get('Mother_Genotype') in ["0/1", "0|1", "1|0"] and
-            sample.get('Father_Genotype') in ["0/0", "0|0"]):
-        return sample
-    elif (sample.get('Mother_Genotype') in ["0/0", "0|0"] and
-          sample.get('Father_Genotype') in ["0/1", "0|1", "1|0"]):
-        return sample
 
-    return None
+def get_child_ids(family):
+    if family.get('children'):
+        return [child['child_id'] for child in family['children']]
+    return [family['child_id']] if family.get('child_id') else []
 
 
 def are_variants_compound_heterozygous(variants):
@@ -740,579 +533,525 @@ def are_variants_compound_heterozygous(variants):
         return False
 
 
-def annotate_autosomal_recessive(es, index_name,family_dict, annotation):
-
-    sample_matched = []
-    for family_id, family in family_dict.items():
-        count = 0
-        actions = []
-        child_id = family.get('child_id')
-        # print(child_id)
-        if annotation == 'vep':
-            query_body = autosomal_recessive_vep_query_body_template % (child_id)
-        elif annotation == 'annovar':
-            query_body = autosomal_recessive_annovar_query_body_template % (child_id)
-        # print(query_body)
-        query_body = json.loads(query_body)
-        for hit in helpers.scan(
-                es,
-                query=query_body,
-                scroll=u'5m',
-                size=1000,
-                preserve_order=False,
-                index=index_name):
-
-            es_id = hit['_id']
-            sample_array = hit["_source"]["sample"]
-            sample = pop_sample_with_id(sample_array, child_id)
-            tmp_id = es_id + child_id
-            mendelian_diseases = sample.get('mendelian_diseases', [])
-            if 'autosomal_recessive' in mendelian_diseases:
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-                continue
-
-            to_update = False
-            if mendelian_diseases:
-                if 'autosomal_recessive' not in mendelian_diseases:
-                    mendelian_diseases.append('autosomal_recessive')
-                    to_update = True
-            else:
-                to_update = True
-                sample['mendelian_diseases'] = ['autosomal_recessive']
-
-
-            if tmp_id not in sample_matched:
-                sample_matched.append(tmp_id)
-
-            if to_update:
-                sample_array.append(sample)
-                action = {
-                    "_index": index_name,
-                    '_op_type': 'update',
-                    "_id": es_id,
-                    "doc": {
-                        "sample": sample_array
-                    }
-                }
-                count += 1
-
-                actions.append(action)
-
-
-            if count % 500 == 0:
-                helpers.bulk(es, actions, refresh=True)
-                actions = []
-
-        helpers.bulk(es, actions, refresh=True)
-        es.indices.refresh(index=index_name)
-        es.cluster.health(wait_for_no_relocating_shards=True)
-
+range_rules = {
+    'hg19/GRCh37': ([60001, 2699520], [154931044, 155260560]),
+    'hg38/GRCh38': ([10001, 2781479], [155701383, 156030895])
+}
+24, 382, 427
 
-    print('Found {} autosomal_recessive samples'.format(len(list(set(sample_matched)))))
 
+# painless script stored in the cluster that appends a tag to the mendelian_diseases of the given samples only,
+# so an update does not have to send the whole sample array back
+MENDELIAN_TAG_SCRIPT_ID = 'genesysv_add_mendelian_tag'
+MENDELIAN_TAG_SCRIPT = """
+boolean changed = false;
+for (def sample : ctx._source.sample) {
+    if (params.sample_ids.contains(sample.Sample_ID)) {
+        def tags = sample.mendelian_diseases;
+        if (tags == null) {
+            sample.mendelian_diseases = [params.tag];
+            changed = true;
+        } else if (tags instanceof List) {
+            if (!tags.contains(params.tag)) {
+                tags.add(params.tag);
+                changed = true;
+            }
+        } else if (tags != params.tag) {
+            sample.mendelian_diseases = [tags, params.tag];
+            changed = true;
+        }
+    }
+}
+if (!changed) {
+    ctx.op = 'noop';
+}
+"""
+
+# families with more variants than this are scanned with sliced scrolls, one slice per SLICED_SCROLL_MIN_DOCS variants
+SLICED_SCROLL_MIN_DOCS = 100000
+# bulk requests in flight at once across all annotation workers
+MAX_CONCURRENT_BULK_REQUESTS = 4
+MENDELIAN_BULK_SIZE = 500
+# workers tag the same variant documents at the same time; the tag script is idempotent, so a conflicting
+# update is simply run again on the new version
+MENDELIAN_RETRY_ON_CONFLICT = 10
+
+# tag, query template for each annotation type, rule applied to the child sample, whether the query takes PAR ranges
+MENDELIAN_ANNOTATIONS = [
+    ('autosomal_recessive', {'vep': autosomal_recessive_vep_query_body_template, 'annovar': autosomal_recessive_annovar_query_body_template}, None, False),
+    ('denovo', denovo_query_body_template, None, False),
+    ('autosomal_dominant', autosomal_dominant_query_body_template, is_autosomal_dominant, False),
+    ('x_linked_dominant', x_linked_dominant_query_body_template, is_x_linked_dominant, True),
+    ('x_linked_recessive', {'vep': x_linked_recessive_vep_query_body_template, 'annovar': x_linked_recessive_annovar_query_body_template}, is_x_linked_recessive, True),
+    ('x_linked_denovo', x_linked_de_novo_query_body_template, is_x_linked_denovo, True),
+]
+
+
+def put_mendelian_tag_script(es):
+    es.put_script(id=MENDELIAN_TAG_SCRIPT_ID, script={"lang": "painless", "source": MENDELIAN_TAG_SCRIPT})
+
+
+def mendelian_tag_action(index_name, es_id, sample_ids, tag):
+    return {
+        "_index": index_name,
+        '_op_type': 'update',
+        "_id": es_id,
+        "retry_on_conflict": MENDELIAN_RETRY_ON_CONFLICT,
+        "script": {
+            "id": MENDELIAN_TAG_SCRIPT_ID,
+            "params": {"sample_ids": sorted(sample_ids), "tag": tag}
+        }
+    }
 
-def annotate_denovo(es, index_name, family_dict):
 
+def get_mendelian_template(tag, annotation):
+    _, templates, _, _ = next(item for item in MENDELIAN_ANNOTATIONS if item[0] == tag)
+    return templates[annotation] if isinstance(templates, dict) else templates
 
-    sample_matched = []
 
-    for family_id, family in family_dict.items():
-        count = 0
-        actions = []
-        child_id = family.get('child_id')
-        # print(child_id)
-        query_body = denovo_query_body_template % (child_id)
-        # print(query_body)
-        query_body = json.loads(query_body)
+def get_mendelian_query(template, child_id, par_ranges, query_slice=None):
+    if par_ranges:
+        query = json.loads(template % (child_id, par_ranges[0][0], par_ranges[0][1], par_ranges[1][0], par_ranges[1][1]))
+    else:
+        query = json.loads(template % (child_id))
+
+    # only the matching child sample is needed, it comes back as an inner hit
+    query['_source'] = False
+    for query_filter in query['query']['bool']['filter']:
+        if query_filter.get('nested', {}).get('path') == 'sample':
+            query_filter['nested']['inner_hits'] = {"size": 1}
+
+    if query_slice is not None:
+        query['slice'] = {"id": query_slice[0], "max": query_slice[1]}
+
+    return query
+
+
+def bulk_with_limit(es, actions, bulk_limiter=None, chunk_size=MENDELIAN_BULK_SIZE):
+    """helpers.bulk in chunks of chunk_size, holding bulk_limiter only while a request is in flight."""
+    def send(chunk):
+        with bulk_limiter or contextlib.nullcontext():
+            helpers.bulk(es, chunk, chunk_size=chunk_size, request_timeout=120)
+
+    chunk = []
+    for action in actions:
+        chunk.append(action)
+        if len(chunk) >= chunk_size:
+            send(chunk)
+            chunk = []
+    if chunk:
+        send(chunk)
+
+
+def annotate_mendelian(es, index_name, child_id, tag, annotation, assembly='hg19', query_slice=None, bulk_limiter=None):
+    """
+    Add one Mendelian inheritance tag, see MENDELIAN_ANNOTATIONS, to the matching variants of one child.
+    query_slice is (slice id, number of slices) for a sliced scroll. Returns (matched, newly tagged).
+    """
+    _, _, rule, x_linked = next(item for item in MENDELIAN_ANNOTATIONS if item[0] == tag)
+    template = get_mendelian_template(tag, annotation)
+    par_ranges = get_par_ranges(assembly) if x_linked else None
+
+    num_matched = 0
+    num_updated = 0
+
+    def generate_actions():
+        nonlocal num_matched, num_updated
         for hit in helpers.scan(
                 es,
-                query=query_body,
+                query=get_mendelian_query(template, child_id, par_ranges, query_slice),
                 scroll=u'5m',
                 size=1000,
                 preserve_order=False,
                 index=index_name):
 
-            es_id = hit['_id']
-            sample_array = hit["_source"]["sample"]
-            sample = pop_sample_with_id(sample_array, child_id)
-            tmp_id = es_id + child_id
-            mendelian_diseases = sample.get('mendelian_diseases', [])
-            if 'denovo' in mendelian_diseases:
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
+            sample = hit['inner_hits']['sample']['hits']['hits'][0]['_source']
+            if rule is not None and tag not in as_list(sample.get('mendelian_diseases')) and not rule(sample):
                 continue
-            to_update = False
-            if mendelian_diseases:
-                if 'denovo' not in mendelian_diseases:
-                    mendelian_diseases.append('denovo')
-                    print(es_id, mendelian_diseases)
-                    to_update = True
-            else:
-                sample['mendelian_diseases'] = ['denovo']
-                to_update = True
-
-            if tmp_id not in sample_matched:
-                sample_matched.append(tmp_id)
-
-            if to_update:
-                sample_array.append(sample)
-                action = {
-                    "_index": index_name,
-                    '_op_type': 'update',
-                    "_id": es_id,
-                    "doc": {
-                        "sample": sample_array
-                    }
-                }
-                count += 1
 
-                actions.append(action)
+            num_matched += 1
+            if tag not in as_list(sample.get('mendelian_diseases')):
+                num_updated += 1
+                yield mendelian_tag_action(index_name, hit['_id'], [child_id], tag)
 
+    bulk_with_limit(es, generate_actions(), bulk_limiter)
 
-            if count % 500 == 0:
-                helpers.bulk(es, actions, refresh=True)
-                actions = []
+    return num_matched, num_updated
 
-        helpers.bulk(es, actions, refresh=True)
-        es.indices.refresh(index=index_name)
-        es.cluster.health(wait_for_no_relocating_shards=True)
 
+def count_child_variants(es, index_name, child_id):
+    query = {"nested": {"path": "sample", "query": {"term": {"sample.Sample_ID": child_id}}, "score_mode": "none"}}
+    return es.count(index=index_name, query=query)['count']
 
-    print('Found {} denovo samples'.format(len(list(set(sample_matched)))))
 
+def get_num_slices(num_docs, num_workers):
+    if num_workers < 2 or num_docs <= SLICED_SCROLL_MIN_DOCS:
+        return 1
+    return min(num_workers, math.ceil(num_docs / SLICED_SCROLL_MIN_DOCS))
 
-def annotate_autosomal_dominant(es, index_name, family_dict):
 
+def summarize_mendelian_timings(timings, report_file=None):
+    """
+    timings holds one (tag, family_id, seconds, matched, newly tagged) row per task. Prints the totals
+    per analysis type and the slowest families, and writes every row to report_file.
+    """
+    if report_file:
+        with open(report_file, 'w') as fp:
+            fp.write("analysis\tfamily\tseconds\tmatched\ttagged\n")
+            for row in timings:
+                fp.write("%s\t%s\t%.3f\t%d\t%d\n" % row)
 
-    sample_matched = []
+    per_type = {}
+    per_family = {}
+    for tag, family_id, seconds, matched, updated in timings:
+        totals = per_type.setdefault(tag, [0, 0.0, 0, 0])
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += matched
+        totals[3] += updated
+        per_family[family_id] = per_family.get(family_id, 0) + seconds
 
-    for family_id, family in family_dict.items():
-        count = 0
-        actions = []
-        child_id = family.get('child_id')
-        # print(child_id)
-        query_body = autosomal_dominant_query_body_template % (child_id)
-        # print(query_body)
-        query_body = json.loads(query_body)
-        for hit in helpers.scan(
-                es,
-                query=query_body,
-                scroll=u'5m',
-                size=1000,
-                preserve_order=False,
-                index=index_name):
-            # pprint.pprint(hit["_source"])
-            es_id = hit['_id']
-            sample_array = hit["_source"]["sample"]
-            sample = pop_sample_with_id(sample_array, child_id)
-            mendelian_diseases = sample.get('mendelian_diseases', [])
-            tmp_id = es_id + child_id
-            if 'autosomal_dominant' in mendelian_diseases:
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-                continue
+    for tag, (num_tasks, seconds, matched, updated) in per_type.items():
+        print("%-22s %5d tasks %8.1f seconds, found %d, %d newly tagged" % (tag, num_tasks, seconds, matched, updated))
 
-            if is_autosomal_dominant(sample):
-                to_update = False
-                if mendelian_diseases:
-                    if 'autosomal_dominant' not in mendelian_diseases:
-                        mendelian_diseases.append('autosomal_dominant')
-                        print(es_id, mendelian_diseases)
-                        to_update = True
-                else:
-                    sample['mendelian_diseases'] = ['autosomal_dominant']
-                    to_update = True
-
-
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-                if to_update:
-                    sample_array.append(sample)
-                    action = {
-                        "_index": index_name,
-                        '_op_type': 'update',
-                        "_id": es_id,
-                        "doc": {
-                            "sample": sample_array
-                        }
-                    }
-                    count += 1
+    slowest = sorted(per_family.items(), key=lambda item: item[1], reverse=True)[:10]
+    print("Slowest families: " + ', '.join("%s %.1fs" % (family_id, seconds) for family_id, seconds in slowest))
+    if report_file:
+        print("Per family timings written to %s" % report_file)
 
-                    actions.append(action)
 
+def annotate_mendelian_inheritance(es, index_name, family_dict, annotation, assembly='hg19', num_workers=1, report_file=None):
+    """
+    Run every Mendelian annotation, including compound heterozygous, and refresh the index once at the end.
 
-                if count % 500 == 0:
-                    helpers.bulk(es, actions, refresh=True)
-                    actions = []
+    Every (analysis type, family) pair is one task. With num_workers > 1 the tasks run on a thread pool that
+    shares es and its connection pool, families with many variants are split into sliced scrolls, and at most
+    MAX_CONCURRENT_BULK_REQUESTS bulk requests are sent at once.
+    """
+    put_mendelian_tag_script(es)
+    all_start_time = time.time()
+    num_workers = max(1, int(num_workers))
+    bulk_limiter = threading.BoundedSemaphore(min(num_workers, MAX_CONCURRENT_BULK_REQUESTS))
 
-        helpers.bulk(es, actions, refresh=True)
-        es.indices.refresh(index=index_name)
-        es.cluster.health(wait_for_no_relocating_shards=True)
+    children = [(family_id, child_id) for family_id, family in family_dict.items() for child_id in get_child_ids(family)]
 
+    def run_task(tag, family_id, child_id, query_slice):
+        start_time = time.time()
+        matched, updated = annotate_mendelian(es, index_name, child_id, tag, annotation, assembly, query_slice, bulk_limiter)
+        return tag, family_id, time.time() - start_time, matched, updated
 
-    print('Found {} autosomal dominant samples'.format(len(list(set(sample_matched)))))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        num_slices = {child_id: 1 for _, child_id in children}
+        if num_workers > 1:
+            counts = executor.map(lambda child: count_child_variants(es, index_name, child[1]), children)
+            num_slices = {child_id: get_num_slices(num_docs, num_workers) for (_, child_id), num_docs in zip(children, counts)}
 
+        futures = []
+        for tag, _, _, _ in MENDELIAN_ANNOTATIONS:
+            for family_id, child_id in children:
+                slices = num_slices[child_id]
+                for slice_id in range(slices):
+                    query_slice = (slice_id, slices) if slices > 1 else None
+                    futures.append(executor.submit(run_task, tag, family_id, child_id, query_slice))
 
-range_rules = {
-    'hg19/GRCh37': ([60001, 2699520], [154931044, 155260560]),
-    'hg38/GRCh38': ([10001, 2781479], [155701383, 156030895])
-}
-24, 382, 427
+        timings = [future.result() for future in futures]
 
+    print('Finished %d Mendelian annotation tasks on %d workers in %d seconds' % (len(timings), num_workers, int(time.time() - all_start_time)))
 
-def annotate_x_linked_dominant(es, index_name, family_dict):
+    # the candidate scan has to see the documents as they are now
+    es.indices.refresh(index=index_name)
 
+    start_time = time.time()
+    num_tagged = annotate_compound_heterozygous(es, index_name, family_dict, annotation, bulk_limiter)
+    timings.append(('compound_heterozygous', 'all families', time.time() - start_time, num_tagged, num_tagged))
 
-    sample_matched = []
-    for family_id, family in family_dict.items():
-        count = 0
-        actions = []
-        child_id = family.get('child_id')
-        # print(child_id)
-        query_body = x_linked_dominant_query_body_template % (
-            child_id,
-            range_rules['hg19/GRCh37'][0][0],
-            range_rules['hg19/GRCh37'][0][1],
-            range_rules['hg19/GRCh37'][1][0],
-            range_rules['hg19/GRCh37'][1][1])
-        # print(query_body)
-        query_body = json.loads(query_body)
-        for hit in helpers.scan(
-                es,
-                query=query_body,
-                scroll=u'5m',
-                size=1000,
-                preserve_order=False,
-                index=index_name):
-            # pprint.pprint(hit["_source"])
-            es_id = hit['_id']
-            # print(es_id)
-            sample_array = hit["_source"]["sample"]
-            sample = pop_sample_with_id(sample_array, child_id)
-            tmp_id = es_id + child_id
-            mendelian_diseases = sample.get('mendelian_diseases', [])
-
-            if 'x_linked_dominant' in mendelian_diseases:
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-                continue
+    summarize_mendelian_timings(timings, report_file)
+    print('Finished annotating all in ', int(time.time() - all_start_time), 'seconds')
 
-            if is_x_linked_dominant(sample):
-                to_update = False
-                if mendelian_diseases:
-                    if 'x_linked_dominant' not in mendelian_diseases:
-                        mendelian_diseases.append('x_linked_dominant')
-                        print(es_id, mendelian_diseases)
-                        to_update = True
-                else:
-                    sample['mendelian_diseases'] = ['x_linked_dominant']
-                    to_update = True
-
-
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-
-                if to_update:
-                    sample_array.append(sample)
-                    action = {
-                        "_index": index_name,
-                        '_op_type': 'update',
-                        "_id": es_id,
-                        "doc": {
-                            "sample": sample_array
-                        }
-                    }
-                    count += 1
-
-                    actions.append(action)
-
-
-                if count % 500 == 0:
-                    helpers.bulk(es, actions, refresh=True)
-                    actions = []
-
-        helpers.bulk(es, actions, refresh=True)
-        es.indices.refresh(index=index_name)
-        es.cluster.health(wait_for_no_relocating_shards=True)
-
-
-    print('Found {} x_linked_dominant samples'.format(len(list(set(sample_matched)))))
-
-
-def annotate_x_linked_recessive(es, index_name, family_dict, annotation):
 
+def get_compound_heterozygous_candidate_query(annotation, child_ids):
+    """One query for the compound heterozygous candidates of all children, whatever the gene."""
+    sample_filter = {"nested": {
+        "path": "sample",
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"sample.Sample_ID": sorted(child_ids)}},
+                    {"terms": {"sample.GT": HETEROZYGOUS_GENOTYPES}},
+                    {"term": {"sample.Phenotype": "2"}},
+                    {"term": {"sample.Mother_Phenotype": "1"}},
+                    {"term": {"sample.Father_Phenotype": "1"}}
+                ]
+            }
+        },
+        "score_mode": "none"
+    }}
+
+    if annotation == 'vep':
+        return {
+            "_source": ["sample", "CHROM", "POS", "Variant", "CSQ_nested"],
+            "query": {
+                "bool": {
+                    "filter": [
+                        sample_filter,
+                        {"nested": {
+                            "path": "CSQ_nested",
+                            "query": {"terms": {"CSQ_nested.Consequence": sorted(HIGH_IMPACT_VEP_CONSEQUENCES)}},
+                            "score_mode": "none"
+                        }}
+                    ],
+                    "must_not": [{"terms": {"CHROM": ["X", "Y"]}}]
+                }
+            }
+        }
 
-    sample_matched = []
+    return {
+        "_source": ["sample", "CHROM", "POS", "Variant", "AAChange_refGene", "ExonicFunc_ensGene", "ExonicFunc_refGene", "Func_ensGene", "Func_refGene"],
+        "query": {
+            "bool": {
+                "filter": [sample_filter],
+                "must_not": [{"terms": {"CHROM": ["X", "Y"]}}],
+                "should": [
+                    {"terms": {"ExonicFunc_ensGene": sorted(HIGH_IMPACT_ANNOVAR_EXONIC_FUNCS)}},
+                    {"terms": {"ExonicFunc_refGene": sorted(HIGH_IMPACT_ANNOVAR_EXONIC_FUNCS)}},
+                    {"term": {"Func_ensGene": "splicing"}},
+                    {"term": {"Func_refGene": "splicing"}}
+                ],
+                "minimum_should_match": 1
+            }
+        }
+    }
 
-    for family_id, family in family_dict.items():
-        count = 0
-        actions = []
-        child_id = family.get('child_id')
-        # print(child_id)
-        if annotation == 'vep':
-            query_body = x_linked_recessive_vep_query_body_template % (
-                child_id,
-                range_rules['hg19/GRCh37'][0][0],
-                range_rules['hg19/GRCh37'][0][1],
-                range_rules['hg19/GRCh37'][1][0],
-                range_rules['hg19/GRCh37'][1][1]
-            )
-        elif annotation == 'annovar':
-            query_body = x_linked_recessive_annovar_query_body_template % (
-                child_id,
-                range_rules['hg19/GRCh37'][0][0],
-                range_rules['hg19/GRCh37'][0][1],
-                range_rules['hg19/GRCh37'][1][0],
-                range_rules['hg19/GRCh37'][1][1]
-            )
 
-        # print(query_body)
-        query_body = json.loads(query_body)
-        for hit in helpers.scan(
-                es,
-                query=query_body,
-                scroll=u'5m',
-                size=1000,
-                preserve_order=False,
-                index=index_name):
-            # pprint.pprint(hit["_source"])
-            es_id = hit['_id']
-            sample_array = hit["_source"]["sample"]
-            sample = pop_sample_with_id(sample_array, child_id)
-            tmp_id = es_id + child_id
-            mendelian_diseases = sample.get('mendelian_diseases', [])
-            if 'x_linked_recessive' in mendelian_diseases:
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-                    continue
-
-            if is_x_linked_recessive(sample):
-
-                # sample['mendelian_diseases'] = 'x_linked_recessive'
-                to_update = False
-                if mendelian_diseases:
-                    if 'x_linked_recessive' not in mendelian_diseases:
-                        mendelian_diseases.append('x_linked_recessive')
-                        print(es_id, mendelian_diseases)
-                        to_update = True
-                else:
-                    sample['mendelian_diseases'] = ['x_linked_recessive']
-                    to_update = True
-
-
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-
-
-                if to_update:
-                    sample_array.append(sample)
-                    action = {
-                        "_index": index_name,
-                        '_op_type': 'update',
-                        "_id": es_id,
-                        "doc": {
-                            "sample": sample_array
-                        }
-                    }
-                    count += 1
+def annotate_compound_heterozygous(es, index_name, family_dict, annotation, bulk_limiter=None):
+    """Tag the compound heterozygous variants of every child, returns the number of samples tagged."""
+    child_ids = {child_id for family in family_dict.values() for child_id in get_child_ids(family)}
+    if not child_ids:
+        return 0
+
+    # a single scan over every candidate, grouped in memory per child and gene
+    groups = {}
+    for hit in helpers.scan(
+            es,
+            query=get_compound_heterozygous_candidate_query(annotation, child_ids),
+            scroll=u'5m',
+            size=1000,
+            preserve_order=False,
+            index=index_name):
+
+        genes = get_compound_heterozygous_genes(hit['_source'], annotation)
+        if not genes:
+            continue
 
-                    actions.append(action)
+        for sample in hit['_source']['sample']:
+            child_id = sample.get('Sample_ID')
+            if child_id not in child_ids or not is_compound_heterozygous_candidate(sample):
+                continue
 
+            for gene in genes:
+                groups.setdefault((child_id, gene), []).append({
+                    'es_id': hit['_id'],
+                    'Father_Genotype': sample.get('Father_Genotype'),
+                    'Mother_Genotype': sample.get('Mother_Genotype')})
 
-                if count % 500 == 0:
-                    helpers.bulk(es, actions, refresh=True)
-                    actions = []
+    to_tag = {}
+    for (child_id, gene), samples in groups.items():
+        if len(samples) > 1 and are_variants_compound_heterozygous(samples):
+            for sample in samples:
+                to_tag.setdefault(sample['es_id'], set()).add(child_id)
 
-        helpers.bulk(es, actions, refresh=True)
-        es.indices.refresh(index=index_name)
-        es.cluster.health(wait_for_no_relocating_shards=True)
+    put_mendelian_tag_script(es)
+    actions = (mendelian_tag_action(index_name, es_id, sample_ids, 'compound_heterozygous') for es_id, sample_ids in to_tag.items())
+    bulk_with_limit(es, actions, bulk_limiter)
+    es.indices.refresh(index=index_name)
 
-    print('Found {} x_linked_recessive samples'.format(len(list(set(sample_matched)))))
+    num_tagged = sum(len(child_ids) for child_ids in to_tag.values())
+    print('Found {} compound_heterozygous samples'.format(num_tagged))
 
+    return num_tagged
 
-def annotate_x_linked_denovo(es, index_name, family_dict):
 
+HETEROZYGOUS_GENOTYPES = ["0/1", "0|1", "1|0"]
+HOMOZYGOUS_ALT_GENOTYPES = ["1/1", "1|1"]
+HOMOZYGOUS_REF_GENOTYPES = ["0/0", "0|0"]
+HIGH_IMPACT_VEP_CONSEQUENCES = {"frameshift_variant", "splice_acceptor_variant", "splice_donor_variant", "start_lost", "start_retained_variant", "stop_gained", "stop_lost"}
+HIGH_IMPACT_ANNOVAR_EXONIC_FUNCS = {"frameshift_deletion", "frameshift_insertion", "stopgain", "stoploss"}
 
 
-    sample_matched = []
-    for family_id, family in family_dict.items():
-        count = 0
-        actions = []
-        child_id = family.get('child_id')
-        # print(child_id)
-        query_body = x_linked_de_novo_query_body_template % (
-            child_id,
-            range_rules['hg19/GRCh37'][0][0],
-            range_rules['hg19/GRCh37'][0][1],
-            range_rules['hg19/GRCh37'][1][0],
-            range_rules['hg19/GRCh37'][1][1])
-        # print(query_body)
-        query_body = json.loads(query_body)
-        for hit in helpers.scan(
-                es,
-                query=query_body,
-                scroll=u'5m',
-                size=1000,
-                preserve_order=False,
-                index=index_name):
-            # pprint.pprint(hit["_source"])
-            es_id = hit['_id']
+def get_par_ranges(assembly):
+    if assembly in ['hg38', 'GRCh38']:
+        return range_rules['hg38/GRCh38']
+    return range_rules['hg19/GRCh37']
 
-            sample_array = hit["_source"]["sample"]
-            sample = pop_sample_with_id(sample_array, child_id)
 
-            tmp_id = es_id + child_id
-            mendelian_diseases = sample.get('mendelian_diseases', [])
-            if 'x_linked_denovo' in mendelian_diseases:
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-                continue
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
 
-            if is_x_linked_denovo(sample):
-                mendelian_diseases = sample.get('mendelian_diseases')
-                to_update = False
-                if mendelian_diseases:
-                    if 'x_linked_denovo' not in mendelian_diseases:
-                        mendelian_diseases.append('x_linked_denovo')
-                        print(type(mendelian_diseases), es_id, mendelian_diseases)
-                        to_update = True
-                else:
-                    sample['mendelian_diseases'] = ['x_linked_denovo']
-                    to_update = True
-
-
-                tmp_id = es_id + child_id
-                if tmp_id not in sample_matched:
-                    sample_matched.append(tmp_id)
-
-                if to_update:
-                    sample_array.append(sample)
-                    action = {
-                        "_index": index_name,
-                        '_op_type': 'update',
-                        "_id": es_id,
-                        "doc": {
-                            "sample": sample_array
-                        }
-                    }
-                    count += 1
-
-                    actions.append(action)
 
+def has_high_impact_annovar_function(variant):
+    for field in ['ExonicFunc_ensGene', 'ExonicFunc_refGene']:
+        if HIGH_IMPACT_ANNOVAR_EXONIC_FUNCS.intersection(as_list(variant.get(field))):
+            return True
+    for field in ['Func_ensGene', 'Func_refGene']:
+        if 'splicing' in as_list(variant.get(field)):
+            return True
+    return False
 
-                if count % 500 == 0:
-                    helpers.bulk(es, actions, refresh=True)
-                    actions = []
 
-        helpers.bulk(es, actions, refresh=True)
-        es.indices.refresh(index=index_name)
-        es.cluster.health(wait_for_no_relocating_shards=True)
+def is_high_impact_csq(csq):
+    return bool(HIGH_IMPACT_VEP_CONSEQUENCES.intersection(as_list(csq.get('Consequence'))))
 
 
-    print('Found {} x_linked_denovo samples'.format(len(list(set(sample_matched)))))
+def has_high_impact_variant(variant, annotation):
+    if annotation == 'vep':
+        return any(is_high_impact_csq(csq) for csq in variant.get('CSQ_nested', []))
+    return has_high_impact_annovar_function(variant)
 
 
-def annotate_compound_heterozygous(es, index_name, family_dict, annotation):
+def is_compound_heterozygous_candidate(sample):
+    """Sample side of the compound heterozygous query: affected heterozygous child, healthy parents, one of them carrier."""
+    if (sample.get('GT') not in HETEROZYGOUS_GENOTYPES or sample.get('Phenotype') != '2' or
+            sample.get('Mother_Phenotype') != '1' or sample.get('Father_Phenotype') != '1'):
+        return False
 
+    mother_gt = sample.get('Mother_Genotype')
+    father_gt = sample.get('Father_Genotype')
+    return ((mother_gt in HETEROZYGOUS_GENOTYPES and father_gt in HOMOZYGOUS_REF_GENOTYPES) or
+            (mother_gt in HOMOZYGOUS_REF_GENOTYPES and father_gt in HETEROZYGOUS_GENOTYPES))
 
-    sample_matched = []
-    for family_id, family in family_dict.items():
-        child_id = family.get('child_id')
-        if annotation == 'vep':
-            genes = get_vep_genes_from_es_for_compound_heterozygous(es, index_name)
-        elif annotation == 'annovar':
-            genes = get_annovar_genes_from_es_for_compound_heterozygous(es, index_name)
 
-        for gene in genes:
+def get_compound_heterozygous_genes(variant, annotation):
+    """Genes the compound heterozygous queries would have matched this variant with."""
+    if annotation == 'vep':
+        return {csq['SYMBOL'] for csq in variant.get('CSQ_nested', []) if csq.get('SYMBOL') and is_high_impact_csq(csq)}
 
-            if annotation == 'vep':
-                query_body = compound_heterozygous_vep_query_body_template % (child_id, gene)
-            elif annotation == 'annovar':
-                query_body = compound_heterozygous_annovar_query_body_template % (child_id, gene)
-            query_body = json.loads(query_body)
-            samples = []
-            for hit in helpers.scan(
-                    es,
-                    query=query_body,
-                    scroll=u'5m',
-                    size=1000,
-                    preserve_order=False,
-                    index=index_name):
+    if not has_high_impact_annovar_function(variant):
+        return set()
+    return {aachange['Gene'] for aachange in variant.get('AAChange_refGene', []) if aachange.get('Gene')}
 
-                es_id = hit['_id']
-                sample_array = hit["_source"]["sample"]
 
-                sample = pop_sample_with_id_apply_compound_het_rules(sample_array, child_id)
+class MendelianClassifier:
+    """
+    Evaluates the Mendelian inheritance rules for every child with both parents
+    in the ped file while the document is being built, instead of querying the
+    index afterwards. The conditions are the ones of the *_query_body_template
+    queries followed by the matching is_* rule.
 
-                if not sample:
-                    continue
+    Compound heterozygosity needs all variants of a gene, so candidates are only
+    written to candidate_file (document number, child, gene, father and mother
+    genotype) for find_compound_heterozygous() to group once parsing is done.
+    """
 
-                sample.update({'es_id': es_id})
-                samples.append(sample)
+    def __init__(self, annotation, assembly, candidate_file=None):
+        self.annotation = annotation
+        self.par_ranges = get_par_ranges(assembly)
+        self.candidate_fp = open(candidate_file, 'w') if candidate_file else None
+        self.num_docs = 0
 
-            actions = []
-            count = 0
-            if len(samples) > 1 and are_variants_compound_heterozygous(samples):
+    def close(self):
+        if self.candidate_fp:
+            self.candidate_fp.close()
 
-                for sample in samples:
-                    es_id = sample.pop("es_id")
+    def is_in_par(self, pos):
+        return any(start < pos < end for start, end in self.par_ranges)
 
-                    es_document = es.get(index=index_name, id=es_id)
-                    sample_array = es_document["_source"]["sample"]
-                    sample = pop_sample_with_id(sample_array, child_id)
+    def classify(self, variant):
+        doc_number = self.num_docs
+        self.num_docs += 1
 
+        chrom = variant.get('CHROM')
+        autosomal = chrom not in ['X', 'Y']
+        x_linked = chrom == 'X' and not self.is_in_par(variant.get('POS'))
+        if not autosomal and not x_linked:
+            return
 
-                    mendelian_diseases = sample.get('mendelian_diseases', [])
-                    tmp_id = es_id + child_id
-                    if 'compound_heterozygous' in mendelian_diseases:
-                        if tmp_id not in sample_matched:
-                            sample_matched.append(tmp_id)
-                        continue
+        high_impact = None
 
-                    to_update = False
-                    if mendelian_diseases:
-                        if 'compound_heterozygous' not in mendelian_diseases:
-                            mendelian_diseases.append('compound_heterozygous')
-                            print(es_id, mendelian_diseases)
-                            to_update = True
-                    else:
-                        sample['mendelian_diseases'] = ['compound_heterozygous']
-                        to_update = True
+        for sample in variant.get('sample', []):
+            if not sample.get('Father_ID') or not sample.get('Mother_ID') or sample.get('Phenotype') != '2':
+                continue
 
-                    if tmp_id not in sample_matched:
-                        sample_matched.append(tmp_id)
+            gt = sample.get('GT')
+            mother_phenotype = sample.get('Mother_Phenotype')
+            father_phenotype = sample.get('Father_Phenotype')
+            healthy_parents = mother_phenotype == '1' and father_phenotype == '1'
+            affected_parent = mother_phenotype == '2' or father_phenotype == '2'
+            if high_impact is None:
+                high_impact = has_high_impact_variant(variant, self.annotation)
+
+            mendelian_diseases = []
+            if autosomal:
+                if (high_impact and healthy_parents and gt in HOMOZYGOUS_ALT_GENOTYPES and
+                        sample.get('Mother_Genotype') in HETEROZYGOUS_GENOTYPES and
+                        sample.get('Father_Genotype') in HETEROZYGOUS_GENOTYPES):
+                    mendelian_diseases.append('autosomal_recessive')
+                if (healthy_parents and gt in HETEROZYGOUS_GENOTYPES and
+                        sample.get('Mother_Genotype') == '0/0' and sample.get('Father_Genotype') == '0/0'):
+                    mendelian_diseases.append('denovo')
+                if affected_parent and gt in HETEROZYGOUS_GENOTYPES and is_autosomal_dominant(sample):
+                    mendelian_diseases.append('autosomal_dominant')
 
-                    if to_update:
-                        sample_array.append(sample)
-                        action = {
-                            "_index": index_name,
-                            '_op_type': 'update',
-                            "_id": es_id,
-                            "doc": {
-                                "sample": sample_array
-                            }
-                        }
-                        count += 1
+                if self.candidate_fp and is_compound_heterozygous_candidate(sample):
+                    for gene in sorted(get_compound_heterozygous_genes(variant, self.annotation)):
+                        self.candidate_fp.write("%d\t%s\t%s\t%s\t%s\n" % (doc_number, sample['Sample_ID'], gene, sample.get('Father_Genotype'), sample.get('Mother_Genotype')))
+            else:
+                if affected_parent and is_x_linked_dominant(sample):
+                    mendelian_diseases.append('x_linked_dominant')
+                if high_impact and is_x_linked_recessive(sample):
+                    mendelian_diseases.append('x_linked_recessive')
+                if is_x_linked_denovo(sample):
+                    mendelian_diseases.append('x_linked_denovo')
 
-                        actions.append(action)
+            if mendelian_diseases:
+                sample['mendelian_diseases'] = mendelian_diseases
+
+
+def find_compound_heterozygous(candidate_files):
+    """
+    Group the candidates written by MendelianClassifier per child and gene and
+    apply are_variants_compound_heterozygous to each group. Returns
+    {candidate_file: {document number: set of child ids}} for the documents to tag.
+    """
+    groups = {}
+    for candidate_file in candidate_files:
+        if not os.path.exists(candidate_file):
+            continue
+        with open(candidate_file) as fp:
+            for line in fp:
+                doc_number, child_id, gene, father_gt, mother_gt = line.rstrip('\n').split('\t')
+                groups.setdefault((child_id, gene), []).append({
+                    'candidate_file': candidate_file,
+                    'doc_number': int(doc_number),
+                    'Father_Genotype': father_gt,
+                    'Mother_Genotype': mother_gt})
 
+    to_tag = {}
+    for (child_id, gene), samples in groups.items():
+        if len(samples) > 1 and are_variants_compound_heterozygous(samples):
+            for sample in samples:
+                to_tag.setdefault(sample['candidate_file'], {}).setdefault(sample['doc_number'], set()).add(child_id)
 
-                    if count % 500 == 0:
-                        helpers.bulk(es, actions, refresh=True)
-                        actions = []
+    return to_tag
 
-                helpers.bulk(es, actions, refresh=True)
-                es.indices.refresh(index=index_name)
-                es.cluster.health(wait_for_no_relocating_shards=True)
 
+def tag_compound_heterozygous(variant, child_ids):
+    """Add the compound_heterozygous tag to the given children, returns True if anything changed."""
+    changed = False
+    for sample in variant.get('sample', []):
+        if sample.get('Sample_ID') in child_ids:
+            mendelian_diseases = sample.setdefault('mendelian_diseases', [])
+            if 'compound_heterozygous' not in mendelian_diseases:
+                mendelian_diseases.append('compound_heterozygous')
+                changed = True
 
-    print('Found {} compound_heterozygous samples'.format(len(list(set(sample_matched)))))
+    return changed
 
 
 def main():
-    import datetime
-
     index_name = "ashkenazitrio4families"
     annotation = 'vep'
 
@@ -1320,45 +1059,7 @@ def main():
     family_dict = get_family_dict(es, index_name)
     pprint.pprint(family_dict)
 
-    all_start_time = datetime.datetime.now()
-
-    start_time = datetime.datetime.now()
-    print('Starting annotate_autosomal_recessive', start_time)
-    annotate_autosomal_recessive(es, index_name, family_dict, annotation)
-    print('Finished annotate_autosomal_recessive', int((datetime.datetime.now() - start_time).total_seconds()), 'seconds')
-
-    start_time = datetime.datetime.now()
-    print('Starting annotate_denovo', start_time)
-    annotate_denovo(es, index_name,  family_dict)
-    print('Finished annotate_denovo', int((datetime.datetime.now() - start_time).total_seconds()), 'seconds')
-
-    start_time = datetime.datetime.now()
-    print('Starting annotate_autosomal_dominant', start_time)
-    annotate_autosomal_dominant(es, index_name, family_dict)
-    print('Finished annotate_autosomal_dominant', int((datetime.datetime.now() - start_time).total_seconds()), 'seconds')
-
-    start_time = datetime.datetime.now()
-    print('Starting annotate_x_linked_dominant', start_time)
-    annotate_x_linked_dominant(es, index_name, family_dict)
-    print('Finished annotate_x_linked_dominant', int((datetime.datetime.now() - start_time).total_seconds()), 'seconds')
-
-    start_time = datetime.datetime.now()
-    print('Starting annotate_x_linked_recessive', start_time)
-    annotate_x_linked_recessive(es, index_name, family_dict, annotation)
-    print('Finished annotate_x_linked_recessive', int((datetime.datetime.now() - start_time).total_seconds()), 'seconds')
-
-    start_time = datetime.datetime.now()
-    print('Starting annotate_x_linked_denovo', start_time)
-    annotate_x_linked_denovo(es, index_name, family_dict)
-    print('Finished annotate_x_linked_denovo', int((datetime.datetime.now() - start_time).total_seconds()), 'seconds')
-
-    start_time = datetime.datetime.now()
-    print('Starting annotate_compound_heterozygous', start_time)
-    annotate_compound_heterozygous(es, index_name, family_dict, annotation)
-    print('Finished annotate_compound_heterozygous', int(
-        (datetime.datetime.now() - start_time).total_seconds()), 'seconds')
-
-    print('Finished annotating all in ', int((datetime.datetime.now() - all_start_time).total_seconds()), 'seconds')
+    annotate_mendelian_inheritance(es, index_name, family_dict, annotation)
 
 
 if __name__ == "__main__":
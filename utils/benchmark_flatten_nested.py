@@ -0,0 +1,113 @@
+"""
+Micro-benchmark for flattening nested inner hits into result rows (core/flatten.py).
+
+Builds synthetic hits with many CSQ_nested transcripts and many samples, the
+worst case for the cross product of nested paths, and reports rows/sec. With
+--baseline, the same hits are also flattened with BaseElasticsearchResponseParser
+taken from an older core/utils.py, and both outputs are compared. Run it from
+the repository root, e.g.
+
+    git show <commit>:core/utils.py > /tmp/core_utils_before.py
+    python utils/benchmark_flatten_nested.py --baseline /tmp/core_utils_before.py
+"""
+import argparse
+import ast
+import copy
+import itertools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.flatten import MAX_FLATTENED_ROWS_PER_HIT, flatten_results
+
+NESTED_PATHS = ['CSQ_nested', 'sample']
+NON_NESTED_FIELDS = ['CHROM', 'POS', 'REF', 'ALT', 'Variant']
+
+
+def load_parser_class(source_file):
+    """Execute only BaseElasticsearchResponseParser of a core/utils.py that cannot be imported without django."""
+    with open(source_file) as fp:
+        tree = ast.parse(fp.read(), source_file)
+
+    classes = [node for node in tree.body if isinstance(node, ast.ClassDef) and node.name == 'BaseElasticsearchResponseParser']
+    if not classes:
+        raise ValueError("%s does not define BaseElasticsearchResponseParser" % source_file)
+
+    namespace = {'itertools': itertools}
+    exec(compile(ast.Module(body=classes, type_ignores=[]), source_file, 'exec'), namespace)
+    return namespace['BaseElasticsearchResponseParser']
+
+
+def make_results(num_hits, num_transcripts, num_samples):
+    """Results as left by extract_nested_results_from_elasticsearch_response, including one duplicated transcript."""
+    results = []
+    for hit_number in range(num_hits):
+        transcripts = [{'Feature': 'ENST%011d' % i, 'Consequence': 'missense_variant', 'SYMBOL': 'GENE%d' % (i % 7)}
+                       for i in range(num_transcripts - 1)]
+        transcripts.append(dict(transcripts[0]))
+        samples = [{'Sample_ID': 'S%04d' % i, 'GT': '0/1', 'AD': [10, i]} for i in range(num_samples)]
+        results.append({
+            'es_id': 'doc%d' % hit_number,
+            'CHROM': '1',
+            'POS': 10000 + hit_number,
+            'REF': 'A',
+            'ALT': 'G',
+            'Variant': '1-%d-A-G' % (10000 + hit_number),
+            'CSQ_nested': transcripts,
+            'sample': samples,
+        })
+
+    return results
+
+
+def run_flatten(results, limit_results, maximum_table_size):
+    start = time.time()
+    rows = flatten_results(results, NESTED_PATHS, NON_NESTED_FIELDS, max_rows_per_hit=MAX_FLATTENED_ROWS_PER_HIT)
+    if limit_results:
+        rows = itertools.islice(rows, maximum_table_size)
+    rows = list(rows)
+    return time.time() - start, rows
+
+
+def run_baseline(parser_class, results, limit_results):
+    parser = parser_class({'hits': {'hits': []}}, NON_NESTED_FIELDS, NESTED_PATHS, None, limit_results=limit_results)
+    parser.results = results
+
+    start = time.time()
+    parser.flatten_nested_results()
+    rows = parser.flattened_results
+    if limit_results:
+        rows = rows[:parser.maximum_table_size]
+    return time.time() - start, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark flattening nested inner hits into result rows')
+    parser.add_argument("--hits", help="Number of synthetic hits", type=int, default=2)
+    parser.add_argument("--transcripts", help="CSQ_nested inner hits per hit", type=int, default=50)
+    parser.add_argument("--samples", help="sample inner hits per hit", type=int, default=200)
+    parser.add_argument("--limit_results", help="Stop at the 400 row table size like the search page does", action="store_true")
+    parser.add_argument("--baseline", help="core/utils.py from before core/flatten.py, to compare speed and output", required=False)
+    args = parser.parse_args()
+
+    results = make_results(args.hits, args.transcripts, args.samples)
+    print("%d hits of %d transcripts x %d samples" % (args.hits, args.transcripts, args.samples))
+
+    flatten_time, rows = run_flatten(copy.deepcopy(results), args.limit_results, 400)
+    print("streaming flattener: %d rows in %.3f seconds, %.0f rows/sec" % (len(rows), flatten_time, len(rows) / max(flatten_time, 1e-9)))
+
+    if args.baseline:
+        baseline_time, baseline_rows = run_baseline(load_parser_class(args.baseline), copy.deepcopy(results), args.limit_results)
+        print("baseline:            %d rows in %.3f seconds, %.0f rows/sec" % (len(baseline_rows), baseline_time, len(baseline_rows) / max(baseline_time, 1e-9)))
+        print("speedup: %.1fx" % (baseline_time / max(flatten_time, 1e-9)))
+
+        if baseline_rows != rows:
+            print("Outputs differ")
+            sys.exit(1)
+        print("Outputs are identical")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Micro-benchmark for the compiled VCF field parsing plan used by load_vcf.py.
+
+Parses every variant of a vcf file into documents and reports variants/sec.
+With --baseline, the same records are also parsed with parse_info_fields,
+parse_sample_info and process_line_data taken from an older load_vcf.py, and
+both outputs are compared. Run it from the repository root, e.g.
+
+    git show <commit>:utils/load_vcf.py > /tmp/load_vcf_before.py
+    python utils/benchmark_vcf_field_plan.py --baseline /tmp/load_vcf_before.py
+"""
+import argparse
+import ast
+import gzip
+import io
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+
+from vcf_field_plan import VcfFieldPlan, EXCLUDED_FIELDS, COHORT_SPECIFIC_FIELDS
+
+LOAD_VCF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_vcf.py')
+LEGACY_FUNCTIONS = ['parse_info_fields', 'parse_sample_info', 'process_line_data']
+
+
+def load_functions(source_file, names, namespace):
+    """Execute only the named top level functions of a script that cannot be imported."""
+    with open(source_file) as fp:
+        tree = ast.parse(fp.read(), source_file)
+
+    functions = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in names]
+    missing = set(names) - {node.name for node in functions}
+    if missing:
+        raise ValueError("%s does not define %s" % (source_file, ', '.join(sorted(missing))))
+
+    exec(compile(ast.Module(body=functions, type_ignores=[]), source_file, 'exec'), namespace)
+    return namespace
+
+
+class DocumentBuffer(io.StringIO):
+    """In-memory spool file; older process_line_data versions json.dump into it, newer ones call add()."""
+
+    def add(self, source):
+        self.write(json.dumps({"_index": 'benchmark', "_source": source}, ensure_ascii=True) + "\n")
+
+
+def read_variant_lines(vcf):
+    with gzip.open(vcf, 'rt', encoding='latin1') as fp:
+        return [line for line in fp if not line.startswith('#')]
+
+
+def run_plan(variant_lines, vcf_info, annot, ped_info):
+    out = DocumentBuffer()
+    log = io.StringIO()
+
+    start = time.time()
+    plan = VcfFieldPlan(vcf_info, annot, EXCLUDED_FIELDS, COHORT_SPECIFIC_FIELDS, ped_info)
+    for line in variant_lines:
+        out.add(plan.parse_record(line, log))
+
+    return time.time() - start, out.getvalue()
+
+
+def run_baseline(baseline, variant_lines, vcf_info, annot, ped_info):
+    namespace = {
+        'annot': annot, 'excluded_list': list(EXCLUDED_FIELDS), 'cohort_specific': list(COHORT_SPECIFIC_FIELDS),
+        'ped': ped_info is not None, 'index_name': 'benchmark',
+        'json': json, 're': re, 'math': math, 'OrderedDict': OrderedDict,
+    }
+    load_functions(baseline, LEGACY_FUNCTIONS, namespace)
+
+    vcf_info = dict(vcf_info)
+    if ped_info is not None:
+        vcf_info['ped_info'] = ped_info
+
+    out = DocumentBuffer()
+    log = io.StringIO()
+
+    start = time.time()
+    namespace['process_line_data'](variant_lines, log, out, vcf_info)
+
+    return time.time() - start, out.getvalue()
+
+
+def compare_outputs(baseline_output, plan_output):
+    baseline_docs = baseline_output.splitlines()
+    plan_docs = plan_output.splitlines()
+    if len(baseline_docs) != len(plan_docs):
+        return "different number of documents: %d vs %d" % (len(baseline_docs), len(plan_docs))
+
+    for i, (before, after) in enumerate(zip(baseline_docs, plan_docs)):
+        if json.loads(before)['_source'] != json.loads(after)['_source']:
+            return "document %d differs:\n%s\n%s" % (i + 1, before, after)
+
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parsing vcf records into Elasticsearch documents')
+    parser.add_argument("--vcf", help="bgzipped vcf file", default='test_data/test_4families_annovar_trimmed.vcf.gz')
+    parser.add_argument("--vcf_info", help="vcf_info json written by load_vcf.py for the same vcf", default='config/test_4families_annovar_trimmed_vcf_info.json')
+    parser.add_argument("--annot", help="'annovar' or 'vep'", default='annovar')
+    parser.add_argument("--ped", help="Pedigree file, adds the family fields to every sample", required=False)
+    parser.add_argument("--baseline", help="load_vcf.py from before the parsing plan, to compare speed and output", required=False)
+    parser.add_argument("--repeat", help="Number of timed runs, the fastest one is reported", type=int, default=3)
+    args = parser.parse_args()
+
+    with open(args.vcf_info) as fp:
+        vcf_info = json.load(fp)
+
+    ped_info = None
+    if args.ped:
+        ped_info = load_functions(LOAD_VCF, ['process_ped_file'], {'sys': sys})['process_ped_file'](args.ped)
+
+    variant_lines = read_variant_lines(args.vcf)
+    num_variants = len(variant_lines)
+
+    plan_time, plan_output = min(run_plan(variant_lines, vcf_info, args.annot, ped_info) for _ in range(args.repeat))
+    print("compiled plan: %d variants in %.2f seconds, %.0f variants/sec" % (num_variants, plan_time, num_variants / plan_time))
+
+    if args.baseline:
+        baseline_time, baseline_output = min(run_baseline(args.baseline, variant_lines, vcf_info, args.annot, ped_info) for _ in range(args.repeat))
+        print("baseline:      %d variants in %.2f seconds, %.0f variants/sec" % (num_variants, baseline_time, num_variants / baseline_time))
+        print("speedup: %.2fx" % (baseline_time / plan_time))
+
+        difference = compare_outputs(baseline_output, plan_output)
+        if difference:
+            print("Outputs differ, %s" % difference)
+            sys.exit(1)
+        print("Outputs are identical")
+
+
+if __name__ == '__main__':
+    main()
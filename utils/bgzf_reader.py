@@ -0,0 +1,142 @@
+import struct
+import zlib
+
+# grabix records one BGZF virtual offset for every GRABIX_CHUNK_SIZE data lines
+GRABIX_CHUNK_SIZE = 10000
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+
+class BgzfReader:
+    """
+    Minimal BGZF reader that seeks to virtual offsets and returns lines as bytes.
+
+    A virtual offset is (compressed block offset << 16) | offset within the
+    uncompressed block, which is what grabix stores in its .gbi index.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = open(filename, 'rb')
+        self.block = b''
+        self.within_block = 0
+        self.next_block_offset = 0
+
+    def close(self):
+        self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _load_block(self, block_offset):
+        self.fp.seek(block_offset)
+        header = self.fp.read(12)
+        if not header:
+            self.block = b''
+            self.within_block = 0
+            return False
+
+        if len(header) < 12 or header[:4] != BGZF_MAGIC:
+            raise ValueError("Invalid BGZF block at offset %d in %s" % (block_offset, self.filename))
+
+        extra_length = struct.unpack('<H', header[10:12])[0]
+        extra = self.fp.read(extra_length)
+
+        block_size = None
+        position = 0
+        while position + 4 <= extra_length:
+            subfield_id = extra[position:position + 2]
+            subfield_length = struct.unpack('<H', extra[position + 2:position + 4])[0]
+            if subfield_id == b'BC' and subfield_length == 2:
+                block_size = struct.unpack('<H', extra[position + 4:position + 6])[0] + 1
+            position += 4 + subfield_length
+
+        if block_size is None:
+            raise ValueError("Missing BGZF block size at offset %d in %s" % (block_offset, self.filename))
+
+        compressed = self.fp.read(block_size - 12 - extra_length)
+        self.block = zlib.decompress(compressed[:-8], -15)
+        self.within_block = 0
+        self.next_block_offset = block_offset + block_size
+
+        return True
+
+    def seek(self, virtual_offset):
+        self._load_block(virtual_offset >> 16)
+        self.within_block = virtual_offset & 0xFFFF
+
+    def readline(self):
+        """Return the next line including its newline, or b'' at end of file."""
+        pieces = []
+        while True:
+            if self.within_block >= len(self.block):
+                # the EOF marker is an empty block, so keep reading until there is data
+                if not self._load_block(self.next_block_offset):
+                    break
+                continue
+
+            newline = self.block.find(b'\n', self.within_block)
+            if newline == -1:
+                pieces.append(self.block[self.within_block:])
+                self.within_block = len(self.block)
+            else:
+                pieces.append(self.block[self.within_block:newline + 1])
+                self.within_block = newline + 1
+                break
+
+        return b''.join(pieces)
+
+
+class GrabixIndex:
+    """Contents of a grabix .gbi file: header end, number of data lines and chunk offsets."""
+
+    def __init__(self, bgzf_file):
+        with open(bgzf_file + '.gbi') as fp:
+            values = [int(line) for line in fp if line.strip()]
+
+        self.header_end = values[0]
+        self.num_lines = values[1]
+        self.chunk_offsets = values[2:]
+
+
+class GrabixReader:
+    """
+    In-process replacement for `grabix grab`. The file and the index are
+    opened once, and every grab() seeks straight to the nearest indexed chunk.
+    Only variant lines are returned; the header is never re-read.
+    """
+
+    def __init__(self, bgzf_file):
+        self.index = GrabixIndex(bgzf_file)
+        self.reader = BgzfReader(bgzf_file)
+
+    @property
+    def num_lines(self):
+        return self.index.num_lines
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def grab(self, from_line, to_line):
+        """Yield data lines from_line..to_line (1-based, inclusive) as bytes without the newline."""
+        from_line_0 = from_line - 1
+        requested_chunk = from_line_0 // GRABIX_CHUNK_SIZE
+        self.reader.seek(self.index.chunk_offsets[requested_chunk])
+
+        for _ in range(from_line_0 - requested_chunk * GRABIX_CHUNK_SIZE):
+            self.reader.readline()
+
+        for _ in range(to_line - from_line + 1):
+            line = self.reader.readline()
+            if not line:
+                break
+            yield line.rstrip(b'\n')
@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+
+# number of ready-to-send bulk bodies allowed to wait in the queue; parsers block when it is full
+BULK_QUEUE_SIZE = 64
+DOCS_PER_BULK_BODY = 1000
+MAX_BULK_BODY_BYTES = 10 * 1024 * 1024
+
+
+class SpoolFileWriter:
+    """Writes one {"_index", "_source"} document per line into a .chunk_N.json file."""
+
+    def __init__(self, filename, index_name):
+        self.index_name = index_name
+        self.fp = open(filename, 'w')
+
+    def add(self, source):
+        # json.dumps uses the C encoder, json.dump into a file falls back to the pure python one
+        self.fp.write(json.dumps({"_index": self.index_name, "_source": source}, ensure_ascii=True) + "\n")
+
+    def close(self):
+        self.fp.close()
+
+
+class BulkQueueWriter:
+    """
+    Serializes documents straight into NDJSON bulk bodies and puts every full
+    body on a bounded queue shared with the indexer threads.
+    """
+
+    def __init__(self, queue, index_name, docs_per_body=DOCS_PER_BULK_BODY, max_body_bytes=MAX_BULK_BODY_BYTES):
+        self.queue = queue
+        self.action_line = json.dumps({"index": {"_index": index_name}}) + "\n"
+        self.docs_per_body = docs_per_body
+        self.max_body_bytes = max_body_bytes
+        self.lines = []
+        self.num_docs = 0
+        self.num_bytes = 0
+
+    def add(self, source):
+        doc_line = json.dumps(source, ensure_ascii=True) + "\n"
+        self.lines.append(self.action_line)
+        self.lines.append(doc_line)
+        self.num_docs += 1
+        self.num_bytes += len(self.action_line) + len(doc_line)
+
+        if self.num_docs >= self.docs_per_body or self.num_bytes >= self.max_body_bytes:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            # blocks while the indexers are behind, which keeps parser memory bounded
+            self.queue.put(''.join(self.lines))
+            self.lines = []
+            self.num_docs = 0
+            self.num_bytes = 0
+
+    def close(self):
+        self.flush()
+
+
+class BulkIndexer:
+    """Pool of threads that ship queued NDJSON bulk bodies to Elasticsearch as they arrive."""
+
+    def __init__(self, es, queue, num_threads, request_timeout=300):
+        self.es = es
+        self.queue = queue
+        self.num_threads = num_threads
+        self.request_timeout = request_timeout
+        self.threads = []
+        self.lock = threading.Lock()
+        self.num_bodies = 0
+        self.num_docs = 0
+        self.num_failed = 0
+        self.errors = []
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        for _ in range(self.num_threads):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Wait until every queued body has been sent, then stop the threads."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+        return time.time() - self.start_time
+
+    def _run(self):
+        while True:
+            body = self.queue.get()
+            if body is None:
+                break
+
+            try:
+                response = self.es.bulk(operations=body, request_timeout=self.request_timeout)
+            except Exception as e:
+                with self.lock:
+                    self.num_bodies += 1
+                    self.num_failed += body.count('\n') // 2
+                    self.errors.append(str(e))
+                continue
+
+            failed = [item['index'] for item in response['items'] if item['index'].get('error')]
+            with self.lock:
+                self.num_bodies += 1
+                self.num_docs += len(response['items']) - len(failed)
+                self.num_failed += len(failed)
+                self.errors.extend(str(item['error']) for item in failed[:5])
+
+    def summary(self):
+        return "indexed %d documents in %d bulk requests, %d failed" % (self.num_docs, self.num_bodies, self.num_failed)
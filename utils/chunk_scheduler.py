@@ -0,0 +1,84 @@
+import os
+import statistics
+
+
+def make_line_chunks(total_lines, chunk_size):
+    """Split data lines 1..total_lines into [start, end] ranges of at most chunk_size lines."""
+    chunks = []
+    line_start = 1
+    while line_start <= total_lines:
+        line_end = min(line_start + chunk_size - 1, total_lines)
+        chunks.append([line_start, line_end])
+        line_start = line_end + 1
+
+    return chunks
+
+
+def make_region_chunks(chr2len, region_size):
+    """Split every contig into tabix regions 'chrom:start-end' of at most region_size bp."""
+    chunks = []
+    for chrom, length in chr2len.items():
+        start = 1
+        while start <= length:
+            end = min(start + region_size - 1, length)
+            chunks.append(chrom + ':' + str(start) + '-' + str(end))
+            start = end + 1
+
+    return chunks
+
+
+def fill_task_queue(task_queue, chunks, num_workers):
+    """Queue every chunk followed by one stop marker (None) per worker."""
+    for chunk in chunks:
+        task_queue.put(chunk)
+    for _ in range(num_workers):
+        task_queue.put(None)
+
+
+class ChunkTimingLog:
+    """Per-worker tab separated log of how long each chunk took to parse."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fp = open(filename, 'w')
+        self.pid = os.getpid()
+
+    def add(self, chunk, num_variants, seconds):
+        if isinstance(chunk, (list, tuple)):
+            chunk = '-'.join(str(val) for val in chunk)
+        self.fp.write("%s\t%s\t%d\t%.3f\n" % (self.pid, chunk, num_variants, seconds))
+
+    def close(self):
+        self.fp.close()
+
+
+def summarize_chunk_timings(timing_files, report_file):
+    """Merge the per-worker timing logs into report_file and print a summary for tuning the chunk size."""
+    rows = []
+    for timing_file in timing_files:
+        if not os.path.exists(timing_file):
+            continue
+        with open(timing_file) as fp:
+            for line in fp:
+                pid, chunk, num_variants, seconds = line.rstrip('\n').split('\t')
+                rows.append((pid, chunk, int(num_variants), float(seconds)))
+        os.remove(timing_file)
+
+    if not rows:
+        return
+
+    with open(report_file, 'w') as fp:
+        fp.write("pid\tchunk\tvariants\tseconds\n")
+        for row in rows:
+            fp.write("%s\t%s\t%d\t%.3f\n" % row)
+
+    seconds = [row[3] for row in rows]
+    busy_time = {}
+    for pid, _, _, chunk_seconds in rows:
+        busy_time[pid] = busy_time.get(pid, 0) + chunk_seconds
+
+    print("Parsed %d chunks, seconds per chunk min/median/max: %.2f/%.2f/%.2f, %.0f variants per second per worker" % (
+        len(rows), min(seconds), statistics.median(seconds), max(seconds),
+        sum(row[2] for row in rows) / max(sum(seconds), 1e-9)))
+    print("Worker busy time min/max: %.1f/%.1f seconds, per chunk timings written to %s" % (
+        min(busy_time.values()), max(busy_time.values()), report_file))
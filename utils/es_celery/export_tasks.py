@@ -0,0 +1,18 @@
+import os
+import sys
+
+import django
+
+from es_celery.celery import app
+
+# the web project, to write exports with its models and Elasticsearch helpers. Appended, so that the
+# scripts of utils/ keep their precedence over the project packages of the same name.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genesysv.settings')
+
+
+@app.task()
+def run_export_job(export_job_id):
+    django.setup()
+    from core.exports import run_export_job
+    return run_export_job(export_job_id)
@@ -11,18 +11,21 @@ import argparse
 from pprint import pprint
 import multiprocessing
 import logging
-import math
 import re
 from pathlib import Path
 from collections import defaultdict
-from collections import OrderedDict
 import json
+import itertools
 from collections import deque
 import elasticsearch
 from collections import deque
 from elasticsearch import helpers
 import time
 from make_gui import make_gui_config, make_gui
+from bgzf_reader import GrabixIndex, GrabixReader, GRABIX_CHUNK_SIZE
+from bulk_pipeline import SpoolFileWriter, BulkQueueWriter, BulkIndexer, BULK_QUEUE_SIZE
+from vcf_field_plan import VcfFieldPlan, EXCLUDED_FIELDS, COHORT_SPECIFIC_FIELDS
+from chunk_scheduler import make_line_chunks, make_region_chunks, fill_task_queue, ChunkTimingLog, summarize_chunk_timings
 from add_mendelian_annotations import *
 import utils
 import sqlite3
@@ -42,6 +45,7 @@ from django.core.exceptions import ValidationError
 from core.models import *
 from core.models import *
 from core.utils import get_values_from_es
+from mendelian.utils import save_pedigree
 
 
 parser = argparse.ArgumentParser(description='Parse vcf file(s) and create ElasticSearch mapping and index from the parsed data')
@@ -58,11 +62,15 @@ required.add_argument("--assembly", help="Reference genome assembly version used
 required.add_argument("--num_cores", help="Number of cpu cores to use. Default to the number of cpu cores of the system", required=False)
 required.add_argument("--ped", help="Pedigree file in the format of '#Family Subject Father  Mother  Sex     Phenotype", required=False)
 required.add_argument("--control_vcf", help="vcf file from control study. Must be compressed with bgzip and indexed with grabix", required=False)
-required.add_argument("--interval_size", help="Genomic interval size (bp) for loading case/control vcf. Default is 5000000. Choose a smaller number if low in physical memory", required=False)
+required.add_argument("--interval_size", help="Genomic interval size (bp) for loading case/control vcf. Default is 1000000. Choose a smaller number if low in physical memory", required=False)
+required.add_argument("--chunk_size", help="Number of variants in each chunk handed out to the parsing processes for a single cohort vcf. Default is 10000", required=False)
+required.add_argument("--mendelian_workers", help="Number of threads annotating Mendelian inheritance in an already indexed dataset (--gui_only). Default is 1", required=False)
 required.add_argument("--webserver_port", help="Port number for webser to explore variant data", required=False)
 parser.add_argument("--debug", help="Run in single CPU mode for debugging purposes", action="store_true")
 parser.add_argument("--cleanup", help="Remove temporary .json files under --tmp_dir after being indexed", action="store_true")
 parser.add_argument("--skip_parsing", help="Skip the parsing process, directly go to the indexing and GUI creating step. Useful when parsing was successful but indexing failed for various reasons", action="store_true")
+parser.add_argument("--spool", help="Write parsed documents to .chunk_N.json files under --tmp_dir and index them after parsing has finished, instead of streaming them to ElasticSearch while parsing. Required if you want to rerun with --skip_parsing", action="store_true")
+parser.add_argument("--sort_index", help="Sort the index on CHROM and POS, so searches with a region filter stop reading a shard once it has a page of hits. Indexing is slower", action="store_true")
 parser.add_argument("--gui_only", help="Only create GUI config. Used in situations where the paring and indexing were finished successfuly, but the final GUI creation failed", action="store_true")
 
 args = parser.parse_args()
@@ -89,19 +97,24 @@ study = args.study_name
 dataset_name = args.dataset_name
 ped = args.ped
 interval_size = args.interval_size
+chunk_size = args.chunk_size
 debug = args.debug
 cleanup = args.cleanup
 skip_parsing = args.skip_parsing
 gui_only = args.gui_only
+sort_index = args.sort_index
+# debug mode parses in the main process before any indexer runs, so it always spools to files
+spool = args.spool or debug
 assembly = args.assembly
+mendelian_workers = int(args.mendelian_workers or 1)
 
 if not assembly in ['hg19', 'hg38', 'GRCh37', 'GRCh38']:
 	print("Invalid assembly value. Supported values are 'hg19|hg38|GRCh37|GRCh38'")
 	sys.exit(2)
 
 
-excluded_list = ['AA', 'ANNOVAR_DATE', 'MQ0', 'DB', 'POSITIVE_TRAIN_SITE', 'NEGATIVE_TRAIN_SITE', 'culprit']
-cohort_specific = ['AC', 'AF', 'AN', 'BaseQRankSum', 'GQ_MEAN', 'GQ_STDDEV', 'HWP', 'MQRankSum', 'NCC', 'MQ', 'ReadPosRankSum', 'QD', 'VQSLOD']
+excluded_list = list(EXCLUDED_FIELDS)
+cohort_specific = list(COHORT_SPECIFIC_FIELDS)
 
 def check_commandline(vcf, control_vcf, annot):
 	# check if valid annotation type is specified
@@ -411,763 +424,168 @@ def process_vcf_data(vcf, number_of_lines_to_read, vcf_info):
 
 	return(vcf_info)
 
-def parse_vcf(vcf, interval, outfile, vcf_info):
-	p = multiprocessing.current_process()
+def open_document_writer(outfile, bulk_queue):
+	if bulk_queue is None:
+		return(SpoolFileWriter(outfile, index_name))
+	else:
+		return(BulkQueueWriter(bulk_queue, index_name))
 
-	# divide interval into smaller chunks to minimize memory footprint
-	chunk_size = 5000
-	start = interval[0]
-	num_variants_processed = 0
+def parse_vcf(vcf, task_queue, outfile, vcf_info, bulk_queue=None):
+	p = multiprocessing.current_process()
 
 	logfile = re.sub('json', 'log', outfile)
 	log = open(logfile, 'w')
 
-	with open(outfile, 'w') as f:
-		while True:
-			if start < interval[1]:
-				end = start + chunk_size - 1
-				if end >= interval[1]:
-					end = interval[1]
-
-				command = ["grabix", "grab", vcf, str(start), str(end)]
-				output = check_output(command)
-				try:
-					output = output.decode('latin1') #ascii')
-				except ValueError:
-					log.write("decoding error: %s, %s\n" % (start, end))
-					start = end + 1
-					continue
-				# remove the header lines from output
-				lines = output.splitlines()
-				variant_lines = lines[vcf_info['num_header_lines']:]
-
-				process_line_data(variant_lines, log, f, vcf_info)
-
-				num_variants_processed += end - start + 1
-
-				print("Pid %s: processed %d variants" % (p.pid, num_variants_processed))
-
-				# update start and end positions
-				start = end + 1
-
-				if start >= interval[1]:
-					break
-
-def parse_info_fields(info_fields, result, log, vcf_info, group = ''):
-	with open('./utils/default_vcf_mappings.json') as f2:
-		patho_dict = json.load(f2)
-
-	p = re.compile(r'^(.*?)\((.*)\)') # for parsing SIFT and PolyPhen predition and score
-	tag_fields = [item for item in info_fields if not '=' in item]
-	for tag in tag_fields:
-		result[tag] = 'Yes'
-
-	tmp = [info for info in info_fields if '=' in info]
-	tmp_dict = {d[0].replace('.', '_'):d[1] for d in [item.split('=') for item in tmp]} # i.e. "Gene.refGene" "GeneDetail.refGene", "Gene.ensGene" "GeneDetail.ensGene"
-	for item in excluded_list:
-		if item in tmp_dict:
-			del tmp_dict[item]
-
-	for key, val in tmp_dict.items():
-		if key not in  vcf_info['info_dict']:
-			log.write("Key not exists: %s" % key)
-			continue
-		if val == '.' and key != 'CSQ':
-			continue
-
-		if key == 'CSQ' and annot == 'vep':
-			# VEP annotation repeated the variant specific features, such as MAF, so move them to globol space.
-			# Only keey gene and consequence related info in the nested structure
-			csq_list = []
-			info_csq = val.split(',')
-
-			for csq in info_csq:
-				csq2	= csq.split('|')
-				csq_dict2 = dict(zip(vcf_info['csq_fields'], csq2)) # map names to values for CSQ annotation sub-fields
-
-				# partition csq_dict2 into global and local space
-				csq_dict2_local = {key:val for key, val in csq_dict2.items() if key in vcf_info['csq_dict_local']}
-				csq_dict2_global = {key:val for key, val in csq_dict2.items() if key in vcf_info['csq_dict_global']}
-
-
-				csq_dict3_local = {}
-
-				for key2, val2 in csq_dict2_local.items():
-					if key2 in ['SIFT', 'PolyPhen']:
-						if val2 == '':
-							continue
-
-						m = p.match(val2)
-						if m:
-							csq_dict3_local[key2 + '_pred'] = m.group(1)
-							csq_dict3_local[key2 + '_score'] = float(m.group(2))
-						else: # empty value or only pred or score are included in vep annotation
-							try:
-								x = float(val2)
-								csq_dict3_local[key2 + '_score'] = x
-							except ValueError:
-								continue
-
-					elif vcf_info['csq_dict_local'][key2]['type'] == 'integer':
-						if val2 == '':
-							csq_dict3_local[key2] = -999
-							continue
-						try:
-							csq_dict3_local[key2] = int(csq_dict2_local[key2])
-						except ValueError:
-							tmp = val2.split('-')
-							try:
-								x = int(tmp[0])
-								csq_dict3_local[key2] = x
-							except ValueError:
-								try:
-									x = int(tmp[1])
-									csq_dict3_local[key2] = x
-								except ValueError:
-									continue
-					elif key2 == 'Consequence':
-						if val2 == '':
-							continue
-
-						tmp = val2.split('&')
-						if len(tmp) > 1:
-							csq_dict3_local[key2] = tmp
-						else:
-							csq_dict3_local[key2] = tmp[0]
-					else:
-						if val2 == '':
-							continue
-						else:
-							csq_dict3_local[key2] = val2
-
-				for key2, val2 in csq_dict2_global.items():
-					if vcf_info['csq_dict_global'][key2]['type'] == 'integer':
-						if val2 == '':
-							continue
-						tmp = [int(item) for item in csq_dict2_global[key2].split('&')]
-						if len(tmp) > 1:
-							result[key2] = tmp
-						else:
-							result[key2] = tmp[0]
-					elif key2 == "AF":
-						continue # skip AF annotation from VEP, as it is in correct	
-					elif vcf_info['csq_dict_global'][key2]['type'] == 'float':
-						if val2 == '':
-							if key2 not in result:
-								result[key2] = -999.99
-						else:
-							if '&.' in val2 or '.&' in val2:
-								val2 = val2.replace('&.', '&-999')
-								val2 = val2.replace('.&', '-999&')
-							tmp = val2.split('&')
-							if len(tmp) > 1:
-								
-								result[key2] = [float(item) for item in tmp]
-							else:
-								result[key2] = float(val2)
-					else:
-						if key2 == 'SOMATIC':
-							continue
-						elif key2 == 'Existing_variation':
-							if val2 == '':
-								continue
-
-							tmp_variants = val2.split('&')
-							cosmic_ids = [item for item in tmp_variants if item.startswith('COSM')]
-							dbsnp_ids = [item for item in tmp_variants if item.startswith('rs')]
-							if len(cosmic_ids) > 0:
-								if len(cosmic_ids) > 1:
-									result['COSMIC_ID'] = cosmic_ids
-								else:
-									result['COSMIC_ID'] = cosmic_ids[0]
-							if len(dbsnp_ids) > 0:
-								if len(dbsnp_ids) > 1:
-									result['dbSNP_ID'] = dbsnp_ids # use array value
-								else:
-									result['dbSNP_ID'] = dbsnp_ids[0] # use scalar value
-						elif key2 in ['CLIN_SIG', 'MAX_AF_POPS']:
-							if val2 == '':
-								continue
-							tmp = val2.split('&')
-							if len(tmp) > 1:
-								result[key2] = tmp
-							else:
-								result[key2] = tmp[0]
-						else:
-							result[key2] = val2
-				csq_list.append(csq_dict3_local)
-
-			result['CSQ_nested'] = csq_list
-		elif key == 'Gene_refGene':
-			if 'x3b' in val:
-				tmp = val.split('\\x3b')
-			else:
-				tmp = val.split(',')
-			try:
-				tmp2 = tmp_dict['GeneDetail_refGene']
-			except KeyError:
-				log.write("KeyError: %s, %s" % (key, val))
-				continue
-			if tmp2 != '.':
-				tmp2 = tmp2.split('\\x3b')
-				if tmp2[0].startswith('dist'):
-					if tmp_dict['Func_refGene'] == 'downstream':
-						result['Upstream_refGene'] = tmp[0]
-						if 'NONE' not in tmp2[0]:
-							result['Distance_to_upstream_refGene'] = int(tmp2[0].replace('dist\\x3d', ''))
-					elif tmp_dict['Func_refGene'] == 'upstream':
-						result['Downstream_refGene'] = tmp[0]
-						if 'NONE' not in tmp2[0]:
-							result['Distance_to_downstream_refGene'] = int(tmp2[0].replace('dist\\x3d', ''))
-					elif tmp_dict['Func_refGene'] in ['intergenic', 'upstream\\x3bdownstream']:
-						result['Upstream_refGene'] = tmp[0]
-						result['Downstream_refGene'] = tmp[1]
-						if 'NONE' not in tmp2[0]:
-							result['Distance_to_upstream_refGene'] = int(tmp2[0].replace('dist\\x3d', ''))
-						if 'NONE' not in tmp2[1]:
-							result['Distance_to_downstream_refGene'] = int(tmp2[1].replace('dist\\x3d', ''))
-				else:
-					if tmp_dict['Func_refGene'] in ['exonic', 'intronic', 'ncRNA_intronic']:
-						tmp = tmp_dict['Gene_refGene'].split('\\x3b')
-						if len(tmp) == 1:
-							result['Gene_refGene'] = tmp[0]
-						else:
-							result['Gene_refGene'] = tmp
-					elif tmp_dict['Func_refGene'] in ['UTR5', 'UTR3', 'splicing', 'ncRNA_splicing']:
-						result['Gene_refGene'] = tmp[0]
-						tmp = tmp_dict['GeneDetail_refGene'].split('\\x3b')
-						if len(tmp) == 1:
-							result['GeneDetail_refGene'] = tmp[0]
-						else:
-							result['GeneDetail_refGene'] = tmp
-		elif key == 'Gene_ensGene':
-			if 'x3b' in val:
-				tmp = val.split('\\x3b')
-			else:
-				tmp = val.split(',')
-
-			tmp2 = tmp_dict['GeneDetail_ensGene']
-			if tmp2 != '.':
-				tmp2 = tmp2.split('\\x3b')
-				if tmp2[0].startswith('dist'):
-					if tmp_dict['Func_ensGene'] == 'downstream':
-						result['Upstream_ensGene'] = tmp[0]
-						if 'NONE' not in tmp2[0]:
-							result['Distance_to_upstream_ensGene'] = int(tmp2[0].replace('dist\\x3d', ''))
-					elif tmp_dict['Func_ensGene'] == 'upstream':
-						result['Downstream_ensGene'] = tmp[0]
-						if 'NONE' not in tmp2[0]:
-							result['Distance_to_downstream_ensGene'] = int(tmp2[0].replace('dist\\x3d', ''))
-					elif tmp_dict['Func_ensGene'] in ['intergenic', 'upstream\\x3bdownstream']:
-						result['Upstream_ensGene'] = tmp[0]
-						result['Downstream_ensGene'] = tmp[1]
-						if 'NONE' not in tmp2[0]:
-							result['Distance_to_upstream_ensGene'] = int(tmp2[0].replace('dist\\x3d', ''))
-						if 'NONE' not in tmp2[1]:
-							result['Distance_to_downstream_ensGene'] = int(tmp2[1].replace('dist\\x3d', ''))
-				else:
-					if tmp_dict['Func_ensGene'] in ['exonic', 'intronic', 'ncRNA_intronic']:
-						tmp = tmp_dict['Gene_ensGene'].split('\\x3b')
-						if len(tmp) == 1:
-							result['Gene_ensGene'] = tmp[0]
-						else:
-							result['Gene_ensGene'] = tmp
-					elif tmp_dict['Func_ensGene'] in ['UTR5', 'UTR3', 'splicing', 'ncRNA_splicing']:
-						result['Gene_ensGene'] = tmp[0]
-						tmp = tmp_dict['GeneDetail_ensGene'].split('\\x3b')
-						if len(tmp) == 1:
-							result['GeneDetail_ensGene'] = tmp[0]
-						else:
-							result['GeneDetail_ensGene'] = tmp
-
-		elif key in ["GeneDetail_refGene", "GeneDetail_ensGene"]:
-			continue
-		elif key == 'AAChange_refGene':
-			aac_list = []
-			aac_dict = {}
-
-			if val == 'UNKNOWN':
-				continue
-			else:
-				val_list = val.split(',')
-				for subval in val_list:
-					gene, refseq, exon, *cdna_aa = subval.split(':')
-					aac_dict['Gene'] = gene
-					aac_dict['RefSeq'] = refseq
-					aac_dict['exon_id_rg'] = exon
-
-					if len(cdna_aa) == 2:
-						aac_dict['cdna_change_rg'] = cdna_aa[0]
-						aac_dict['aa_change_rg'] = cdna_aa[1]
-					else:
-						continue
-					aac_list.append(aac_dict)
-
-			result[key] = aac_list
-		elif key == 'AAChange_ensGene':
-			aac_list = []
-			aac_dict = {}
-			if val == 'UNKNOWN':
-				continue
-			else:
-				val_list = val.split(',')
-				for subval in val_list:
-					gene, transcript, exon, *cdna_aa = subval.split(':')
-					aac_dict['Ensembl_Gene_ID'] = gene
-					aac_dict['Ensembl_Transcript_ID'] = transcript
-					aac_dict['exon_id_eg'] = exon
-					if len(cdna_aa) == 2:
-						aac_dict['cdna_change_eg'] = cdna_aa[0]
-						aac_dict['aa_change_eg'] = cdna_aa[1]
-					else:
-						continue
-
-					aac_list.append(aac_dict)
-			result[key] = aac_list
-
-		elif vcf_info['info_dict'][key]['type'] == 'integer':
-			if key == 'CIPOS' or key == 'CIEND':
-				if key in cohort_specific:
-					result[key + group] = val # keep as is (i.e. string type)
-				else:
-					result[key] = val
-			else:
-				if key == 'FS':
-					result[key + group] = val # keep FS integer string as is
-				else:
-					try:
-						result[key + group] = int(val)
-						if math.isnan(int(val)):
-							if key in cohort_specific:
-								result[key + group] = -999
-							else:
-								result[key] = -999
-					except ValueError:
-						log.write("Interger parsing problem: %s, %s\n" % (key, val))
-						continue
-
-		elif vcf_info['info_dict'][key]['type'] == 'float':
-			try:
-				x = float(val)
-				if math.isnan(x):
-					if key in cohort_specific:
-						result[key + group] = -999.99
-					else:
-						result[key] = -999.99
-
-				elif math.isinf(x):
-					if key in cohort_specific:
-						result[key + group] = 999.99
-					else:
-						result[key] = 999.99
-				else:
-					if key in cohort_specific:
-						result[key + group] = x
-					else:
-						result[key] = x
-			except ValueError:
-				if key in cohort_specific:
-					result[key + group] = - 999.99
-				else:
-					result[key] = -999.99
-				#log.write("Parsing problem: %s %s. value is assigned with -999.99\n" % (key, val))
-				continue
-		elif 'snp' in key:
-			if key == 'snp138NonFlagged':
-				result[key] = val
-			else:
-				if 'dbSNP_ID' in result and result['dbSNP_ID'] is not None:
-					continue
-				else:
-					result['dbSNP_ID'] = val
-		elif key == 'dbSNP_ID':
-			continue # skip because Annovar does not populate this field for unknown reason
-		elif key == 'COSMIC_ID':
-			continue # same reason as above
-		elif key == 'ICGC_Id':
-			result['ICGC_ID'] = val
-		elif key == 'ICGC_Occurrence':
-			tmp = val.split(',')
-			tmp_list = []
-			for item in tmp:
-				tmp_dict2 = {}
-				tmp2 = item.split('|')
-				tmp_dict2.update({'ICGC_Cancer_Site': tmp2[0]})
-				tmp_dict2.update({'ICGC_Allele_Count': tmp2[1]})
-				tmp_dict2.update({'ICGC_Allele_Number': tmp2[2]})
-				tmp_dict2.update({'ICGC_Allele_Frequency': tmp2[3]})
-				tmp_list.append(tmp_dict2)
-
-			result['ICGC_nested'] = tmp_list
-
-		elif key in ['CLINSIG', 'CLNSIG'] and val != '.':
-			tmp = []
-			tmp_sig = val.split('|')
-			tmp_dbn = tmp_dict['CLNDN'].split('|')
-			tmp_revstat = tmp_dict['CLNREVSTAT'].split('|')
-
-			if len(tmp_sig) > 0:
-				for i in range(len(tmp_sig)):
-					tmp_dict2 = {'CLNSIG': tmp_sig[i]}
-					if tmp_dbn is not None:
-						tmp_dict2.update({'CLNDN': tmp_dbn[i]})
-					if tmp_revstat is not None:
-						tmp_dict2.update({'CLNREVSTAT': tmp_revstat[i]})
-					tmp.append(tmp_dict2)
-
-				result['CLNVAR_nested'] = tmp
-
-		elif key.startswith('CLN'):
-			continue
-		elif key == 'gwasCatalog':
-			val = val.replace('Name\\x3d', '')
-			tmp = [re.sub('^_', '', item) for item in val.split(',')]
-			if len(tmp) > 1:
-				result['gwasCatalog'] = tmp
-			else:
-				result['gwasCatalog'] = tmp[0]
-		elif key in ['tfbsConsSites', 'targetScanS']:
-			tmp = val.split('\\x3b')
-			if len(tmp) == 2:
-				score = re.sub('Score\\\\x3d', '', tmp[0])
-				name = re.sub('Name\\\\x3d', '', tmp[1])
-				result[key + '_Score'] = int(score)
-				result[key + '_Name'] = name
-		elif key == 'wgRna':
-			val = val.replace('Name\\x3d', '')
-			result[key] = val
-		elif key == "GTEx_V6_gene":
-			genes = val.split('|')
-			tissues = tmp_dict["GTEx_V6_tissue"].split('|')
-			if len(genes) > 0:
-				tmp = []
-				for i in range(len(genes)):
-					tmp.append({"GTEx_V6_gene": genes[i], "GTEx_V6_tissue": tissues[i]})
-				result['GTEx_nested'] = tmp
-		elif key == 'GTEx_V6_tissue':
-			continue
-		elif 'cosmic' in key:
-			cosmic_id, occurrence = val.split("\\x3b")
-			cosmic_id = cosmic_id.split('\\x3d')[1]
-			occurrence = occurrence.split('\\x3d')[1]
-
-			tmp = cosmic_id.split(',')
-			if len(tmp) > 1:
-				result['COSMIC_ID'] = tmp
-			else:
-				result['COSMIC_ID'] = tmp[0]
-			tmp = occurrence.split(',')
-			cosmic_list = []
-			for item in tmp:
-				occurrence, cancer_site = item.split('(')
-				cancer_site = cancer_site.replace(')', '')
-				cosmic_list.append({'COSMIC_Occurrence': int(occurrence), 'COSMIC_Cancer_Site': cancer_site})
-			result['COSMIC_nested'] = cosmic_list
-		elif key == 'VT':
-			result['VariantType'] = val # replace with "VariantType"
-		else: # other string type
-			val = val.replace('\\x3d', '=')
-			val = val.replace('\\x3b',';')
-			if key in cohort_specific:
-				result[key + group] = val
-			else:
-				try:
-					result[key] = patho_dict['INFO_FIELDS'][key]['value_mapping'][val]
-				except KeyError:
-					result[key] = val
-					continue
+	writer = open_document_writer(outfile, bulk_queue)
+	timing_log = ChunkTimingLog(re.sub('json', 'timings.tsv', outfile))
+	plan = compile_field_plan(vcf_info)
+	mendelian = open_mendelian_classifier(outfile, bulk_queue)
+	num_variants_processed = 0
 
-	return(result)
+	# keep pulling line ranges from the shared queue until the stop marker, so that a worker that got
+	# light chunks goes on to help with the rest instead of sitting idle
+	with GrabixReader(vcf) as reader:
+		while True:
+			interval = task_queue.get()
+			if interval is None:
+				break
 
-def parse_sample_info(result, format_fields, sample_info, log, vcf_info, group = ''):
-	sample_data_array = []
+			chunk_start = time.time()
+			num_variants = parse_vcf_interval(reader, interval, log, writer, plan, mendelian)
+			timing_log.add(interval, num_variants, time.time() - chunk_start)
 
-	for sample_id, sample_data in sample_info.items():
-		sample_data_dict = {}
+			num_variants_processed += num_variants
+			print("Pid %s: processed %d variants" % (p.pid, num_variants_processed))
 
-		# do not waste time and storage for no GT
-		if sample_data.startswith('.|.') or sample_data.startswith('./.') or sample_data.startswith('0|.') or sample_data.startswith('.|0') or sample_data.startswith('0/.'):
-			continue
-		# skip parsing hom_ref GT if no ped file is specified to save time and disk space
-		if not ped and (sample_data.startswith('0/0') or sample_data.startswith('0|0') or sample_data == '0' or sample_data.startswith('0:')):
-			continue
+	writer.close()
+	timing_log.close()
+	if mendelian is not None:
+		mendelian.close()
 
-		format_fields = format_fields if isinstance(format_fields, list) else [format_fields]
-		tmp = sample_data.split(':')
-		sample_sub_info_dict = dict(zip(format_fields, tmp))
+def parse_vcf_interval(reader, interval, log, writer, plan, mendelian=None):
+	# divide interval into smaller pieces to minimize memory footprint
+	lines_per_batch = 5000
+	num_variants = 0
 
-		# handle comma-delimited numeric values
-		for (key, val) in sample_sub_info_dict.items():
-			if val == '.':
-				continue
-			if key in ['GT', 'PGT', 'PID']:
-				sample_data_dict[key] = val
-			elif ',' in val:
-				sub_items = val.split(',')
-				if key == 'AD':
-					sample_data_dict['AD_ref'], sample_data_dict['AD_alt'], *_ = sub_items
-					sample_data_dict['AD_ref'] = int(sample_data_dict['AD_ref'])
-					sample_data_dict['AD_alt'] = int(sample_data_dict['AD_alt'])
-				elif key == 'PL':
-					sample_data_dict[key] = val
-				else:
-					log.write("Unknown type: %s, %s\n" % (key, val))
-					continue
-			elif key == 'DP':
-				sample_data_dict[key] = int(val)
-			else:
-				if vcf_info['format_dict'][key]['type'] == 'float':
-					sample_data_dict[key] = float(val)
-				elif vcf_info['format_dict'][key]['type'] == 'integer':
-					sample_data_dict[key] = int(val)
-				else:
-					log.write("Unknown type: %s, %s\n" % (key, val))
-					continue
+	lines = reader.grab(interval[0], interval[1])
+	while True:
+		variant_lines = [line.decode('latin1') for line in itertools.islice(lines, lines_per_batch)]
+		if not variant_lines:
+			break
 
-		# add information from ped file
-		if ped and sample_id in  vcf_info['ped_info']:
-			sample_data_dict['Family_ID'] = vcf_info['ped_info'][sample_id]['family']
-			sample_data_dict['Father_ID'] = vcf_info['ped_info'][sample_id]['father']
-			sample_data_dict['Mother_ID'] = vcf_info['ped_info'][sample_id]['mother']
-			sample_data_dict['Sex'] = vcf_info['ped_info'][sample_id]['sex']
-			sample_data_dict['Phenotype'] = vcf_info['ped_info'][sample_id]['phenotype']
-
-			# fields below may not be always available, so only include them if they exist
-			if 'age' in vcf_info['ped_info'][sample_id] and  vcf_info['ped_info'][sample_id]['age'] is not None:
-				sample_data_dict['Age'] = vcf_info['ped_info'][sample_id]['age']
-			if 'affected_sibs_id' in vcf_info['ped_info'][sample_id] and vcf_info['ped_info'][sample_id]['affected_sibs_id'] is not None:
-				sample_data_dict['Affected_Siblings_IDs'] = vcf_info['ped_info'][sample_id]['affected_sibs_id']
-			if 'affected_sibs_age' in vcf_info['ped_info'][sample_id] and  vcf_info['ped_info'][sample_id]['affected_sibs_age'] is not None:
-				sample_data_dict['Affected_Siblings_Ages'] = vcf_info['ped_info'][sample_id]['affected_sibs_age']
-			if 'affected_sibs_sex' in vcf_info['ped_info'][sample_id] and  vcf_info['ped_info'][sample_id]['affected_sibs_sex'] is not None:
-				sample_data_dict['Affected_Siblings_Sex'] = vcf_info['ped_info'][sample_id]['affected_sibs_sex']
-			if 'unaffected_sibs_id' in vcf_info['ped_info'][sample_id] and vcf_info['ped_info'][sample_id]['unaffected_sibs_id'] is not None:
-				sample_data_dict['Unaffected_Siblings_IDs'] = vcf_info['ped_info'][sample_id]['unaffected_sibs_id']
-			if 'unaffected_sibs_age' in vcf_info['ped_info'][sample_id] and vcf_info['ped_info'][sample_id]['unaffected_sibs_age'] is not None:
-				sample_data_dict['Unaffected_Siblings_Ages'] = vcf_info['ped_info'][sample_id]['unaffected_sibs_age']
-			if 'unaffected_sibs_sex' in vcf_info['ped_info'][sample_id] and vcf_info['ped_info'][sample_id]['unaffected_sibs_sex'] is not None:
-				sample_data_dict['Unaffected_Siblings_Sex'] = vcf_info['ped_info'][sample_id]['unaffected_sibs_sex']
-
-			# caculate additional fields
-			father_id = vcf_info['ped_info'][sample_id]['father']
-			if father_id in sample_info:
-				father_data = sample_info[father_id]
-				father_gt = father_data.split(':')[0]
-				sample_data_dict['Father_Genotype'] = father_gt
-
-			mother_id = vcf_info['ped_info'][sample_id]['mother']
-			if mother_id in sample_info:
-				mother_data = sample_info[mother_id]
-				mother_gt = mother_data.split(':')[0]
-				sample_data_dict['Mother_Genotype'] = mother_gt
-
-			if father_id in vcf_info['ped_info']:
-				father_phenotype = vcf_info['ped_info'][father_id]['phenotype']
-			if mother_id in vcf_info['ped_info']:
-				mother_phenotype = vcf_info['ped_info'][mother_id]['phenotype']
-				sample_data_dict['Mother_Phenotype'] = mother_phenotype
-
-			if father_id in vcf_info['ped_info']:
-				father_phenotype = vcf_info['ped_info'][father_id]['phenotype']
-				sample_data_dict['Father_Phenotype'] = father_phenotype
-
-
-			if 'Affected_Siblings_IDs' in sample_data_dict:
-				sib_gts = []
-				for sid in sample_data_dict['Affected_Siblings_IDs'].split(','):
-					if sid == '-9' or sid == 'NA':
-						continue
-					else:
-						sib_data = sample_info[sid]
-						sib_gt = sib_data.split(':')[0]
-						sib_gts.append(sib_gt)
-				if len(sib_gts) > 0:
-					sample_data_dict['Affected_Siblings_Genotypes'] = ','.join(sib_gts)
-
-			if 'Unaffected_Siblings_IDs' in sample_data_dict:
-				sib_gts = []
-				for sid in sample_data_dict['Unaffected_Siblings_IDs'].split(','):
-					if sid == '-9' or sid =='NA':
-						continue
-					else:
-						sib_data = sample_info[sid]
-						sib_gt = sib_data.split(':')[0]
-						sib_gts.append(sib_gt)
-				if len(sib_gts) > 0:
-					sample_data_dict['Unaffected_Siblings_Genotypes'] = ','.join(sib_gts)
+		process_line_data(variant_lines, log, writer, plan, mendelian)
+		num_variants += len(variant_lines)
 
-		sample_data_dict['Sample_ID'] = sample_id
-		if group != '':
-			sample_data_dict['group'] = re.sub('_', '', group)
+	return(num_variants)
 
-		sample_data_array.append(sample_data_dict)
+def compile_field_plan(vcf_info):
+	# compiled once per parsing process, then reused for every record
+	ped_info = vcf_info.get('ped_info') if ped else None
+	return(VcfFieldPlan(vcf_info, annot, excluded_list, cohort_specific, ped_info))
 
-	result['sample'] = sample_data_array
+def open_mendelian_classifier(outfile, bulk_queue):
+	if not ped:
+		return(None)
 
-	return(result)
+	# compound heterozygous candidates are grouped by document number in the spooled files, which streamed documents do not have
+	candidate_file = re.sub('json', 'comphet.tsv', outfile) if bulk_queue is None else None
+	return(MendelianClassifier(annot, assembly, candidate_file))
 
-def process_line_data(variant_lines, log, f, vcf_info):
+def process_line_data(variant_lines, log, writer, plan, mendelian=None):
 	for line in variant_lines:
-		result = OrderedDict()
-		col_data = line.strip().split("\t")
-		data_fixed = dict(zip(vcf_info['col_header'][:7], col_data[:7]))
-		result['Variant'] = "_".join([data_fixed['CHROM'], data_fixed['POS'], data_fixed['REF'][:10], data_fixed['ALT'][:10]])
-
-		# in the first 8 field of vcf format, POS and QUAL are of non-string type, so convert them to the right type
-		data_fixed['POS'] = int(data_fixed['POS'])
-		if data_fixed['QUAL'] == '.':
-			data_fixed['QUAL'] = 100.00
-		else:
-			data_fixed['QUAL'] = float(data_fixed['QUAL'])
-
-		# FIlTER field may contain multiple valuse, so parse them
-		tmp = data_fixed['FILTER'].split(';')
-		if len(tmp) > 1:
-			data_fixed['FILTER'] = tmp
-		else:
-			data_fixed['FILTER'] = tmp[0]
-
-		if data_fixed['ID'] == '.':
-			data_fixed['ID'] = None
-		else:
-			if data_fixed['ID'].startswith('rs'):
-				result['dbSNP_ID'] = data_fixed['ID']
-
-		result.update(data_fixed)
-
-		# get variant type
-		if data_fixed['REF'] in ['G','A','T','C'] and data_fixed['ALT'] in ['G','A','T','C']:
-			result['VariantType'] = 'SNV'
-		else:
-			result['VariantType'] = 'INDEL'
-
-		# parse INFO field
-		info_fields = col_data[7].split(";")
-
-		# parse FORMAT field
-		format_fields = col_data[8].split(":")
-
-		# parse INFO field
-		result = parse_info_fields(info_fields, result, log, vcf_info)
-
-		# parse sample related data
-		sample_info = dict(zip(vcf_info['col_header'][9:], col_data[9:]))
-
-		result = parse_sample_info(result, format_fields, sample_info, log, vcf_info)
-
-		# json.dump({"_index" : index_name, "_type" : '_doc', "_source" : result}, f, ensure_ascii=True)
+		result = plan.parse_record(line, log)
+		if mendelian is not None:
+			mendelian.classify(result)
 		# Removed _type keyword and value for new elasticsearch 8+ compatibility
-		json.dump({"_index" : index_name, "_source" : result}, f, ensure_ascii=True)
-		f.write("\n")
+		writer.add(result)
 
 
-def process_single_cohort(vcf, vcf_info):
+def process_single_cohort(vcf, vcf_info, bulk_queue=None):
 
 	# get the total number of variants in the input vcf
-	out = check_output(["grabix", "size", vcf])
-	total_lines = int(out.decode('latin1').strip())
-
-	# calculate number of variants each cpu core need to process
-	num_lines_per_proc = math.ceil(total_lines/num_cpus)
+	total_lines = GrabixIndex(vcf).num_lines
 
-	# create a intervals list for distributing variants into each of the processes
-	intervals = []
-	line_start = 1
-	line_end = num_lines_per_proc + line_start
-
-	# get the interval list
-	while True:
-		if (line_start < total_lines):
-			line_end = line_start + num_lines_per_proc - 1
-			if line_end >= total_lines:
-				line_end = total_lines
-
-			interval = [line_start, line_end]
-			intervals.append(interval)
-			line_start = line_end + 1
-
-			if (line_end >= total_lines):
-				break
+	# split the variants into small chunks that idle processes pull from a shared queue
+	chunks = make_line_chunks(total_lines, int(chunk_size) if chunk_size else GRABIX_CHUNK_SIZE)
+	num_workers = min(num_cpus, len(chunks))
+	task_queue = multiprocessing.Queue()
 
 	# to be used to hold the process ids for the join() function
 	processes = []
 	output_json = []
+	timing_files = []
 
 	if debug:
-		for intev in intervals: # debug
-			output_file = 'tmp/output_' + str(intev) + '.json'
-			parse_vcf(vcf, intev, output_file, vcf_info)
-			output_json.append(output_file)
+		fill_task_queue(task_queue, chunks, 1)
+		output_file = 'tmp/output_' + os.path.basename(vcf) + '.json'
+		parse_vcf(vcf, task_queue, output_file, vcf_info, bulk_queue)
+		output_json.append(output_file)
+		timing_files.append(re.sub('json', 'timings.tsv', output_file))
 	else:
- 		# dispatch subtasks to each of the processes
-		for i in range(num_cpus):
+		fill_task_queue(task_queue, chunks, num_workers)
+
+ 		# dispatch subtasks to each of the processes, the caller waits for them with wait_for_processes()
+		for i in range(num_workers):
 			output_file = os.path.join(tmp_dir, os.path.basename(vcf) + '.chunk_' + str(i) + '.json')
-			proc = multiprocessing.Process(target=parse_vcf, args=[vcf, intervals[i], output_file, vcf_info])
+			proc = multiprocessing.Process(target=parse_vcf, args=[vcf, task_queue, output_file, vcf_info, bulk_queue])
 			proc.start()
 			processes.append(proc)
-			output_json.append(output_file)
+			timing_files.append(re.sub('json', 'timings.tsv', output_file))
+			if bulk_queue is None:
+				output_json.append(output_file)
+
+	return(processes, output_json, timing_files)
 
-	 	# wait for all the processes to finish
-		for proc in processes:
-			proc.join()
-			print("Process %s finished ..." % proc.pid)
+def create_es_index(es, create_index_script):
+	if es.indices.exists(index=index_name):
+		print("deleting '%s' index..." % index_name)
+		res = es.indices.delete(index = index_name)
+		print("response: '%s'" % res)
 
-	return(output_json)
+	print("creating '%s' index..." % index_name)
+	res = check_output(["bash", create_index_script])
+	print("Response: '%s'" % res.decode('ascii'))
 
-def process_case_control(case_vcf, control_vcf, vcf_info):
+def wait_for_processes(processes):
+	for proc in processes:
+		proc.join()
+		print("Process %s finished ..." % proc.pid)
+
+def process_case_control(case_vcf, control_vcf, vcf_info, bulk_queue=None):
 	batch_size = 1000000 # reduce this number if memory is an issue
 	if interval_size:
-		batch_size = interval_size
+		batch_size = int(interval_size)
+
+	# idle processes pull the next genomic region from a shared queue instead of owning a fixed slice of the genome
+	batch_list = make_region_chunks(vcf_info['chr2len'], batch_size)
+	num_workers = min(num_cpus, len(batch_list))
+	task_queue = multiprocessing.Queue()
 
-	batch_list = []
 	output_json = []
 	processes = []
-
-	for chrom, length in vcf_info['chr2len'].items():
-		start = 1
-		while True:
-			if (start < length):
-				end = start + batch_size - 1
-				batch = chrom + ':' + str(start) + '-' + str(end)
-				if (end >= length):
-					batch = chrom + ':' + str(start) + '-' + str(length)
-
-				batch_list.append(batch)
-
-				start = end + 1
-				if (start >= length):
-					break
-
-	# calculate number of batches each cpu need to process
-	batches_per_cpu = math.ceil(len(batch_list)/num_cpus)
-	batch_start = 0
+	timing_files = []
 
 	if debug:
+		fill_task_queue(task_queue, batch_list[:1], 1)
 		output_file = 'tmp/output_case_control_' + str(batch_list[0]) + '.json'
-		parse_case_control(case_vcf, control_vcf, [batch_list[0]], output_file, vcf_info)
+		parse_case_control(case_vcf, control_vcf, task_queue, 1, output_file, vcf_info, bulk_queue)
 		output_json.append(output_file)
+		timing_files.append(re.sub('json', 'timings.tsv', output_file))
 	else:
-		for i in range(num_cpus):
-			batch_end = batch_start + batches_per_cpu
-			if batch_end > len(batch_list):
-				batch_end = len(batch_list)
+		fill_task_queue(task_queue, batch_list, num_workers)
 
+		for i in range(num_workers):
 			output_file = os.path.join(tmp_dir, os.path.basename(control_vcf) + '.chunk_' + str(i) + '.json')
-			proc = multiprocessing.Process(target=parse_case_control, args=[case_vcf, control_vcf, batch_list[batch_start:batch_end], output_file, vcf_info])
+			proc = multiprocessing.Process(target=parse_case_control, args=[case_vcf, control_vcf, task_queue, len(batch_list), output_file, vcf_info, bulk_queue])
 			proc.start()
 			processes.append(proc)
-			output_json.append(output_file)
-
-			batch_start = batch_end + 1
+			timing_files.append(re.sub('json', 'timings.tsv', output_file))
+			if bulk_queue is None:
+				output_json.append(output_file)
 
-		# wait for all the processes to finish
-		for proc in processes:
-			proc.join()
-			print("Process %s finished ..." % proc.pid)
+	return(processes, output_json, timing_files)
 
-	return(output_json)
-
-def parse_case_control(case_vcf, control_vcf, batch_sub_list, outfile, vcf_info):
+def parse_case_control(case_vcf, control_vcf, task_queue, total_batches, outfile, vcf_info, bulk_queue=None):
 
 	p = multiprocessing.current_process()
 
@@ -1175,116 +593,130 @@ def parse_case_control(case_vcf, control_vcf, batch_sub_list, outfile, vcf_info)
 	log = open(logfile, 'w')
 
 	batch_count = 0
-	total_batches = len(batch_sub_list)
 
-	with open(outfile, 'w') as f:
-		for batch in batch_sub_list:
-			batch_count += 1
-			data_dict = defaultdict()
-			data_dict['_case'] = {}
-			data_dict['_control'] = {}
+	writer = open_document_writer(outfile, bulk_queue)
+	timing_log = ChunkTimingLog(re.sub('json', 'timings.tsv', outfile))
+	plan = compile_field_plan(vcf_info)
+	mendelian = open_mendelian_classifier(outfile, bulk_queue)
+	while True:
+		batch = task_queue.get()
+		if batch is None:
+			break
+
+		batch_count += 1
+		batch_start_time = time.time()
+		data_dict = defaultdict()
+		data_dict['_case'] = {}
+		data_dict['_control'] = {}
+
+ 		# get a chunck of line from each of the vcf files
+		output_case = check_output(["tabix", case_vcf, batch])
+		output_control = check_output(["tabix", control_vcf, batch])
+
+		if len(output_case) + len(output_control) == 0:
+			print("Empty batch %s" % batch)
+			continue
 
-	 		# get a chunck of line from each of the vcf files
-			output_case = check_output(["tabix", case_vcf, batch])
-			output_control = check_output(["tabix", control_vcf, batch])
+		print("Pid %s processing batch  %s, %d processed by this process, %d in total"% (p.pid, batch, batch_count, total_batches))
 
-			if len(output_case) + len(output_control) == 0:
-				print("Empty batch %s" % batch)
-				continue
+		output_case = output_case.decode('latin1')
+		output_control = output_control.decode('latin1')
 
-			print("Pid %s processing batch  %s, %d of %d"% (p.pid, batch, batch_count, total_batches))
+		lines_case = output_case.splitlines()
+		lines_control = output_control.splitlines()
 
-			output_case = output_case.decode('latin1')
-			output_control = output_control.decode('latin1')
+		for line in lines_case:
+			col_data = line.strip().split("\t")
+			v_id = '_'.join([col_data[0], col_data[1], col_data[3], col_data[4]])
+			data_dict['_case'][v_id] = col_data
+		for line in lines_control:
+			col_data = line.strip().split("\t")
+			v_id = '_'.join([col_data[0], col_data[1], col_data[3], col_data[4]])
+			data_dict['_control'][v_id] = col_data
 
-			lines_case = output_case.splitlines()
-			lines_control = output_control.splitlines()
+		result = defaultdict()
+		seen = {}
 
-			for line in lines_case:
-				col_data = line.strip().split("\t")
-				v_id = '_'.join([col_data[0], col_data[1], col_data[3], col_data[4]])
-				data_dict['_case'][v_id] = col_data
-			for line in lines_control:
-				col_data = line.strip().split("\t")
-				v_id = '_'.join([col_data[0], col_data[1], col_data[3], col_data[4]])
-				data_dict['_control'][v_id] = col_data
+		counter = 0
+		for group in ['_case', '_control']:
+			for v_id in data_dict[group]:
+				tmp = {}
+				tmp2 = {}
 
-			result = defaultdict()
-			seen = {}
+				data_fixed = dict(zip(vcf_info['col_header'][:7], data_dict[group][v_id][:7]))
 
-			counter = 0
-			for group in ['_case', '_control']:
-				for v_id in data_dict[group]:
-					tmp = {}
-					tmp2 = {}
 
-					data_fixed = dict(zip(vcf_info['col_header'][:7], data_dict[group][v_id][:7]))
+				if v_id in seen: # alread found in case
+					# parse INFO field
+					info_fields = data_dict[group][v_id][7].split(";")
+					result_info = plan.parse_info_fields(info_fields, tmp, log, group)
+					result[v_id].update(result_info)
 
+					# parse FORMAT field
+					format_fields = data_dict[group][v_id][8].split(":")
 
-					if v_id in seen: # alread found in case
-						# parse INFO field
-						info_fields = data_dict[group][v_id][7].split(";")
-						result_info = parse_info_fields(info_fields, tmp, log, vcf_info, group)
-						result[v_id].update(result_info)
+					# parse sample related data
+					sample_info = dict(zip(vcf_info['col_header'][9:], data_dict[group][v_id][9:]))
+					result_sample = plan.parse_sample_info(tmp2, format_fields, sample_info, log, group=group)
+					result[v_id]['sample'].extend(result_sample['sample'])
 
-						# parse FORMAT field
-						format_fields = data_dict[group][v_id][8].split(":")
+					result[v_id]['QUAL' + group] = float(data_fixed['QUAL'])
+					result[v_id]['FILTER' + group] = data_fixed['FILTER']
+				else:
+					seen[v_id] = True
 
-						# parse sample related data
-						sample_info = dict(zip(vcf_info['col_header'][9:], data_dict[group][v_id][9:]))
-						result_sample = parse_sample_info(tmp2, format_fields, sample_info, log, vcf_info, group=group)
-						result[v_id]['sample'].extend(result_sample['sample'])
+					# make a short format of variant IDs, i.e. keep at most 9 bases for indels
+					variant = '_'.join([data_fixed['CHROM'], data_fixed['POS'], data_fixed['REF'][:10], data_fixed['ALT'][:10]])
 
-						result[v_id]['QUAL' + group] = float(data_fixed['QUAL'])
-						result[v_id]['FILTER' + group] = data_fixed['FILTER']
-					else:
-						seen[v_id] = True
+					result[v_id] = {}
+					result[v_id]['Variant'] = variant
+					result[v_id]['CHROM'] = data_fixed['CHROM']
+					result[v_id]['POS'] = int(data_fixed['POS'])
+					result[v_id]['ID'] = data_fixed['ID']
+					result[v_id]['REF'] = data_fixed['REF']
+					result[v_id]['ALT'] = data_fixed['ALT']
 
-						# make a short format of variant IDs, i.e. keep at most 9 bases for indels
-						variant = '_'.join([data_fixed['CHROM'], data_fixed['POS'], data_fixed['REF'][:10], data_fixed['ALT'][:10]])
+					if data_fixed['ID'].startswith('rs'):
+						result[v_id]['dbSNP_ID'] = data_fixed['ID']
+					else:
+					 	result[v_id]['dbSNP_ID'] = None # boolean filters can not use 'NA'
 
-						result[v_id] = {}
-						result[v_id]['Variant'] = variant
-						result[v_id]['CHROM'] = data_fixed['CHROM']
-						result[v_id]['POS'] = int(data_fixed['POS'])
-						result[v_id]['ID'] = data_fixed['ID']
-						result[v_id]['REF'] = data_fixed['REF']
-						result[v_id]['ALT'] = data_fixed['ALT']
+					# QUAL and FILTER field
+					result[v_id]['QUAL' + group] = float(data_fixed['QUAL'])
+					result[v_id]['FILTER' + group] = data_fixed['FILTER']
 
-						if data_fixed['ID'].startswith('rs'):
-							result[v_id]['dbSNP_ID'] = data_fixed['ID']
-						else:
-						 	result[v_id]['dbSNP_ID'] = None # boolean filters can not use 'NA'
+					if data_fixed['REF'] in ['G','A','T','C'] and data_fixed['ALT'] in ['G','A','T','C']:
+						result[v_id]['VariantType'] = 'SNV'
+					else:
+						result[v_id]['VariantType'] = 'INDEL'
 
-						# QUAL and FILTER field
-						result[v_id]['QUAL' + group] = float(data_fixed['QUAL'])
-						result[v_id]['FILTER' + group] = data_fixed['FILTER']
+					# parse INFO field
+					info_fields = data_dict[group][v_id][7].split(";")
+					result_info = plan.parse_info_fields(info_fields, tmp, log, group)
+					result[v_id].update(result_info)
 
-						if data_fixed['REF'] in ['G','A','T','C'] and data_fixed['ALT'] in ['G','A','T','C']:
-							result[v_id]['VariantType'] = 'SNV'
-						else:
-							result[v_id]['VariantType'] = 'INDEL'
+					# parse FORMAT field
+					format_fields = data_dict[group][v_id][8].split(":")
 
-						# parse INFO field
-						info_fields = data_dict[group][v_id][7].split(";")
-						result_info = parse_info_fields(info_fields, tmp, log, vcf_info, group)
-						result[v_id].update(result_info)
+					# parse sample related data
+					sample_info = dict(zip(vcf_info['col_header'][9:], data_dict[group][v_id][9:]))
+					result_sample = plan.parse_sample_info(tmp2, format_fields, sample_info, log, group=group)
+					result[v_id].update(result_sample)
 
-						# parse FORMAT field
-						format_fields = data_dict[group][v_id][8].split(":")
+		for v_id in result:
+			if mendelian is not None:
+				mendelian.classify(result[v_id])
+			# Changed the dump order not to include doctype, new version of elasticsearch does not use it and causes indexation error.
+			writer.add(result[v_id])
 
-						# parse sample related data
-						sample_info = dict(zip(vcf_info['col_header'][9:], data_dict[group][v_id][9:]))
-						result_sample = parse_sample_info(tmp2, format_fields, sample_info, log, vcf_info, group=group)
-						result[v_id].update(result_sample)
+		timing_log.add(batch, len(result), time.time() - batch_start_time)
 
-			for v_id in result:
-				# json.dump({"_index" : index_name, "_type" : '_doc', "_source": result[v_id]}, f, ensure_ascii=True)
-				# Changed the dump order not to include doctype, new version of elasticsearch does not use it and causes indexation error.
-				json.dump({"_index" : index_name, "_source": result[v_id]}, f, ensure_ascii=True)
-				f.write("\n")
+	print("Pid %s: finished processing %d batches" % (p.pid, batch_count))
 
-		print("Pid %s: finished processing %s, batch %d of %d" % (p.pid, batch, batch_count, total_batches))
+	writer.close()
+	timing_log.close()
+	if mendelian is not None:
+		mendelian.close()
 
 def make_es_mapping(vcf_info):
 	info_dict2 = vcf_info['info_dict']
@@ -1513,6 +945,10 @@ def make_es_mapping(vcf_info):
 		"index.merge.policy.segments_per_tier": 25,
 		"index.merge.policy.max_merged_segment": "10gb"
 	}
+	if sort_index:
+		# the order of core.utils.PAGE_SORT, which the region filter sorts by
+		index_settings["settings"]["index.sort.field"] = ["CHROM", "POS"]
+		index_settings["settings"]["index.sort.order"] = ["asc", "asc"]
 
 	dir_path = os.path.dirname(os.path.realpath(__file__))
 	create_index_script = os.path.join(dir_path,  'scripts', 'create_index_%s_and_put_mapping.sh' % index_name)
@@ -1533,45 +969,9 @@ def make_es_mapping(vcf_info):
 
 def put_mendelian_to_es(es, index_name,  annotation):
 
-	family_dict = get_family_dict(es, index_name)
-	all_start_time = datetime.datetime.now()
-
-	start_time = datetime.datetime.now()
-	print('Starting annotate_autosomal_recessive', start_time)
-	annotate_autosomal_recessive(es, index_name,  family_dict, annotation)
-	print('Finished annotate_autosomal_recessive', int((datetime.datetime.now() - start_time).total_seconds()))
-
-	start_time = datetime.datetime.now()
-	print('Starting annotate_denovo', start_time)
-	annotate_denovo(es, index_name,  family_dict)
-	print('Finished annotate_denovo', int((datetime.datetime.now() - start_time).total_seconds()))
-
-	start_time = datetime.datetime.now()
-	print('Starting annotate_autosomal_dominant', start_time)
-	annotate_autosomal_dominant(es, index_name, family_dict)
-	print('Finished annotate_autosomal_dominant', int((datetime.datetime.now() - start_time).total_seconds()))
-
-	start_time = datetime.datetime.now()
-	print('Starting annotate_x_linked_dominant', start_time)
-	annotate_x_linked_dominant(es, index_name, family_dict)
-	print('Finished annotate_x_linked_dominant', int((datetime.datetime.now() - start_time).total_seconds()))
-
-	start_time = datetime.datetime.now()
-	print('Starting annotate_x_linked_recessive', start_time)
-	annotate_x_linked_recessive(es, index_name, family_dict, annotation)
-	print('Finished annotate_x_linked_recessive', int((datetime.datetime.now() - start_time).total_seconds()))
-
-	start_time = datetime.datetime.now()
-	print('Starting annotate_x_linked_denovo', start_time)
-	annotate_x_linked_denovo(es, index_name,  family_dict)
-	print('Finished annotate_x_linked_denovo', int((datetime.datetime.now() - start_time).total_seconds()))
-
-	start_time = datetime.datetime.now()
-	print('Starting annotate_compound_heterozygous', start_time)
-	annotate_compound_heterozygous(es, index_name,  family_dict, annotation)
-	print('Finished annotate_compound_heterozygous', int((datetime.datetime.now() - start_time).total_seconds()))
-
-	print('Finished annotating all in seconds: ', int((datetime.datetime.now() - all_start_time).total_seconds()))
+	family_dict = get_family_dict_from_ped(process_ped_file(ped))
+	report_file = os.path.join(tmp_dir, os.path.basename(vcf) + '.mendelian_timings.tsv')
+	annotate_mendelian_inheritance(es, index_name, family_dict, annotation, assembly, mendelian_workers, report_file)
 
 
 
@@ -1615,12 +1015,14 @@ if __name__ == '__main__':
         gui_mapping_file = os.path.join("config", index_name + '_gui_config.json')
         with open(gui_mapping_file) as f:
             gui_mapping = json.load(f)
-            make_gui(es, hostname, port, index_name, study, dataset_name, gui_mapping)
+            dataset_obj = make_gui(es, hostname, port, index_name, study, dataset_name, gui_mapping)
     else:
         case_control = False
         if control_vcf:
             case_control = True
 
+        bulk_queue = None
+
         if not skip_parsing:
             check_commandline(vcf, control_vcf, annot)
 
@@ -1649,63 +1051,94 @@ if __name__ == '__main__':
                 ped_info = process_ped_file(ped)
                 vcf_info['ped_info'] = ped_info
 
+            if not spool:
+                # parser processes put ready-to-send bulk bodies on this queue, it blocks them when the indexers fall behind
+                bulk_queue = multiprocessing.Queue(maxsize=BULK_QUEUE_SIZE)
+
             # determine which work flow to choose, i.e. single cohort or case-control analysis
             if control_vcf:
-                output_files = process_case_control(vcf, control_vcf, vcf_info)
+                processes, output_files, timing_files = process_case_control(vcf, control_vcf, vcf_info, bulk_queue)
             else:
-                output_files = process_single_cohort(vcf, vcf_info)
+                processes, output_files, timing_files = process_single_cohort(vcf, vcf_info, bulk_queue)
+
+            # the parser processes already have their own copy of vcf_info, make_es_mapping is free to modify it now
+            create_index_script, mapping_file = make_es_mapping(vcf_info)
+
+            if bulk_queue is not None:
+                create_es_index(es, create_index_script)
+                indexer = BulkIndexer(es, bulk_queue, num_cpus)
+                indexer.start()
+
+            wait_for_processes(processes)
 
             t1 = time.time()
             parsing_time = t1-t0
 
-            print("Finished parsing vcf file in %s seconds, now creating ElasticSearch index ..." % parsing_time)
-
+            summarize_chunk_timings(timing_files, os.path.join(tmp_dir, os.path.basename(vcf) + '.chunk_timings.tsv'))
 
-            create_index_script, mapping_file = make_es_mapping(vcf_info)
+            if bulk_queue is None:
+                print("Finished parsing vcf file in %s seconds, now creating ElasticSearch index ..." % parsing_time)
+            else:
+                print("Finished parsing vcf file in %s seconds, waiting for the remaining documents to be indexed ..." % parsing_time)
 
         else:
 
             for i in range(num_cpus):
                 output_file = os.path.join(tmp_dir, os.path.basename(vcf) + '.chunk_' + str(i) + '.json')
-                output_files.append(output_file)
-
+                # small inputs are parsed by fewer processes than num_cpus
+                if os.path.exists(output_file):
+                    output_files.append(output_file)
 
-        # prepare for elasticsearch
-        if es.indices.exists(index=index_name):
-            print("deleting '%s' index..." % index_name)
-            res = es.indices.delete(index = index_name)
-            print("response: '%s'" % res)
 
-        print("creating '%s' index..." % index_name)
-        res = check_output(["bash", create_index_script])
-        print("Response: '%s'" % res.decode('ascii'))
+        if bulk_queue is None:
+            # index the spooled .chunk_N.json files one by one
+            create_es_index(es, create_index_script)
 
+            # group the compound heterozygous candidates found while parsing, the tags are added as the files are indexed
+            compound_heterozygous = {}
+            if ped:
+                compound_heterozygous = find_compound_heterozygous([re.sub('json', 'comphet.tsv', infile) for infile in output_files])
+
+            for infile in output_files:
+                print("Indexing file %s" % infile)
+                data = []
+                index_start = time.time()
+                docs_to_tag = compound_heterozygous.get(re.sub('json', 'comphet.tsv', infile), {})
+
+                with open(infile, 'r') as fp:
+                    for doc_number, line in enumerate(fp):
+                        tmp = json.loads(line)
+                        if doc_number in docs_to_tag:
+                            tag_compound_heterozygous(tmp['_source'], docs_to_tag[doc_number])
+                        data.append(tmp)
+                        if len(data) % 1000 == 0:
+                            try:
+                                deque(helpers.parallel_bulk(es, data, thread_count=num_cpus, raise_on_exception=False), maxlen=0)
+                                data = []
+                            except ValueError as e:
+                                print("Failed indexing %s" % e)
+                                continue
+                # leftover data
+                try:
+                    deque(helpers.parallel_bulk(es, data, thread_count=num_cpus), maxlen=0)
+                except:
+                    continue
+                # report indexing time
+                index_end = time.time()
+                index_time = index_end - index_start
+                print("Took: %s seconds"% index_time)
+        else:
+            streaming_time = indexer.stop()
+            print("Streaming indexer %s in %s seconds" % (indexer.summary(), streaming_time))
+            for error in indexer.errors[:10]:
+                print("Failed indexing %s" % error)
 
-        for infile in output_files:
-            print("Indexing file %s" % infile)
-            data = []
-            index_start = time.time()
-
-            with open(infile, 'r') as fp:
-                for line in fp:
-                    tmp = json.loads(line)
-                    data.append(tmp)
-                    if len(data) % 1000 == 0:
-                        try:
-                            deque(helpers.parallel_bulk(es, data, thread_count=num_cpus, raise_on_exception=False), maxlen=0)
-                            data = []
-                        except ValueError as e:
-                            print("Failed indexing %s" % e)
-                            continue
-            # leftover data
-            try:
-                deque(helpers.parallel_bulk(es, data, thread_count=num_cpus), maxlen=0)
-            except:
-                continue
-            # report indexing time
-            index_end = time.time()
-            index_time = index_end - index_start
-            print("Took: %s seconds"% index_time)
+            if ped:
+                # the other Mendelian tags were added while parsing, compound heterozygous needs the indexed variants
+                es.indices.refresh(index=index_name)
+                start_time = datetime.datetime.now()
+                annotate_compound_heterozygous(es, index_name, get_family_dict_from_ped(vcf_info['ped_info']), annot)
+                print('Finished annotate_compound_heterozygous', int((datetime.datetime.now() - start_time).total_seconds()))
 
 
         t2 = time.time()
@@ -1719,7 +1152,7 @@ if __name__ == '__main__':
         gui_mapping = make_gui_config(out_vcf_info, mapping_file, index_name,  annot, case_control, ped)
 
 
-        make_gui(es, hostname, port, index_name, study, dataset_name,  gui_mapping)
+        dataset_obj = make_gui(es, hostname, port, index_name, study, dataset_name,  gui_mapping)
 
         print("*"*80+"\n")
         print("Successfully imported VCF file. You can now explore your data at %s:%s" % (hostname, webserver_port))
@@ -1729,8 +1162,13 @@ if __name__ == '__main__':
 
         print("Success, vcf parsing: %s, indexing: %s, GUI creation: %s, VCF: %s\n" % (parsing_time/60, indexing_time/60, gui_time/60, vcf))
 
-    # annotate variants for Mendelian inheritance and insert results back to es index
+    # Mendelian searches resolve families from the database instead of Elasticsearch
     if ped:
+        save_pedigree(dataset_obj, process_ped_file(ped))
+
+    # Mendelian inheritance is annotated while parsing, only an index loaded by an older version needs the
+    # annotations added to the indexed documents
+    if ped and gui_only:
         put_mendelian_to_es(es, index_name,  annot)
 
 
@@ -60,6 +60,7 @@ ES_FILTER_TYPES = ("filter_term",
                    "filter_exists",
                    "must_not_exists",
                    "nested_filter_exists",
+                   "filter_region",
                    )
 
 APP_NAMES = (
@@ -263,6 +264,12 @@ def make_gui_config(vcf_info_file, mapping_file, index_name, annot, case_control
 				gui_mapping_var[key]['filters'][0]['in_line_tooltip'] = "(>=)"
 				gui_mapping_var[key]['filters'][1]['es_filter_type'] = "filter_range_lte"
 				gui_mapping_var[key]['filters'][1]['in_line_tooltip'] = "(<=)"
+				if key == 'POS':
+					gui_mapping_var[key]['filters'].append(copy.deepcopy(gui_mapping_var[key]['filters'][0]))
+					gui_mapping_var[key]['filters'][2]['display_text'] = "Regions"
+					gui_mapping_var[key]['filters'][2]['es_filter_type'] = "filter_region"
+					gui_mapping_var[key]['filters'][2]['widget_type'] = "UploadField"
+					gui_mapping_var[key]['filters'][2]['in_line_tooltip'] = "(chr:start-end lines or a BED file)"
 			elif key == 'Variant':
 				gui_mapping_var[key]['filters'][0]["in_line_tooltip"] = "(e.g. 1_115252204_C_T)"
 			elif key == 'QUAL':
@@ -1117,6 +1124,8 @@ def make_gui(es, hostname, port, index_name, study, dataset,  vcf_gui_mapping):
         for msg in warning_and_skipped_msgs:
             print(msg)
 
+        return dataset_obj
+
 
 
 if __name__ == '__main__':
@@ -0,0 +1,656 @@
+import json
+import math
+import os
+import re
+from collections import OrderedDict
+
+EXCLUDED_FIELDS = ['AA', 'ANNOVAR_DATE', 'MQ0', 'DB', 'POSITIVE_TRAIN_SITE', 'NEGATIVE_TRAIN_SITE', 'culprit']
+COHORT_SPECIFIC_FIELDS = ['AC', 'AF', 'AN', 'BaseQRankSum', 'GQ_MEAN', 'GQ_STDDEV', 'HWP', 'MQRankSum', 'NCC', 'MQ', 'ReadPosRankSum', 'QD', 'VQSLOD']
+
+VCF_MAPPINGS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'default_vcf_mappings.json')
+
+SIFT_POLYPHEN_RE = re.compile(r'^(.*?)\((.*)\)') # for parsing SIFT and PolyPhen predition and score
+NO_CALL_PREFIXES = ('.|.', './.', '0|.', '.|0', '0/.')
+HOM_REF_PREFIXES = ('0/0', '0|0', '0:')
+
+PED_STATIC_FIELDS = [
+    ('Age', 'age'),
+    ('Affected_Siblings_IDs', 'affected_sibs_id'),
+    ('Affected_Siblings_Ages', 'affected_sibs_age'),
+    ('Affected_Siblings_Sex', 'affected_sibs_sex'),
+    ('Unaffected_Siblings_IDs', 'unaffected_sibs_id'),
+    ('Unaffected_Siblings_Ages', 'unaffected_sibs_age'),
+    ('Unaffected_Siblings_Sex', 'unaffected_sibs_sex'),
+]
+
+
+def scalar_or_list(values):
+    if len(values) > 1:
+        return values
+    return values[0]
+
+
+class VcfFieldPlan:
+    """
+    Parsing plan compiled once per vcf_info. Every INFO, CSQ and FORMAT field
+    gets its own converter up front, so parsing a record only looks the field
+    up in a table instead of re-checking names, types and exclusion lists.
+    """
+
+    def __init__(self, vcf_info, annot, excluded_list, cohort_specific, ped_info=None):
+        self.vcf_info = vcf_info
+        self.annot = annot
+        self.excluded_list = list(excluded_list)
+        self.cohort_specific = set(cohort_specific)
+        self.ped_info = ped_info
+        self.col_header = vcf_info['col_header']
+        self.sample_ids = self.col_header[9:]
+
+        with open(VCF_MAPPINGS_FILE) as fp:
+            self.patho_dict = json.load(fp)
+
+        self.info_handlers = {key: self._compile_info_field(key, val.get('type')) for key, val in vcf_info['info_dict'].items()}
+
+        if annot == 'vep' and 'csq_fields' in vcf_info:
+            self.csq_local, self.csq_global = self._compile_csq_fields()
+
+        self.format_handlers = {key: self._compile_format_field(key, val.get('type')) for key, val in vcf_info['format_dict'].items()}
+        self.format_plans = {}
+        self.ped_plans = self._compile_ped_info() if ped_info is not None else {}
+
+    ######## records ########
+
+    def parse_record(self, line, log):
+        """Turn one vcf data line into the document indexed in Elasticsearch."""
+        result = OrderedDict()
+        col_data = line.strip().split("\t")
+        data_fixed = dict(zip(self.col_header[:7], col_data[:7]))
+        result['Variant'] = "_".join([data_fixed['CHROM'], data_fixed['POS'], data_fixed['REF'][:10], data_fixed['ALT'][:10]])
+
+        # in the first 8 field of vcf format, POS and QUAL are of non-string type, so convert them to the right type
+        data_fixed['POS'] = int(data_fixed['POS'])
+        if data_fixed['QUAL'] == '.':
+            data_fixed['QUAL'] = 100.00
+        else:
+            data_fixed['QUAL'] = float(data_fixed['QUAL'])
+
+        # FIlTER field may contain multiple valuse, so parse them
+        data_fixed['FILTER'] = scalar_or_list(data_fixed['FILTER'].split(';'))
+
+        if data_fixed['ID'] == '.':
+            data_fixed['ID'] = None
+        elif data_fixed['ID'].startswith('rs'):
+            result['dbSNP_ID'] = data_fixed['ID']
+
+        result.update(data_fixed)
+
+        # get variant type
+        if data_fixed['REF'] in ['G','A','T','C'] and data_fixed['ALT'] in ['G','A','T','C']:
+            result['VariantType'] = 'SNV'
+        else:
+            result['VariantType'] = 'INDEL'
+
+        result = self.parse_info_fields(col_data[7].split(";"), result, log)
+
+        sample_info = dict(zip(self.sample_ids, col_data[9:]))
+        result = self.parse_sample_info(result, col_data[8], sample_info, log)
+
+        return result
+
+    ######## INFO fields ########
+
+    def parse_info_fields(self, info_fields, result, log, group=''):
+        tmp_dict = {}
+        for item in info_fields:
+            if '=' in item:
+                # i.e. "Gene.refGene" "GeneDetail.refGene", "Gene.ensGene" "GeneDetail.ensGene"
+                pair = item.split('=', 2)
+                tmp_dict[pair[0].replace('.', '_')] = pair[1]
+            else:
+                result[item] = 'Yes'
+
+        for item in self.excluded_list:
+            tmp_dict.pop(item, None)
+
+        info_handlers = self.info_handlers
+        for key, val in tmp_dict.items():
+            handler = info_handlers.get(key)
+            if handler is None:
+                log.write("Key not exists: %s" % key)
+                continue
+            if val == '.' and key != 'CSQ':
+                continue
+
+            handler(val, tmp_dict, result, log, group)
+
+        return result
+
+    def _compile_info_field(self, key, field_type):
+        """Return the converter for one INFO field, picked in the same order as the original if/elif chain."""
+        if key == 'CSQ' and self.annot == 'vep':
+            return self._parse_csq
+        elif key == 'Gene_refGene':
+            return self._gene_handler('refGene')
+        elif key == 'Gene_ensGene':
+            return self._gene_handler('ensGene')
+        elif key in ["GeneDetail_refGene", "GeneDetail_ensGene"]:
+            return skip_field
+        elif key == 'AAChange_refGene':
+            return aachange_handler(key, ['Gene', 'RefSeq', 'exon_id_rg', 'cdna_change_rg', 'aa_change_rg'])
+        elif key == 'AAChange_ensGene':
+            return aachange_handler(key, ['Ensembl_Gene_ID', 'Ensembl_Transcript_ID', 'exon_id_eg', 'cdna_change_eg', 'aa_change_eg'])
+        elif field_type == 'integer':
+            return self._integer_handler(key)
+        elif field_type == 'float':
+            return self._float_handler(key)
+        elif 'snp' in key:
+            if key == 'snp138NonFlagged':
+                return store_as(key)
+            return parse_snp
+        elif key in ['dbSNP_ID', 'COSMIC_ID']:
+            return skip_field # Annovar does not populate these fields for unknown reason
+        elif key == 'ICGC_Id':
+            return store_as('ICGC_ID')
+        elif key == 'ICGC_Occurrence':
+            return parse_icgc_occurrence
+        elif key in ['CLINSIG', 'CLNSIG']:
+            return parse_clinvar
+        elif key.startswith('CLN'):
+            return skip_field
+        elif key == 'gwasCatalog':
+            return parse_gwas_catalog
+        elif key in ['tfbsConsSites', 'targetScanS']:
+            return score_name_handler(key)
+        elif key == 'wgRna':
+            return parse_wgrna
+        elif key == 'GTEx_V6_gene':
+            return parse_gtex
+        elif key == 'GTEx_V6_tissue':
+            return skip_field
+        elif 'cosmic' in key:
+            return parse_cosmic
+        elif key == 'VT':
+            return store_as('VariantType') # replace with "VariantType"
+        else: # other string type
+            return self._string_handler(key)
+
+    def _gene_handler(self, source):
+        gene_key = 'Gene_' + source
+        detail_key = 'GeneDetail_' + source
+        func_key = 'Func_' + source
+
+        def parse_gene(val, tmp_dict, result, log, group):
+            if 'x3b' in val:
+                tmp = val.split('\\x3b')
+            else:
+                tmp = val.split(',')
+            try:
+                tmp2 = tmp_dict[detail_key]
+            except KeyError:
+                log.write("KeyError: %s, %s" % (gene_key, val))
+                return
+            if tmp2 == '.':
+                return
+
+            tmp2 = tmp2.split('\\x3b')
+            func = tmp_dict[func_key]
+            if tmp2[0].startswith('dist'):
+                if func == 'downstream':
+                    result['Upstream_' + source] = tmp[0]
+                    if 'NONE' not in tmp2[0]:
+                        result['Distance_to_upstream_' + source] = int(tmp2[0].replace('dist\\x3d', ''))
+                elif func == 'upstream':
+                    result['Downstream_' + source] = tmp[0]
+                    if 'NONE' not in tmp2[0]:
+                        result['Distance_to_downstream_' + source] = int(tmp2[0].replace('dist\\x3d', ''))
+                elif func in ['intergenic', 'upstream\\x3bdownstream']:
+                    result['Upstream_' + source] = tmp[0]
+                    result['Downstream_' + source] = tmp[1]
+                    if 'NONE' not in tmp2[0]:
+                        result['Distance_to_upstream_' + source] = int(tmp2[0].replace('dist\\x3d', ''))
+                    if 'NONE' not in tmp2[1]:
+                        result['Distance_to_downstream_' + source] = int(tmp2[1].replace('dist\\x3d', ''))
+            else:
+                if func in ['exonic', 'intronic', 'ncRNA_intronic']:
+                    result[gene_key] = scalar_or_list(tmp_dict[gene_key].split('\\x3b'))
+                elif func in ['UTR5', 'UTR3', 'splicing', 'ncRNA_splicing']:
+                    result[gene_key] = tmp[0]
+                    result[detail_key] = scalar_or_list(tmp_dict[detail_key].split('\\x3b'))
+
+        return parse_gene
+
+    def _integer_handler(self, key):
+        if key == 'CIPOS' or key == 'CIEND':
+            # keep as is (i.e. string type)
+            if key in self.cohort_specific:
+                return store_as(key, with_group=True)
+            return store_as(key)
+        elif key == 'FS':
+            return store_as(key, with_group=True) # keep FS integer string as is
+
+        def parse_integer(val, tmp_dict, result, log, group):
+            try:
+                result[key + group] = int(val)
+            except ValueError:
+                log.write("Interger parsing problem: %s, %s\n" % (key, val))
+
+        return parse_integer
+
+    def _float_handler(self, key):
+        cohort_specific = key in self.cohort_specific
+
+        def parse_float(val, tmp_dict, result, log, group):
+            try:
+                x = float(val)
+                if math.isnan(x):
+                    x = -999.99
+                elif math.isinf(x):
+                    x = 999.99
+            except ValueError:
+                x = -999.99
+
+            if cohort_specific:
+                result[key + group] = x
+            else:
+                result[key] = x
+
+        return parse_float
+
+    def _string_handler(self, key):
+        if key in self.cohort_specific:
+            def parse_cohort_string(val, tmp_dict, result, log, group):
+                result[key + group] = val.replace('\\x3d', '=').replace('\\x3b',';')
+            return parse_cohort_string
+
+        value_mapping = self.patho_dict['INFO_FIELDS'].get(key, {}).get('value_mapping', {})
+
+        def parse_string(val, tmp_dict, result, log, group):
+            val = val.replace('\\x3d', '=').replace('\\x3b',';')
+            result[key] = value_mapping.get(val, val)
+
+        return parse_string
+
+    ######## VEP CSQ ########
+
+    def _compile_csq_fields(self):
+        # dict(zip(csq_fields, values)) keeps the first position of a repeated name but its last value
+        positions = {}
+        for i, name in enumerate(self.vcf_info['csq_fields']):
+            positions[name] = i
+
+        csq_dict_local = self.vcf_info['csq_dict_local']
+        csq_dict_global = self.vcf_info['csq_dict_global']
+        csq_local = [(positions[name], csq_local_handler(name, csq_dict_local[name].get('type'))) for name in positions if name in csq_dict_local]
+        csq_global = [(positions[name], csq_global_handler(name, csq_dict_global[name].get('type'))) for name in positions if name in csq_dict_global]
+
+        return csq_local, csq_global
+
+    def _parse_csq(self, val, tmp_dict, result, log, group):
+        # VEP annotation repeated the variant specific features, such as MAF, so move them to globol space.
+        # Only keey gene and consequence related info in the nested structure
+        csq_list = []
+        for csq in val.split(','):
+            csq2 = csq.split('|')
+            num_values = len(csq2)
+
+            csq_dict3_local = {}
+            for position, handler in self.csq_local:
+                if position < num_values:
+                    handler(csq2[position], csq_dict3_local)
+            for position, handler in self.csq_global:
+                if position < num_values:
+                    handler(csq2[position], result)
+
+            csq_list.append(csq_dict3_local)
+
+        result['CSQ_nested'] = csq_list
+
+    ######## FORMAT fields and samples ########
+
+    def _compile_format_field(self, key, field_type):
+        if key in ['GT', 'PGT', 'PID']:
+            def parse_format_string(val, sample_data_dict, log):
+                sample_data_dict[key] = val
+            return parse_format_string
+
+        if key == 'DP':
+            convert = int
+        elif field_type == 'float':
+            convert = float
+        elif field_type == 'integer':
+            convert = int
+        else:
+            convert = None
+
+        def parse_format_value(val, sample_data_dict, log):
+            # handle comma-delimited numeric values
+            if ',' in val:
+                if key == 'AD':
+                    sub_items = val.split(',')
+                    sample_data_dict['AD_ref'] = int(sub_items[0])
+                    sample_data_dict['AD_alt'] = int(sub_items[1])
+                elif key == 'PL':
+                    sample_data_dict[key] = val
+                else:
+                    log.write("Unknown type: %s, %s\n" % (key, val))
+            elif convert is not None:
+                sample_data_dict[key] = convert(val)
+            else:
+                log.write("Unknown type: %s, %s\n" % (key, val))
+
+        return parse_format_value
+
+    def _format_plan(self, format_fields):
+        """Converters for one FORMAT column layout, compiled the first time the layout is seen."""
+        plan = self.format_plans.get(format_fields)
+        if plan is None:
+            plan = []
+            for key in format_fields.split(':'):
+                handler = self.format_handlers.get(key)
+                if handler is None:
+                    handler = unknown_format_handler(key)
+                plan.append((key, handler))
+            self.format_plans[format_fields] = plan
+
+        return plan
+
+    def _compile_ped_info(self):
+        ped_plans = {}
+        for sample_id, ped in self.ped_info.items():
+            static_fields = OrderedDict()
+            static_fields['Family_ID'] = ped['family']
+            static_fields['Father_ID'] = ped['father']
+            static_fields['Mother_ID'] = ped['mother']
+            static_fields['Sex'] = ped['sex']
+            static_fields['Phenotype'] = ped['phenotype']
+
+            # fields below may not be always available, so only include them if they exist
+            for field_name, ped_key in PED_STATIC_FIELDS:
+                if ped.get(ped_key) is not None:
+                    static_fields[field_name] = ped[ped_key]
+
+            parent_phenotypes = OrderedDict()
+            if ped['mother'] in self.ped_info:
+                parent_phenotypes['Mother_Phenotype'] = self.ped_info[ped['mother']]['phenotype']
+            if ped['father'] in self.ped_info:
+                parent_phenotypes['Father_Phenotype'] = self.ped_info[ped['father']]['phenotype']
+
+            siblings = []
+            for field_name, ids_field in [('Affected_Siblings_Genotypes', 'Affected_Siblings_IDs'), ('Unaffected_Siblings_Genotypes', 'Unaffected_Siblings_IDs')]:
+                if ids_field in static_fields:
+                    sib_ids = [sid for sid in static_fields[ids_field].split(',') if sid not in ['-9', 'NA']]
+                    siblings.append((field_name, sib_ids))
+
+            ped_plans[sample_id] = (static_fields, ped['father'], ped['mother'], parent_phenotypes, siblings)
+
+        return ped_plans
+
+    def parse_sample_info(self, result, format_fields, sample_info, log, group=''):
+        if isinstance(format_fields, list):
+            format_fields = ':'.join(format_fields)
+        format_plan = self._format_plan(format_fields)
+        skip_hom_ref = self.ped_info is None
+        ped_plans = self.ped_plans
+        group_name = group.replace('_', '')
+
+        sample_data_array = []
+        for sample_id, sample_data in sample_info.items():
+            # do not waste time and storage for no GT
+            if sample_data.startswith(NO_CALL_PREFIXES):
+                continue
+            # skip parsing hom_ref GT if no ped file is specified to save time and disk space
+            if skip_hom_ref and (sample_data.startswith(HOM_REF_PREFIXES) or sample_data == '0'):
+                continue
+
+            sample_data_dict = {}
+            for (key, handler), val in zip(format_plan, sample_data.split(':')):
+                if val != '.':
+                    handler(val, sample_data_dict, log)
+
+            # add information from ped file
+            ped_plan = ped_plans.get(sample_id)
+            if ped_plan is not None:
+                static_fields, father_id, mother_id, parent_phenotypes, siblings = ped_plan
+                sample_data_dict.update(static_fields)
+
+                # caculate additional fields
+                if father_id in sample_info:
+                    sample_data_dict['Father_Genotype'] = sample_info[father_id].split(':')[0]
+                if mother_id in sample_info:
+                    sample_data_dict['Mother_Genotype'] = sample_info[mother_id].split(':')[0]
+
+                sample_data_dict.update(parent_phenotypes)
+
+                for field_name, sib_ids in siblings:
+                    sib_gts = [sample_info[sid].split(':')[0] for sid in sib_ids]
+                    if len(sib_gts) > 0:
+                        sample_data_dict[field_name] = ','.join(sib_gts)
+
+            sample_data_dict['Sample_ID'] = sample_id
+            if group != '':
+                sample_data_dict['group'] = group_name
+
+            sample_data_array.append(sample_data_dict)
+
+        result['sample'] = sample_data_array
+
+        return result
+
+
+######## INFO field converters ########
+
+def skip_field(val, tmp_dict, result, log, group):
+    pass
+
+
+def store_as(name, with_group=False):
+    if with_group:
+        def store_with_group(val, tmp_dict, result, log, group):
+            result[name + group] = val
+        return store_with_group
+
+    def store(val, tmp_dict, result, log, group):
+        result[name] = val
+    return store
+
+
+def aachange_handler(key, names):
+    gene_name, transcript_name, exon_name, cdna_name, aa_name = names
+
+    def parse_aachange(val, tmp_dict, result, log, group):
+        if val == 'UNKNOWN':
+            return
+
+        # a single dict is shared by all transcripts, which is what has always been indexed for this field
+        aac_list = []
+        aac_dict = {}
+        for subval in val.split(','):
+            gene, transcript, exon, *cdna_aa = subval.split(':')
+            aac_dict[gene_name] = gene
+            aac_dict[transcript_name] = transcript
+            aac_dict[exon_name] = exon
+            if len(cdna_aa) != 2:
+                continue
+            aac_dict[cdna_name] = cdna_aa[0]
+            aac_dict[aa_name] = cdna_aa[1]
+            aac_list.append(aac_dict)
+
+        result[key] = aac_list
+
+    return parse_aachange
+
+
+def parse_snp(val, tmp_dict, result, log, group):
+    if result.get('dbSNP_ID') is None:
+        result['dbSNP_ID'] = val
+
+
+def parse_icgc_occurrence(val, tmp_dict, result, log, group):
+    tmp_list = []
+    for item in val.split(','):
+        tmp2 = item.split('|')
+        tmp_list.append({
+            'ICGC_Cancer_Site': tmp2[0],
+            'ICGC_Allele_Count': tmp2[1],
+            'ICGC_Allele_Number': tmp2[2],
+            'ICGC_Allele_Frequency': tmp2[3],
+        })
+
+    result['ICGC_nested'] = tmp_list
+
+
+def parse_clinvar(val, tmp_dict, result, log, group):
+    tmp_sig = val.split('|')
+    tmp_dbn = tmp_dict['CLNDN'].split('|')
+    tmp_revstat = tmp_dict['CLNREVSTAT'].split('|')
+
+    result['CLNVAR_nested'] = [{'CLNSIG': tmp_sig[i], 'CLNDN': tmp_dbn[i], 'CLNREVSTAT': tmp_revstat[i]} for i in range(len(tmp_sig))]
+
+
+def parse_gwas_catalog(val, tmp_dict, result, log, group):
+    val = val.replace('Name\\x3d', '')
+    result['gwasCatalog'] = scalar_or_list([item[1:] if item.startswith('_') else item for item in val.split(',')])
+
+
+def score_name_handler(key):
+    def parse_score_name(val, tmp_dict, result, log, group):
+        tmp = val.split('\\x3b')
+        if len(tmp) == 2:
+            result[key + '_Score'] = int(tmp[0].replace('Score\\x3d', ''))
+            result[key + '_Name'] = tmp[1].replace('Name\\x3d', '')
+
+    return parse_score_name
+
+
+def parse_wgrna(val, tmp_dict, result, log, group):
+    result['wgRna'] = val.replace('Name\\x3d', '')
+
+
+def parse_gtex(val, tmp_dict, result, log, group):
+    genes = val.split('|')
+    tissues = tmp_dict["GTEx_V6_tissue"].split('|')
+    result['GTEx_nested'] = [{"GTEx_V6_gene": genes[i], "GTEx_V6_tissue": tissues[i]} for i in range(len(genes))]
+
+
+def parse_cosmic(val, tmp_dict, result, log, group):
+    cosmic_id, occurrence = val.split("\\x3b")
+    cosmic_id = cosmic_id.split('\\x3d')[1]
+    occurrence = occurrence.split('\\x3d')[1]
+
+    result['COSMIC_ID'] = scalar_or_list(cosmic_id.split(','))
+    cosmic_list = []
+    for item in occurrence.split(','):
+        count, cancer_site = item.split('(')
+        cosmic_list.append({'COSMIC_Occurrence': int(count), 'COSMIC_Cancer_Site': cancer_site.replace(')', '')})
+    result['COSMIC_nested'] = cosmic_list
+
+
+######## CSQ sub-field converters ########
+
+def csq_local_handler(key, field_type):
+    if key in ['SIFT', 'PolyPhen']:
+        def parse_prediction(val, csq_local):
+            if val == '':
+                return
+            m = SIFT_POLYPHEN_RE.match(val)
+            if m:
+                csq_local[key + '_pred'] = m.group(1)
+                csq_local[key + '_score'] = float(m.group(2))
+            else: # empty value or only pred or score are included in vep annotation
+                try:
+                    csq_local[key + '_score'] = float(val)
+                except ValueError:
+                    pass
+        return parse_prediction
+
+    elif field_type == 'integer':
+        def parse_integer(val, csq_local):
+            if val == '':
+                csq_local[key] = -999
+                return
+            try:
+                csq_local[key] = int(val)
+            except ValueError:
+                # ranges such as protein positions "12-13", keep the first number available
+                tmp = val.split('-')
+                try:
+                    csq_local[key] = int(tmp[0])
+                except ValueError:
+                    try:
+                        csq_local[key] = int(tmp[1])
+                    except ValueError:
+                        pass
+        return parse_integer
+
+    elif key == 'Consequence':
+        def parse_consequence(val, csq_local):
+            if val != '':
+                csq_local[key] = scalar_or_list(val.split('&'))
+        return parse_consequence
+
+    def parse_string(val, csq_local):
+        if val != '':
+            csq_local[key] = val
+    return parse_string
+
+
+def csq_global_handler(key, field_type):
+    if field_type == 'integer':
+        def parse_integer(val, result):
+            if val != '':
+                result[key] = scalar_or_list([int(item) for item in val.split('&')])
+        return parse_integer
+
+    elif key == 'AF':
+        return skip_csq_field # skip AF annotation from VEP, as it is in correct
+
+    elif field_type == 'float':
+        def parse_float(val, result):
+            if val == '':
+                if key not in result:
+                    result[key] = -999.99
+            else:
+                if '&.' in val or '.&' in val:
+                    val = val.replace('&.', '&-999').replace('.&', '-999&')
+                tmp = val.split('&')
+                if len(tmp) > 1:
+                    result[key] = [float(item) for item in tmp]
+                else:
+                    result[key] = float(val)
+        return parse_float
+
+    elif key == 'SOMATIC':
+        return skip_csq_field
+
+    elif key == 'Existing_variation':
+        def parse_existing_variation(val, result):
+            if val == '':
+                return
+            tmp_variants = val.split('&')
+            cosmic_ids = [item for item in tmp_variants if item.startswith('COSM')]
+            dbsnp_ids = [item for item in tmp_variants if item.startswith('rs')]
+            if len(cosmic_ids) > 0:
+                result['COSMIC_ID'] = scalar_or_list(cosmic_ids)
+            if len(dbsnp_ids) > 0:
+                result['dbSNP_ID'] = scalar_or_list(dbsnp_ids)
+        return parse_existing_variation
+
+    elif key in ['CLIN_SIG', 'MAX_AF_POPS']:
+        def parse_list(val, result):
+            if val != '':
+                result[key] = scalar_or_list(val.split('&'))
+        return parse_list
+
+    def parse_string(val, result):
+        result[key] = val
+    return parse_string
+
+
+def skip_csq_field(val, target):
+    pass
+
+
+def unknown_format_handler(key):
+    def parse_unknown(val, sample_data_dict, log):
+        log.write("Unknown type: %s, %s\n" % (key, val))
+    return parse_unknown